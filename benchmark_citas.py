@@ -0,0 +1,222 @@
+"""Benchmark de latencia de proceso_completo_final_actualizado contra la réplica local.
+
+Levanta replica_widget.py en segundo plano, recorre el flujo completo N veces por variante
+(widget en la página y dentro de un iframe), con el atajo por la API del widget activado y
+desactivado, y reporta la latencia de cada paso y de punta a punta (mediana, p95, máximo).
+Cada paso cuenta solo su tiempo propio (sin el de los pasos medidos que llama), así las filas
+suman como mucho el proceso y lo que queda fuera cae en "otros". Estadísticas, cachés, métricas, trazas e historiales se
+guardan en un directorio temporal para no mezclar la réplica con los datos del sitio real, y
+el flujo nunca navega a las URLs alternativas del sitio real.
+
+Uso:
+    python benchmark_citas.py --repeticiones 10 --retraso-busqueda 1500 --json resultados.json
+    python benchmark_citas.py --modos-api clasico   # solo el flujo por clics
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from selenium.webdriver.support.ui import WebDriverWait
+
+import formulario_cita
+import replica_widget
+
+logger = logging.getLogger(__name__)
+
+# Pasos que se cronometran; conducir_widget y proceso_seleccion_profesional llaman a otros pasos
+# medidos, por eso cada uno acumula solo su tiempo propio
+pasos_medidos = [
+    ("carga", "esperar_carga_completa_mejorada"),
+    ("iframe", "cambiar_a_iframe_formulario"),
+    ("api", "conducir_widget"),
+    ("abrir_servicios", "abrir_dropdown_con_interaccion_previa"),
+    ("servicio", "seleccionar_cardiologia_actualizado"),
+    ("busqueda", "hacer_click_boton_busqueda"),
+    ("seccion_grupos", "esperar_seccion_grupos"),
+    ("abrir_grupos", "abrir_dropdown_grupos"),
+    ("ciudad", "seleccionar_medellin"),
+    ("verificar_ciudad", "verificar_seleccion_grupo"),
+    ("profesional", "proceso_seleccion_profesional"),
+]
+
+def cronometrar(nombre_paso, funcion, tiempos, pila):
+    """Envuelve una función del flujo para sumar su tiempo propio en tiempos[nombre_paso].
+    
+    `pila` guarda, por cada paso en curso, el tiempo de los pasos medidos anidados en él; al
+    terminar se descuenta, así una llamada anidada no se cuenta dos veces.
+    """
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        pila.append(0.0)
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            duracion = time.perf_counter() - inicio
+            anidado = pila.pop()
+            if pila:
+                pila[-1] += duracion
+            tiempos[nombre_paso] = tiempos.get(nombre_paso, 0.0) + duracion - anidado
+    return envoltura
+
+def instalar_cronometros(tiempos):
+    """Reemplaza los pasos del módulo por versiones cronometradas; devuelve los originales"""
+    originales = {}
+    pila = []
+    for nombre_paso, nombre_funcion in pasos_medidos:
+        originales[nombre_funcion] = getattr(formulario_cita, nombre_funcion)
+        setattr(formulario_cita, nombre_funcion, cronometrar(nombre_paso, originales[nombre_funcion], tiempos, pila))
+    return originales
+
+def restaurar_funciones(originales):
+    for nombre_funcion, funcion in originales.items():
+        setattr(formulario_cita, nombre_funcion, funcion)
+
+def aislar_datos(directorio):
+    """Redirige los archivos persistentes de formulario_cita a un directorio temporal.
+    
+    También anula intentar_diferentes_urls: si una corrida falla, el flujo no debe salir de la
+    réplica hacia el sitio real.
+    """
+    formulario_cita.archivo_estadisticas = os.path.join(directorio, "estadisticas_estrategias.json")
+    formulario_cita.archivo_cache_iframe = os.path.join(directorio, "cache_iframe.json")
+    formulario_cita.directorio_fallos = os.path.join(directorio, "fallos")
+    formulario_cita.archivo_catalogo = os.path.join(directorio, "catalogo_servicios.json")
+    formulario_cita.archivo_metricas = os.path.join(directorio, "metricas_pasos")
+    formulario_cita.directorio_trazas = os.path.join(directorio, "trazas")
+    formulario_cita.archivo_historial_intentos = os.path.join(directorio, "intentos.jsonl")
+    formulario_cita.archivo_historial_cupos = os.path.join(directorio, "historial_cupos.sqlite3")
+    formulario_cita.intentar_diferentes_urls = lambda driver, wait: False
+    formulario_cita.estadisticas_estrategias = None
+    formulario_cita.cache_iframe = None
+    formulario_cita.catalogo_servicios = None
+
+def percentil(valores, p):
+    """Percentil por el método del rango más cercano (suficiente para pocas muestras)"""
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados) + 0.5) - 1))]
+
+def resumir(valores):
+    """Resumen en milisegundos de una lista de duraciones en segundos"""
+    ms = [valor * 1000 for valor in valores]
+    return {
+        "n": len(ms),
+        "media_ms": round(statistics.fmean(ms), 1),
+        "p50_ms": round(statistics.median(ms), 1),
+        "p95_ms": round(percentil(ms, 95), 1),
+        "max_ms": round(max(ms), 1),
+    }
+
+def ejecutar_variante(driver, url, iframe, api, repeticiones, objetivo):
+    """Corre el flujo completo `repeticiones` veces y devuelve las muestras por paso"""
+    muestras = {"navegacion": [], "proceso": [], "total": [], "otros": []}
+    exitos = 0
+    url_variante = f"{url}?iframe={'1' if iframe else '0'}"
+
+    for i in range(repeticiones):
+        tiempos = {}
+        originales = instalar_cronometros(tiempos)
+        modo_api = formulario_cita.modo_api
+        formulario_cita.modo_api = api
+        try:
+            inicio = time.perf_counter()
+            driver.get(url_variante)
+            navegacion = time.perf_counter() - inicio
+
+            wait = WebDriverWait(driver, 90)
+            inicio_proceso = time.perf_counter()
+            resultado = formulario_cita.proceso_completo_final_actualizado(driver, wait, objetivo)
+            proceso = time.perf_counter() - inicio_proceso
+        finally:
+            formulario_cita.modo_api = modo_api
+            restaurar_funciones(originales)
+            driver.switch_to.default_content()
+
+        exitos += bool(resultado)
+        muestras["navegacion"].append(navegacion)
+        muestras["proceso"].append(proceso)
+        muestras["total"].append(navegacion + proceso)
+        muestras["otros"].append(max(0.0, proceso - sum(tiempos.values())))
+        for nombre_paso, duracion in tiempos.items():
+            muestras.setdefault(nombre_paso, []).append(duracion)
+        logger.info(f"  {'iframe' if iframe else 'pagina'}/{'api' if api else 'clasico'} #{i + 1}: {(navegacion + proceso) * 1000:.0f} ms "
+                    f"({'✅' if resultado else '❌'})")
+
+    return muestras, exitos
+
+def imprimir_reporte(reporte):
+    orden = ["navegacion"] + [nombre for nombre, _ in pasos_medidos] + ["otros", "proceso", "total"]
+    for variante, datos in reporte["variantes"].items():
+        print()
+        print(f"=== {variante.upper()}: {datos['exitos']}/{datos['repeticiones']} exitosos ===")
+        print(f"{'paso':<18}{'n':>4}{'media':>10}{'p50':>10}{'p95':>10}{'max':>10}")
+        for nombre in orden:
+            if nombre not in datos["pasos"]:
+                continue
+            r = datos["pasos"][nombre]
+            print(f"{nombre:<18}{r['n']:>4}{r['media_ms']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['max_ms']:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del flujo de citas contra la réplica local")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--variantes", default="pagina,iframe", help="pagina, iframe o ambas separadas por coma")
+    parser.add_argument("--modos-api", default="api,clasico",
+                        help="api (conducir_widget), clasico (solo clics) o ambos separados por coma")
+    parser.add_argument("--perfil", default="ligero", help="Perfil del navegador (ligero o completo)")
+    parser.add_argument("--chromedriver", help="Ruta de chromedriver (por defecto la de formulario_cita o Selenium Manager)")
+    parser.add_argument("--cupos", type=int, default=3)
+    parser.add_argument("--json", help="Guardar el reporte en este archivo JSON")
+    parser.add_argument("--detalle", action="store_true", help="Mostrar los logs del flujo")
+    for clave, ms in replica_widget.retrasos_por_defecto.items():
+        parser.add_argument(f"--retraso-{clave}", type=int, default=ms, help=f"Retraso de {clave} en ms")
+    args = parser.parse_args()
+
+    if not args.detalle:
+        formulario_cita.logger.setLevel(logging.WARNING)
+    if args.chromedriver:
+        formulario_cita.ruta_driver = args.chromedriver
+    elif not os.path.exists(formulario_cita.ruta_driver):
+        formulario_cita.ruta_driver = None  # Selenium Manager localiza chromedriver
+
+    retrasos = {clave: getattr(args, f"retraso_{clave}") for clave in replica_widget.retrasos_por_defecto}
+    servidor, url = replica_widget.iniciar_replica_en_hilo(retrasos=retrasos, cupos=args.cupos)
+    logger.info(f"🧪 Réplica en {url} con retrasos {retrasos}")
+
+    driver = formulario_cita.inicializar_driver(args.perfil)
+    if not driver:
+        logger.error("❌ No se pudo inicializar el driver")
+        servidor.shutdown()
+        return
+
+    reporte = {"retrasos_ms": retrasos, "perfil": args.perfil, "variantes": {}}
+    try:
+        with tempfile.TemporaryDirectory(prefix="benchmark_citas_") as directorio:
+            aislar_datos(directorio)
+            for variante in [v.strip() for v in args.variantes.split(",") if v.strip()]:
+                for modo in [m.strip() for m in args.modos_api.split(",") if m.strip()]:
+                    nombre = f"{variante}/{modo}"
+                    logger.info(f"⏱️ Variante '{nombre}' ({args.repeticiones} repeticiones)...")
+                    muestras, exitos = ejecutar_variante(driver, url, variante == "iframe", modo == "api",
+                                                         args.repeticiones, formulario_cita.objetivo_por_defecto)
+                    reporte["variantes"][nombre] = {
+                        "repeticiones": args.repeticiones,
+                        "exitos": exitos,
+                        "pasos": {paso: resumir(valores) for paso, valores in muestras.items() if valores},
+                    }
+    finally:
+        driver.quit()
+        servidor.shutdown()
+
+    imprimir_reporte(reporte)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as archivo:
+            json.dump(reporte, archivo, ensure_ascii=False, indent=2)
+        logger.info(f"💾 Reporte guardado en {args.json}")
+
+if __name__ == "__main__":
+    main()
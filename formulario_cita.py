@@ -4,39 +4,1196 @@ from selenium.webdriver.support.ui import Select, WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver import ChromeOptions
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
 import time
+import json
+import os
+import re
+import sys
+import gzip
+import tempfile
+import threading
+import asyncio
+import functools
+import inspect
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import sqlite3
+import http.client
+import http.cookies
+import urllib.parse
 import logging
 import schedule
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
 from datetime import datetime
 
+try:
+    from lxml import etree, html as lxml_html
+except ImportError:  # Opcional: sin lxml los diagnósticos consultan elemento por elemento al navegador
+    etree = lxml_html = None
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # OPCIONES DEL NAVEGADOR
-options = ChromeOptions()
-options.add_argument("--start-maximized")
-options.add_argument("--disable-blink-features=AutomationControlled")
-options.add_experimental_option("excludeSwitches", ["enable-automation"])
-options.add_experimental_option('useAutomationExtension', False)
+# Perfil "completo": Chrome visible y maximizado (para ver el proceso).
+# Perfil "ligero": headless, sin GPU, extensiones ni throttling de segundo plano, y bloqueando
+# por DevTools las peticiones que no afectan al widget de citas (menos carga y menos memoria).
+perfil_navegador = os.environ.get("CITAS_PERFIL_NAVEGADOR", "completo")
+
+# Patrones para Network.setBlockedURLs (el comodín * admite cualquier texto)
+patrones_bloqueados = [
+    # Imágenes
+    "*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.avif*", "*.svg*", "*.ico*",
+    # Fuentes
+    "*.woff*", "*.ttf*", "*.otf*", "*.eot*", "*fonts.googleapis.com*", "*fonts.gstatic.com*",
+    # Multimedia
+    "*.mp4*", "*.webm*", "*.mp3*", "*.ogg*", "*.wav*", "*youtube.com*", "*ytimg.com*", "*vimeo.com*",
+    # Analítica y publicidad
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*googleadservices.com*",
+    "*facebook.net*", "*facebook.com/tr*", "*hotjar.com*", "*clarity.ms*",
+]
+
+def crear_opciones_navegador(perfil="completo"):
+    """Crea las opciones de Chrome para el perfil indicado ('completo' o 'ligero')"""
+    opciones = ChromeOptions()
+    opciones.add_argument("--disable-blink-features=AutomationControlled")
+    opciones.add_experimental_option("excludeSwitches", ["enable-automation"])
+    opciones.add_experimental_option('useAutomationExtension', False)
+    
+    if perfil == "ligero":
+        opciones.add_argument("--headless=new")
+        opciones.add_argument("--window-size=1366,900")
+        opciones.add_argument("--disable-gpu")
+        opciones.add_argument("--disable-extensions")
+        opciones.add_argument("--disable-background-networking")
+        opciones.add_argument("--disable-background-timer-throttling")
+        opciones.add_argument("--disable-backgrounding-occluded-windows")
+        opciones.add_argument("--disable-renderer-backgrounding")
+        opciones.add_argument("--disable-component-update")
+        opciones.add_argument("--disable-default-apps")
+        opciones.add_argument("--disable-sync")
+        opciones.add_argument("--disable-dev-shm-usage")
+        opciones.add_argument("--no-first-run")
+        opciones.add_argument("--mute-audio")
+        opciones.add_argument("--blink-settings=imagesEnabled=false")
+        # Iframes de otro origen en el mismo proceso: menos memoria y el bloqueo de URLs también los cubre
+        opciones.add_argument("--disable-features=Translate,MediaRouter,OptimizationHints,IsolateOrigins,site-per-process")
+    else:
+        opciones.add_argument("--start-maximized")
+    
+    return opciones
+
+options = crear_opciones_navegador(perfil_navegador)
 
 # UBICACIÓN DE CHROMEDRIVER
 ruta_driver = r"C:\Users\duvan.botero\Downloads\chromedriver-win64\chromedriver-win64\chromedriver.exe"
 
-# VARIABLES GLOBALES PARA EL SCHEDULER
-driver_global = None
-wait_global = None
-contador_intentos = 0
+# LÍMITE DE INTENTOS POR SESIÓN (el estado de cada sesión vive en SesionCitas)
 max_intentos = 100  # Máximo 100 intentos
 
+# MAPEO DE TIPOS DE CONSULTA DE CARDIOLOGÍA SEGÚN EL HTML
+consultas_disponibles = {
+    "primera_vez": {
+        "data_value": "1510", 
+        "text": "890228 - CONSULTA DE PRIMERA VEZ POR ESPECIALISTA EN CARDIOLOGÍA."
+    },
+    "primera_vez_pediatrica": {
+        "data_value": "3443",
+        "text": "890229 - CONSULTA DE PRIMERA VEZ POR ESPECIALISTA EN CARDIOLOGÍA PEDIÁTRICA"
+    },
+    "control": {
+        "data_value": "1511",
+        "text": "890328 - CONSULTA DE CONTROL O DE SEGUIMIENTO POR ESPECIALISTA EN CARDIOLOGÍA."
+    },
+    "control_pediatrica": {
+        "data_value": "3444",
+        "text": "890329 - CONSULTA DE CONTROL O DE SEGUIMIENTO POR ESPECIALISTA EN CARDIOLOGÍA PEDIÁTRICA"
+    }
+}
+
+# OBJETIVO POR DEFECTO (servicio, subconsulta y ciudad que se buscan)
+objetivo_por_defecto = {"servicio": "1450", "nombre_servicio": "CARDIOLOGÍA", "subconsulta": "control", "ciudad": "Medellín"}
+
+# DIRECTORIO PARA DATOS PERSISTENTES (estadísticas, cachés)
+directorio_datos = os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos")
+
+def escribir_atomico(ruta, contenido):
+    """Escribe el archivo completo o no lo toca: temporal propio de este escritor y os.replace.
+    
+    El temporal tiene nombre único, así dos hilos o procesos del pool que guardan a la vez no
+    escriben en el mismo .tmp ni renombran el temporal del otro a medio escribir.
+    """
+    archivo = tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(ruta),
+                                          prefix=os.path.basename(ruta) + ".", suffix=".tmp", delete=False)
+    try:
+        with archivo:
+            archivo.write(contenido)
+        os.replace(archivo.name, ruta)
+    except BaseException:
+        if os.path.exists(archivo.name):
+            os.remove(archivo.name)
+        raise
+
+# LÍNEA DE TIEMPO POR INTENTO (TRACE EVENTS)
+# Cada intento se guarda en datos/trazas/ como JSON de trace events (se abre en
+# https://ui.perfetto.dev o chrome://tracing) con tramos anidados para los proceso_*, los pasos
+# medidos, las cascadas de selectores y estrategias, cada comando WebDriver y cada pausa o espera.
+# Se conservan las últimas max_trazas_guardadas; CITAS_TRAZAS=0 lo desactiva.
+trazas_activas = os.environ.get("CITAS_TRAZAS", "1") != "0"
+directorio_trazas = os.path.join(directorio_datos, "trazas")
+max_trazas_guardadas = 50
+# Eventos de la traza en curso en este hilo, o None si no se está trazando
+contexto_traza = threading.local()
+
+def ahora_us():
+    """Reloj monotónico en microsegundos (unidad de los trace events)"""
+    return time.perf_counter_ns() // 1000
+
+def traza_activa():
+    return getattr(contexto_traza, "eventos", None) is not None
+
+def agregar_evento_traza(nombre, categoria, inicio_us, duracion_us, args=None):
+    """Agrega un evento completo ('X') a la traza del hilo, si hay una en curso"""
+    eventos = getattr(contexto_traza, "eventos", None)
+    if eventos is None:
+        return
+    evento = {"name": nombre, "cat": categoria, "ph": "X", "ts": inicio_us, "dur": duracion_us,
+              "pid": os.getpid(), "tid": threading.get_ident()}
+    if args:
+        evento["args"] = args
+    eventos.append(evento)
+
+@contextmanager
+def tramo(nombre, categoria, **args):
+    """Registra el bloque como tramo de la traza; el bloque puede añadir argumentos al dict cedido"""
+    if not traza_activa():
+        yield args
+        return
+    inicio = ahora_us()
+    try:
+        yield args
+    finally:
+        agregar_evento_traza(nombre, categoria, inicio, ahora_us() - inicio, args)
+
+def trazado(funcion):
+    """Decorador: cada llamada a la función es un tramo de la traza"""
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        with tramo(funcion.__name__, "proceso"):
+            return funcion(*args, **kwargs)
+    return envoltura
+
+def instrumentar_driver(driver):
+    """Registra cada comando WebDriver del driver como tramo mientras haya una traza en curso"""
+    ejecutar_original = driver.execute
+    
+    def ejecutar(comando, *args, **kwargs):
+        if not traza_activa():
+            return ejecutar_original(comando, *args, **kwargs)
+        with tramo(comando, "webdriver"):
+            return ejecutar_original(comando, *args, **kwargs)
+    
+    driver.execute = ejecutar
+    return driver
+
+def iniciar_traza():
+    """Empieza a registrar la traza del intento en este hilo"""
+    if trazas_activas:
+        contexto_traza.eventos = []
+
+def terminar_traza(nombre):
+    """Cierra la traza del hilo y la guarda en datos/trazas; devuelve la ruta o None"""
+    eventos = getattr(contexto_traza, "eventos", None)
+    contexto_traza.eventos = None
+    if not eventos:
+        return None
+    
+    metadatos = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": threading.get_ident(),
+                  "args": {"name": nombre}}]
+    ruta = os.path.join(directorio_trazas, f"intento-{nombre}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    try:
+        os.makedirs(directorio_trazas, exist_ok=True)
+        with open(ruta, "w", encoding="utf-8") as archivo:
+            json.dump({"traceEvents": metadatos + eventos, "displayTimeUnit": "ms"}, archivo, ensure_ascii=False)
+        
+        # Conservar solo las trazas más recientes
+        trazas = sorted(
+            (os.path.join(directorio_trazas, nombre_archivo) for nombre_archivo in os.listdir(directorio_trazas)
+             if nombre_archivo.endswith(".json")),
+            key=os.path.getmtime
+        )
+        for antigua in trazas[:-max_trazas_guardadas]:
+            os.remove(antigua)
+    except Exception as e:
+        logger.warning(f"No se pudo guardar la traza del intento: {e}")
+        return None
+    return ruta
+
+# CONTABILIDAD DE PAUSAS Y ESPERAS
+# Toda pausa deliberada pasa por pausar() y toda espera al sitio (motor de esperas, WebDriverWait)
+# por contabilizar(); ambas se registran por sitio de llamada ("funcion:línea" del flujo, sin
+# contar las funciones del propio motor). Al final de cada intento se reporta cuánto fue pausa,
+# cuánto espera al sitio y cuánto trabajo activo (comandos WebDriver y Python).
+funciones_motor_esperas = {
+    "sitio_llamada", "contabilizar", "tramo", "pausar", "esperar_hasta", "esperar_condicion_js", "esperar_documento_listo",
+    "esperar_presente", "esperar_visible", "esperar_alguno_visible", "esperar_texto", "esperar_dom_estable",
+    "__enter__", "__exit__", "envoltura",
+}
+# Esperas del intento en curso en este hilo: {(tipo, sitio): [veces, segundos, agotadas]} o None
+contexto_pausas = threading.local()
+totales_pausas_por_sitio = {}  # Acumulado del proceso, mismo formato
+bloqueo_pausas = threading.Lock()
+
+def sitio_llamada():
+    """Primer marco de la pila fuera del motor de esperas, como 'funcion:línea'"""
+    marco = sys._getframe(1)
+    while marco and (marco.f_code.co_name in funciones_motor_esperas or marco.f_code.co_filename.endswith("contextlib.py")):
+        marco = marco.f_back
+    return f"{marco.f_code.co_name}:{marco.f_lineno}" if marco else "desconocido"
+
+def registrar_pausa(tipo, sitio, segundos, agotada=False):
+    """Suma una pausa o espera al intento en curso del hilo y al acumulado del proceso"""
+    registros = [totales_pausas_por_sitio]
+    del_intento = getattr(contexto_pausas, "registro", None)
+    if del_intento is not None:
+        registros.append(del_intento)
+    with bloqueo_pausas:
+        for registro in registros:
+            entrada = registro.setdefault((tipo, sitio), [0, 0.0, 0])
+            entrada[0] += 1
+            entrada[1] += segundos
+            entrada[2] += bool(agotada)
+
+@contextmanager
+def contabilizar(tipo, sitio=None):
+    """Cuenta el bloque como 'pausa' o 'espera' del sitio; el bloque puede marcar estado['agotada']"""
+    sitio = sitio or sitio_llamada()
+    estado = {"agotada": False}
+    inicio = time.monotonic()
+    try:
+        with tramo(f"{tipo} {sitio}", tipo) as args_tramo:
+            yield estado
+            args_tramo["agotada"] = estado["agotada"]
+    finally:
+        registrar_pausa(tipo, sitio, time.monotonic() - inicio, estado["agotada"])
+
+def pausar(segundos, sitio=None):
+    """Única pausa deliberada del programa: duerme y la registra por sitio de llamada"""
+    with contabilizar("pausa", sitio or sitio_llamada()):
+        time.sleep(segundos)
+
+def esperar_hasta(wait, condicion):
+    """wait.until contabilizado como espera al sitio (se marca agotada si vence)"""
+    with contabilizar("espera") as estado:
+        try:
+            return wait.until(condicion)
+        except TimeoutException:
+            estado["agotada"] = True
+            raise
+
+def presupuesto_intento(registro, duracion):
+    """Reparte la duración de un intento entre pausas, esperas al sitio y trabajo activo"""
+    pausas = sum(segundos for (tipo, _), (_, segundos, _) in registro.items() if tipo == "pausa")
+    esperas = sum(segundos for (tipo, _), (_, segundos, _) in registro.items() if tipo == "espera")
+    return {
+        "total_s": round(duracion, 3),
+        "pausas_s": round(pausas, 3),
+        "espera_sitio_s": round(esperas, 3),
+        "activo_s": round(max(0.0, duracion - pausas - esperas), 3),
+        "por_sitio": [
+            {"tipo": tipo, "sitio": sitio, "veces": veces, "segundos": round(segundos, 3), "agotadas": agotadas}
+            for (tipo, sitio), (veces, segundos, agotadas)
+            in sorted(registro.items(), key=lambda item: item[1][1], reverse=True)
+        ],
+    }
+
+def reportar_presupuesto(nombre, presupuesto, max_sitios=8):
+    """Escribe en el log el reparto del intento y los sitios que más tiempo consumieron"""
+    total = presupuesto["total_s"] or 1.0
+    logger.info(
+        f"⏳ [{nombre}] Presupuesto del intento {presupuesto['total_s']:.1f}s: "
+        f"pausas {presupuesto['pausas_s']:.1f}s ({presupuesto['pausas_s'] / total:.0%}), "
+        f"esperando al sitio {presupuesto['espera_sitio_s']:.1f}s ({presupuesto['espera_sitio_s'] / total:.0%}), "
+        f"activo {presupuesto['activo_s']:.1f}s ({presupuesto['activo_s'] / total:.0%})"
+    )
+    for entrada in presupuesto["por_sitio"][:max_sitios]:
+        agotadas = f", {entrada['agotadas']} agotadas" if entrada["agotadas"] else ""
+        logger.info(f"   {entrada['tipo']:<6} {entrada['sitio']:<45} {entrada['veces']:>3}x {entrada['segundos']:>7.2f}s{agotadas}")
+
+# MOTOR DE ESPERAS POR EVENTOS
+# Límite (segundos) para execute_async_script; cada espera aplica además su propio timeout en la página
+tiempo_max_script_async = 120
+
+# La condición se evalúa en cada mutación del DOM (MutationObserver) y, como red de
+# seguridad para estados que no mutan el DOM (readyState, jQuery.active, estilos), cada 50ms.
+# La promesa se resuelve con el primer valor verdadero de la condición o con null al agotar el tiempo.
+js_plantilla_espera = """
+var callback = arguments[arguments.length - 1];
+var limiteMs = arguments[0];
+var args = arguments[1] || [];
+
+function porId(id) { return document.getElementById(id); }
+function visible(el) {
+    if (!el || el.getClientRects().length === 0) return false;
+    var estilo = window.getComputedStyle(el);
+    return estilo.visibility !== 'hidden' && estilo.display !== 'none';
+}
+function condicion() { return (__CONDICION__); }
+
+new Promise(function (resolver) {
+    var observador = null, sondeo = null, limite = null;
+    function terminar(valor) {
+        if (observador) observador.disconnect();
+        clearInterval(sondeo);
+        clearTimeout(limite);
+        resolver(valor);
+    }
+    function evaluar() {
+        var resultado = false;
+        try { resultado = condicion(); } catch (e) { resultado = false; }
+        if (resultado) terminar(resultado);
+        return resultado;
+    }
+    if (evaluar()) return;
+    observador = new MutationObserver(evaluar);
+    observador.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    sondeo = setInterval(evaluar, 50);
+    limite = setTimeout(function () { terminar(null); }, limiteMs);
+}).then(callback);
+"""
+
+# Se resuelve cuando el DOM pasa silencioMs sin mutaciones (true) o al agotar el tiempo (false)
+js_esperar_dom_estable = """
+var callback = arguments[arguments.length - 1];
+var silencioMs = arguments[0];
+var limiteMs = arguments[1];
+
+new Promise(function (resolver) {
+    var temporizador = null, limite = null;
+    var observador = new MutationObserver(reprogramar);
+    function terminar(estable) {
+        observador.disconnect();
+        clearTimeout(temporizador);
+        clearTimeout(limite);
+        resolver(estable);
+    }
+    function reprogramar() {
+        clearTimeout(temporizador);
+        temporizador = setTimeout(function () { terminar(true); }, silencioMs);
+    }
+    observador.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    reprogramar();
+    limite = setTimeout(function () { terminar(false); }, limiteMs);
+}).then(callback);
+"""
+
+def esperar_condicion_js(driver, condicion, *args, timeout=10):
+    """Espera dentro del navegador hasta que la expresión JS sea verdadera y devuelve su valor"""
+    script = js_plantilla_espera.replace("__CONDICION__", condicion)
+    with contabilizar("espera") as estado:
+        try:
+            resultado = driver.execute_async_script(script, int(timeout * 1000), list(args))
+        except TimeoutException:
+            resultado = None
+        except Exception as e:
+            logger.warning(f"Error esperando condición '{condicion[:60]}': {e}")
+            resultado = None
+        estado["agotada"] = not resultado
+        return resultado
+
+def esperar_documento_listo(driver, timeout=30):
+    """Espera document.readyState = complete y jQuery inactivo (si existe)"""
+    return bool(esperar_condicion_js(
+        driver,
+        "document.readyState === 'complete' && (typeof jQuery === 'undefined' || jQuery.active === 0)",
+        timeout=timeout
+    ))
+
+def esperar_presente(driver, id_elemento, timeout=10):
+    """Espera que exista un elemento por ID y lo devuelve (o None)"""
+    return esperar_condicion_js(driver, "porId(args[0])", id_elemento, timeout=timeout)
+
+def esperar_visible(driver, id_elemento, timeout=10):
+    """Espera que un elemento por ID sea visible y lo devuelve (o None)"""
+    return esperar_condicion_js(driver, "visible(porId(args[0])) && porId(args[0])", id_elemento, timeout=timeout)
+
+def esperar_alguno_visible(driver, ids_elementos, timeout=10):
+    """Espera que cualquiera de los IDs sea visible y devuelve el primero que lo sea (o None)"""
+    return esperar_condicion_js(
+        driver, "args[0].map(porId).filter(visible)[0] || null", list(ids_elementos), timeout=timeout
+    )
+
+def esperar_texto(driver, id_elemento, texto, timeout=10):
+    """Espera que el texto de un elemento contenga el valor indicado"""
+    return bool(esperar_condicion_js(
+        driver,
+        "porId(args[0]) && porId(args[0]).textContent.indexOf(args[1]) !== -1",
+        id_elemento, texto, timeout=timeout
+    ))
+
+def esperar_dom_estable(driver, silencio_ms=500, timeout=10):
+    """Espera que el DOM deje de mutar durante silencio_ms (reemplaza las pausas fijas)"""
+    with contabilizar("espera") as estado:
+        try:
+            estable = bool(driver.execute_async_script(js_esperar_dom_estable, int(silencio_ms), int(timeout * 1000)))
+        except Exception as e:
+            logger.warning(f"Error esperando DOM estable: {e}")
+            estable = False
+        estado["agotada"] = not estable
+        return estable
+
+# BIBLIOTECA JS INYECTADA (window.__citas)
+# La lógica del lado del navegador (cascadas de selectores, clicks por atributos o texto,
+# apertura forzada de dropdowns, lectura de la agenda y diagnósticos) se instala una sola vez por
+# documento en window.__citas; después cada paso la invoca con una llamada corta por nombre.
+# Si el documento no la tiene (se recargó, es otra pestaña o iframe) o tiene otra versión, se
+# reinstala y se repite la llamada. Al cambiar la biblioteca hay que subir version_biblioteca_js.
+version_biblioteca_js = 8
+
+js_biblioteca_citas = """
+(function (version) {
+    function porId(id) { return document.getElementById(id); }
+    function visible(el) {
+        if (!el || el.getClientRects().length === 0) return false;
+        var estilo = window.getComputedStyle(el);
+        return estilo.visibility !== 'hidden' && estilo.display !== 'none';
+    }
+    function enPantalla(el) { return el.offsetParent !== null; }
+    function textoNormalizado(el) { return el ? el.textContent.replace(/\\s+/g, ' ').trim() : ''; }
+    function lista(nodos) { return Array.prototype.slice.call(nodos); }
+    function atributos(el) {
+        var resultado = {};
+        for (var i = 0; i < el.attributes.length; i++) resultado[el.attributes[i].name] = el.attributes[i].value;
+        return resultado;
+    }
+    function buscar(tipo, valor) {
+        if (tipo === 'id') {
+            var el = porId(valor);
+            return el ? [el] : [];
+        }
+        if (tipo === 'css selector') return lista(document.querySelectorAll(valor));
+        if (tipo === 'tag name') return lista(document.getElementsByTagName(valor));
+        if (tipo === 'xpath') {
+            var snapshot = document.evaluate(valor, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+            var nodos = [];
+            for (var i = 0; i < snapshot.snapshotLength; i++) nodos.push(snapshot.snapshotItem(i));
+            return nodos;
+        }
+        return [];
+    }
+    function cumple(criterios, texto, attrs) {
+        if (criterios.length === 0) return true;
+        return criterios.some(function (c) {
+            var k;
+            for (k in (c.atributos || {})) if (attrs[k] !== c.atributos[k]) return false;
+            for (k in (c.atributos_contienen || {})) if ((attrs[k] || '').indexOf(c.atributos_contienen[k]) === -1) return false;
+            if (c.texto !== undefined && texto !== c.texto) return false;
+            if (c.texto_contiene !== undefined && texto.indexOf(c.texto_contiene) === -1) return false;
+            return true;
+        });
+    }
+    function resumen(el) {
+        return {tag: el.tagName, id: el.id, class: el.className, text: el.textContent.trim().substring(0, 50)};
+    }
+    // Promesa con el primer valor verdadero de condicion(), revisada en cada mutación del DOM y cada
+    // 10ms (estilos y clases que cambian por temporizador), o null al agotar limiteMs
+    function cuando(condicion, limiteMs) {
+        return new Promise(function (resolver) {
+            var observador = null, sondeo = null, limite = null;
+            function terminar(valor) {
+                if (observador) observador.disconnect();
+                clearInterval(sondeo);
+                clearTimeout(limite);
+                resolver(valor);
+            }
+            function evaluar() {
+                var resultado = false;
+                try { resultado = condicion(); } catch (e) { resultado = false; }
+                if (resultado) terminar(resultado);
+                return resultado;
+            }
+            if (evaluar()) return;
+            observador = new MutationObserver(evaluar);
+            observador.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+            sondeo = setInterval(evaluar, 10);
+            limite = setTimeout(function () { terminar(null); }, limiteMs);
+        });
+    }
+    // Primer botón de los contenedores cuyo data-value o data-name sea el valor (o cuyo texto lo contenga)
+    function botonPorValor(selectorContenedores, valor, filtro) {
+        var botones = lista(document.querySelectorAll(selectorContenedores)).reduce(function (todos, contenedor) {
+            return todos.concat(lista(contenedor.querySelectorAll('button')));
+        }, []).filter(filtro || function () { return true; });
+        return botones.filter(function (b) {
+            return b.getAttribute('data-value') === valor || b.getAttribute('data-name') === valor;
+        })[0] || botones.filter(function (b) { return textoNormalizado(b).indexOf(valor) !== -1; })[0] || null;
+    }
+    // Llama la función global de la página; sin ella, ejecuta el click del elemento en la página
+    function manejador(nombre, argumento, el) {
+        if (typeof window[nombre] === 'function') window[nombre](argumento);
+        else if (el) el.click();
+        else throw new Error(nombre + ' no existe');
+    }
+    // Pasos del recorrido por las funciones del widget, [nombre, acción, verificación], para el
+    // objetivo {servicio, subconsulta, ciudad, profesional}
+    function pasosFormulario(objetivo) {
+        function servicio() {
+            return botonPorValor('#service_list', objetivo.servicio, function (b) { return !b.getAttribute('data-parent_id'); });
+        }
+        function subconsulta() {
+            return botonPorValor('#service_list', objetivo.subconsulta, function (b) {
+                return b.getAttribute('data-parent_id') === objetivo.servicio;
+            });
+        }
+        function sede() { return botonPorValor('#groups_drop, #group', objetivo.ciudad); }
+        function profesional() { return botonPorValor('#professional_drop, #professional', objetivo.profesional); }
+        function abierto(id) { return visible(porId(id)); }
+        function contiene(id, texto) { return textoNormalizado(porId(id)).indexOf(texto) !== -1; }
+        return [
+            ['abrir_servicios', function () { if (!abierto('services_drop')) manejador('showList', 'services_drop', porId('button_service')); },
+             function () { return abierto('services_drop') && servicio(); }],
+            ['servicio', function () { manejador('showServiceOptionSelected', servicio(), servicio()); },
+             function () { return visible(subconsulta()); }],
+            ['subconsulta', function () { subconsulta().click(); },
+             function () { return visible(porId('btn_search')); }],
+            ['busqueda', function () { porId('btn_search').click(); },
+             function () { return visible(porId('group_section')) && sede(); }],
+            ['abrir_grupos', function () { if (!abierto('groups_drop')) manejador('showGroups', 'groups_drop', porId('group_button')); },
+             function () { return abierto('groups_drop'); }],
+            ['ciudad', function () { sede().click(); },
+             function () { return contiene('selected_place', objetivo.ciudad) && visible(porId('professional_button')); }],
+            ['abrir_profesionales', function () {
+                if (!abierto('professional_drop')) manejador('showProfessionals', 'professional_drop', porId('professional_button'));
+            }, function () { return abierto('professional_drop') && profesional(); }],
+            ['profesional', function () { profesional().click(); },
+             function () { return contiene('selected_professional', objetivo.profesional); }]
+        ];
+    }
+    function pasoFormulario(nombre, objetivo) {
+        return pasosFormulario(objetivo).filter(function (paso) { return paso[0] === nombre; })[0];
+    }
+
+    // Contador de respuestas XHR/fetch terminadas (con éxito o no) en window.__citasRespuestas; se
+    // instala una sola vez por documento aunque la biblioteca se reinstale con otra versión
+    if (window.__citasRespuestas === undefined) {
+        window.__citasRespuestas = 0;
+        var contar = function () { window.__citasRespuestas++; };
+        var sendOriginal = XMLHttpRequest.prototype.send;
+        XMLHttpRequest.prototype.send = function () {
+            this.addEventListener('loadend', contar);
+            return sendOriginal.apply(this, arguments);
+        };
+        if (typeof window.fetch === 'function') {
+            var fetchOriginal = window.fetch;
+            window.fetch = function () {
+                return fetchOriginal.apply(this, arguments).then(function (respuesta) {
+                    contar();
+                    return respuesta;
+                }, function (error) {
+                    contar();
+                    throw error;
+                });
+            };
+        }
+    }
+
+    window.__citas = {
+        version: version,
+
+        // Primer elemento visible y habilitado de la cascada que cumpla alguno de los criterios
+        resolverCascada: function (selectores, criterios) {
+            criterios = criterios || [];
+            for (var i = 0; i < selectores.length; i++) {
+                var candidatos;
+                try { candidatos = buscar(selectores[i][0], selectores[i][1]); } catch (e) { continue; }
+                for (var j = 0; j < candidatos.length; j++) {
+                    var el = candidatos[j];
+                    if (!visible(el) || el.disabled) continue;
+                    var texto = (el.innerText || el.textContent || '').trim();
+                    var attrs = atributos(el);
+                    if (cumple(criterios, texto, attrs)) {
+                        return {elemento: el, indice: i, selector: selectores[i][1], candidatos: candidatos.length,
+                                texto: texto, atributos: attrs};
+                    }
+                }
+            }
+            return null;
+        },
+
+        // Click en el primer botón en pantalla del primer contenedor existente que coincida con
+        // alguno de los selectores CSS o, si se indica, con el texto (exacto o parcial)
+        clickBoton: function (contenedores, selectores, texto, textoParcial) {
+            var contenedor = null;
+            for (var i = 0; !contenedor && i < contenedores.length; i++) contenedor = porId(contenedores[i]);
+            if (!contenedor) return 'ERROR: ' + contenedores.join('/') + ' not found';
+            for (var s = 0; s < selectores.length; s++) {
+                var botones = contenedor.querySelectorAll(selectores[s]);
+                for (var j = 0; j < botones.length; j++) {
+                    if (enPantalla(botones[j])) {
+                        botones[j].scrollIntoView();
+                        botones[j].click();
+                        return 'SUCCESS: Clicked ' + selectores[s];
+                    }
+                }
+            }
+            var todos = texto ? contenedor.querySelectorAll('button') : [];
+            for (var k = 0; k < todos.length; k++) {
+                var contenido = todos[k].textContent.trim();
+                if ((textoParcial ? contenido.indexOf(texto) !== -1 : contenido === texto) && enPantalla(todos[k])) {
+                    todos[k].scrollIntoView();
+                    todos[k].click();
+                    return 'SUCCESS: Clicked by text';
+                }
+            }
+            return 'ERROR: button not found or not visible';
+        },
+
+        dispararClick: function (el) {
+            el.dispatchEvent(new MouseEvent('click', {bubbles: true, cancelable: true, view: window}));
+            return true;
+        },
+
+        // Llama una función global de la página (showList, showGroups...) si existe
+        llamarFuncion: function (nombre, argumento) {
+            if (typeof window[nombre] !== 'function') return false;
+            window[nombre](argumento);
+            return true;
+        },
+
+        // Ejecuta el onclick del elemento; sin él, la función de respaldo de la página
+        onclickManual: function (el, respaldo, argumento) {
+            if (el && el.onclick) {
+                el.onclick();
+                return true;
+            }
+            if (el && el.getAttribute('onclick')) {
+                eval(el.getAttribute('onclick'));
+                return true;
+            }
+            return respaldo ? this.llamarFuncion(respaldo, argumento) : false;
+        },
+
+        // Prueba en orden las estrategias de apertura ('click', 'funcion', 'evento', 'onclick') del
+        // dropdown y tras cada una sondea la visibilidad de los ids hasta limiteMs; la promesa se
+        // resuelve en cuanto alguno queda visible con {estrategia, intentos: [[ms, éxito, error]]}
+        // (estrategia null si ninguna lo abrió)
+        abrirDropdown: function (boton, funcion, drop, ids, estrategias, limiteMs) {
+            var biblioteca = this, intentos = [];
+            boton = typeof boton === 'string' ? porId(boton) : boton;
+            function abierto() { return ids.some(function (id) { return visible(porId(id)); }); }
+            var acciones = {
+                click: function () { boton.click(); },
+                funcion: function () { if (!biblioteca.llamarFuncion(funcion, drop)) throw new Error(funcion + ' no existe'); },
+                evento: function () { biblioteca.dispararClick(boton); },
+                onclick: function () { if (!biblioteca.onclickManual(boton, null, null)) throw new Error('sin onclick'); }
+            };
+            if (abierto()) return {estrategia: 'abierto', intentos: intentos};
+            function probar(i) {
+                if (i === estrategias.length) return {estrategia: null, intentos: intentos};
+                var inicio = performance.now();
+                try {
+                    acciones[estrategias[i]]();
+                } catch (e) {
+                    intentos.push([Math.round(performance.now() - inicio), false, String(e)]);
+                    return probar(i + 1);
+                }
+                return cuando(abierto, limiteMs).then(function (valor) {
+                    intentos.push([Math.round(performance.now() - inicio), !!valor, null]);
+                    return valor ? {estrategia: estrategias[i], intentos: intentos} : probar(i + 1);
+                });
+            }
+            return probar(0);
+        },
+
+        // Fuerza la visibilidad de los dropdowns indicados; devuelve por ID si quedó en pantalla
+        // (null si el elemento no existe)
+        forzarApertura: function (ids, estilosPorId) {
+            var resultado = {};
+            ids.forEach(function (id) {
+                var el = porId(id);
+                if (!el) {
+                    resultado[id] = null;
+                    return;
+                }
+                el.style.display = 'block';
+                el.style.visibility = 'visible';
+                el.classList.add('show');
+                var estilos = (estilosPorId || {})[id] || {};
+                for (var propiedad in estilos) el.style[propiedad] = estilos[propiedad];
+                resultado[id] = enPantalla(el);
+            });
+            return resultado;
+        },
+
+        // Huella de la agenda visible (FNV-1a de 32 bits y longitud de su innerHTML normalizado más
+        // la sede y el profesional elegidos, que extraerCupos asigna a cada cupo), o null si no hay agenda
+        huellaAgenda: function () {
+            var seccion = porId('schedule_section');
+            if (!visible(seccion)) return null;
+            var html = seccion.innerHTML.replace(/\\s+/g, ' ').trim() + '|' +
+                       textoNormalizado(porId('selected_place')) + '|' + textoNormalizado(porId('selected_professional'));
+            var hash = 0x811c9dc5;
+            for (var i = 0; i < html.length; i++) {
+                hash ^= html.charCodeAt(i);
+                hash = Math.imul(hash, 0x01000193);
+            }
+            return (hash >>> 0).toString(16) + ':' + html.length;
+        },
+
+        // Filas [id, fecha, hora, profesional, sede] de la agenda visible (null si no hay agenda);
+        // listas en vez de objetos para que la respuesta sea compacta. Si la huella coincide con
+        // huellaAnterior no se recorre la agenda y solo se devuelve {huella, sinCambios: true}
+        extraerCupos: function (huellaAnterior) {
+            var huella = this.huellaAgenda();
+            if (huella === null) return null;
+            if (huella === huellaAnterior) return {huella: huella, sinCambios: true};
+            var seccion = porId('schedule_section');
+            var sede = textoNormalizado(porId('selected_place'));
+            var profesional = textoNormalizado(porId('selected_professional'));
+            var botones = seccion.querySelectorAll('[data-slot_id], #schedule_list button, .schedule_item button, button.schedule');
+            var vistos = [];
+            var filas = [];
+            for (var i = 0; i < botones.length; i++) {
+                var boton = botones[i];
+                if (vistos.indexOf(boton) !== -1 || boton.disabled) continue;
+                vistos.push(boton);
+                var contenido = textoNormalizado(boton);
+                var fecha = boton.getAttribute('data-date') ||
+                            (contenido.match(/\\d{4}-\\d{2}-\\d{2}|\\d{1,2}\\/\\d{1,2}\\/\\d{2,4}/) || [''])[0];
+                var hora = boton.getAttribute('data-time') ||
+                           (contenido.match(/\\d{1,2}:\\d{2}(\\s*[ap]\\.?\\s*m\\.?)?/i) || [''])[0];
+                filas.push([
+                    boton.getAttribute('data-slot_id') || boton.getAttribute('data-value') || boton.getAttribute('data-id') || '',
+                    fecha, hora,
+                    boton.getAttribute('data-professional') || profesional,
+                    boton.getAttribute('data-place') || sede
+                ]);
+            }
+            return {huella: huella, vacio: visible(porId('schedule_empty')), filas: filas};
+        },
+
+        // Catálogo presente en el documento: filas [data-value, nombre, data-parent_id] de service_list
+        // (parent_id null en los servicios principales), las sedes y los profesionales listados
+        leerCatalogo: function () {
+            function valores(selector) {
+                return lista(document.querySelectorAll(selector)).map(function (el) {
+                    return el.getAttribute('data-value') || textoNormalizado(el);
+                }).filter(function (valor, i, todos) { return valor && todos.indexOf(valor) === i; });
+            }
+            var servicios = lista(document.querySelectorAll('#service_list button[data-value]')).map(function (el) {
+                return [el.getAttribute('data-value'), el.getAttribute('data-name') || textoNormalizado(el),
+                        el.getAttribute('data-parent_id')];
+            });
+            return {servicios: servicios, sedes: valores('#groups_drop button.place, #group button'),
+                    profesionales: valores('#professional_drop button.professional, #professional button')};
+        },
+
+        // Recorre el formulario llamando los manejadores del widget con los ids del objetivo
+        // ({servicio, subconsulta, ciudad, profesional}) desde el paso indicado. Tras cada llamada
+        // espera en la página a que se verifique su efecto; la promesa se resuelve con
+        // {ok, paso, error, tiempos} en el primer paso que falle o al terminar todos
+        conducirFormulario: function (objetivo, desde, limiteMs) {
+            var inicio = performance.now(), tiempos = {};
+            var pasos = pasosFormulario(objetivo);
+            var indice = Math.max(0, pasos.map(function (paso) { return paso[0]; }).indexOf(desde));
+            function siguiente(i) {
+                if (i === pasos.length) return {ok: true, paso: null, error: null, tiempos: tiempos};
+                var paso = pasos[i], inicioPaso = performance.now();
+                try {
+                    paso[1]();
+                } catch (e) {
+                    return {ok: false, paso: paso[0], error: String(e), tiempos: tiempos};
+                }
+                return cuando(paso[2], Math.max(0, limiteMs - (performance.now() - inicio))).then(function (valor) {
+                    tiempos[paso[0]] = Math.round(performance.now() - inicioPaso);
+                    return valor ? siguiente(i + 1) : {ok: false, paso: paso[0], error: null, tiempos: tiempos};
+                });
+            }
+            return siguiente(indice);
+        },
+
+        // Solo la acción de un paso de conducirFormulario (null o el error); quien llama espera
+        // luego verificarPaso, p. ej. el modo pestañas entre las esperas de las demás pestañas
+        accionPaso: function (nombre, objetivo) {
+            try {
+                pasoFormulario(nombre, objetivo)[1]();
+                return null;
+            } catch (e) {
+                return String(e);
+            }
+        },
+
+        verificarPaso: function (nombre, objetivo) {
+            return !!pasoFormulario(nombre, objetivo)[2]();
+        },
+
+        respuestas: function () { return window.__citasRespuestas; },
+
+        // Estado de button_service, services_drop y service_list (debug_completo_dropdown)
+        estadoDropdownServicios: function () {
+            var info = {button_service: null, services_drop: null, service_list: null, dropdown_div: null};
+            var btn = porId('button_service');
+            if (btn) {
+                info.button_service = {exists: true, tag: btn.tagName, text: btn.textContent.trim(),
+                                       onclick: btn.getAttribute('onclick'), class: btn.getAttribute('class'),
+                                       style_display: window.getComputedStyle(btn).display,
+                                       visible: enPantalla(btn), enabled: !btn.disabled};
+            }
+            var dropdown = porId('services_drop');
+            if (dropdown) {
+                info.services_drop = {exists: true, class: dropdown.getAttribute('class'),
+                                      style_display: window.getComputedStyle(dropdown).display,
+                                      style_visibility: window.getComputedStyle(dropdown).visibility,
+                                      visible: enPantalla(dropdown), children_count: dropdown.children.length};
+            }
+            var list = porId('service_list');
+            if (list) {
+                info.service_list = {exists: true, children_count: list.children.length,
+                                     style_display: window.getComputedStyle(list).display, visible: enPantalla(list),
+                                     first_child_tag: list.children.length > 0 ? list.children[0].tagName : null};
+            }
+            info.dropdown_divs_count = document.querySelectorAll('div[class*="dropdown"]').length;
+            return info;
+        },
+
+        // Elementos con 'service' en el ID o la clase y elementos de dropdown (diagnóstico de la página)
+        elementosServicio: function () {
+            var grupos = [['ID contains service', '*[id*="service"]'], ['CLASS contains service', '*[class*="service"]'],
+                          ['DROPDOWN element', '*[class*="dropdown"], *[id*="dropdown"]']];
+            var elementos = [];
+            grupos.forEach(function (grupo) {
+                lista(document.querySelectorAll(grupo[1])).forEach(function (el) {
+                    var descripcion = resumen(el);
+                    descripcion.tipo = grupo[0];
+                    elementos.push(descripcion);
+                });
+            });
+            return elementos;
+        }
+    };
+    return version;
+})(arguments[0]);
+"""
+
+# Invoca window.__citas[funcion](...args) o devuelve la marca si hay que (re)instalar la biblioteca
+marca_sin_biblioteca = "__SIN_BIBLIOTECA_CITAS__"
+js_llamar_biblioteca = """
+var biblioteca = window.__citas;
+if (!biblioteca || biblioteca.version !== arguments[0]) return '__SIN_BIBLIOTECA_CITAS__';
+return biblioteca[arguments[1]].apply(biblioteca, arguments[2]);
+"""
+
+def llamar_biblioteca(driver, funcion, *args):
+    """Ejecuta una función de window.__citas en el documento actual, instalándola si no está"""
+    resultado = driver.execute_script(js_llamar_biblioteca, version_biblioteca_js, funcion, list(args))
+    if resultado == marca_sin_biblioteca:
+        driver.execute_script(js_biblioteca_citas, version_biblioteca_js)
+        resultado = driver.execute_script(js_llamar_biblioteca, version_biblioteca_js, funcion, list(args))
+    return resultado
+
+# Igual que js_llamar_biblioteca para funciones que devuelven una promesa (execute_async_script)
+js_llamar_biblioteca_async = """
+var callback = arguments[arguments.length - 1];
+var biblioteca = window.__citas, funcion = arguments[1], args = arguments[2];
+if (!biblioteca || biblioteca.version !== arguments[0]) {
+    callback('__SIN_BIBLIOTECA_CITAS__');
+    return;
+}
+Promise.resolve().then(function () { return biblioteca[funcion].apply(biblioteca, args); })
+    .then(callback, function (e) { callback({error: String(e)}); });
+"""
+
+def llamar_biblioteca_async(driver, funcion, *args):
+    """Ejecuta una función asíncrona de window.__citas y espera su promesa (limitada por tiempo_max_script_async)"""
+    resultado = driver.execute_async_script(js_llamar_biblioteca_async, version_biblioteca_js, funcion, list(args))
+    if resultado == marca_sin_biblioteca:
+        driver.execute_script(js_biblioteca_citas, version_biblioteca_js)
+        resultado = driver.execute_async_script(js_llamar_biblioteca_async, version_biblioteca_js, funcion, list(args))
+    return resultado
+
+# RESOLUCIÓN DE CASCADAS DE SELECTORES EN UNA SOLA LLAMADA
+# Recorre la lista de selectores en el navegador (window.__citas.resolverCascada) y devuelve el
+# primer elemento visible y habilitado que cumpla alguno de los criterios, con su texto y atributos.
+def resolver_cascada(driver, selectores, criterios=None, grupo=None):
+    """Resuelve una lista de selectores (By, valor) en una sola llamada al navegador.
+    
+    Cada criterio es un dict con claves opcionales 'atributos', 'atributos_contienen',
+    'texto' y 'texto_contiene'; basta con que se cumpla uno. Devuelve un dict con
+    'elemento', 'indice', 'selector', 'texto' y 'atributos', o None.
+    Si se indica grupo, los selectores se ordenan y registran según su historial.
+    """
+    if grupo:
+        selectores = ordenar_por_historial(grupo, selectores, clave=lambda selector: selector[1])
+    
+    inicio = time.monotonic()
+    with tramo(f"cascada {grupo or ''}".strip(), "selector", selectores=[valor for _, valor in selectores]) as args_tramo:
+        try:
+            resultado = llamar_biblioteca(
+                driver, "resolverCascada", [list(selector) for selector in selectores], criterios or []
+            )
+        except Exception as e:
+            logger.error(f"Error resolviendo cascada de selectores: {e}")
+            return None
+        args_tramo["ganador"] = resultado["selector"] if resultado else None
+    
+    if grupo:
+        # Los selectores anteriores al ganador se evaluaron sin éxito
+        duracion = time.monotonic() - inicio
+        evaluados = selectores[:resultado["indice"] + 1] if resultado else selectores
+        for i, (_, valor) in enumerate(evaluados):
+            registrar_resultado_estrategia(grupo, valor, bool(resultado) and i == resultado["indice"], duracion, trazar=False)
+    
+    if resultado:
+        atributos = resultado["atributos"]
+        logger.info(
+            f"🎯 Selector {resultado['indice'] + 1}/{len(selectores)} ganó: {resultado['selector']} - "
+            f"text='{resultado['texto'][:60]}', data-value='{atributos.get('data-value')}', "
+            f"data-name='{atributos.get('data-name')}', class='{atributos.get('class')}'"
+        )
+    else:
+        logger.info(f"Ningún selector de la cascada ({len(selectores)}) encontró un elemento válido")
+    return resultado
+
+# ORDEN ADAPTATIVO DE SELECTORES Y ESTRATEGIAS
+# Se registra por grupo (p. ej. 'abrir_grupos') cuántas veces se probó cada estrategia o selector,
+# cuántas veces ganó y cuánto tardó en ganar; el siguiente intento prueba primero al mejor.
+archivo_estadisticas = os.path.join(directorio_datos, "estadisticas_estrategias.json")
+estadisticas_estrategias = None  # Se carga desde disco en el primer uso
+bloqueo_estadisticas = threading.Lock()
+
+def cargar_estadisticas_estrategias():
+    """Carga (una sola vez) las estadísticas de estrategias guardadas en disco"""
+    global estadisticas_estrategias
+    
+    with bloqueo_estadisticas:
+        if estadisticas_estrategias is None:
+            try:
+                with open(archivo_estadisticas, encoding="utf-8") as archivo:
+                    estadisticas_estrategias = json.load(archivo)
+                logger.info(f"📈 Estadísticas de estrategias cargadas: {len(estadisticas_estrategias)} grupos")
+            except FileNotFoundError:
+                estadisticas_estrategias = {}
+            except Exception as e:
+                logger.warning(f"No se pudieron leer las estadísticas de estrategias: {e}")
+                estadisticas_estrategias = {}
+        return estadisticas_estrategias
+
+def guardar_estadisticas_estrategias():
+    """Guarda las estadísticas de estrategias en disco (escritura atómica)"""
+    estadisticas = cargar_estadisticas_estrategias()
+    try:
+        os.makedirs(directorio_datos, exist_ok=True)
+        # Volcado y reemplazo bajo el bloqueo: el archivo queda con la última instantánea serializada
+        with bloqueo_estadisticas:
+            escribir_atomico(archivo_estadisticas, json.dumps(estadisticas, ensure_ascii=False, indent=1))
+    except Exception as e:
+        logger.warning(f"No se pudieron guardar las estadísticas de estrategias: {e}")
+
+def registrar_resultado_estrategia(grupo, nombre, exito, duracion, trazar=True):
+    """Registra si una estrategia/selector ganó y cuánto tardó (y su tramo en la traza)"""
+    if trazar:
+        duracion_us = int(duracion * 1_000_000)
+        agregar_evento_traza(f"{grupo}: {nombre}", "estrategia", ahora_us() - duracion_us, duracion_us, {"exito": exito})
+    estadisticas = cargar_estadisticas_estrategias()
+    with bloqueo_estadisticas:
+        registro = estadisticas.setdefault(grupo, {}).setdefault(
+            nombre, {"intentos": 0, "exitos": 0, "latencia_exitos": 0.0}
+        )
+        registro["intentos"] += 1
+        if exito:
+            registro["exitos"] += 1
+            registro["latencia_exitos"] += duracion
+
+def ordenar_por_historial(grupo, elementos, clave=lambda elemento: elemento[0]):
+    """Ordena estrategias/selectores: mayor tasa de éxito primero y, a igualdad, menor latencia"""
+    historial = cargar_estadisticas_estrategias().get(grupo, {})
+    
+    def puntaje(elemento):
+        registro = historial.get(clave(elemento))
+        if not registro:
+            return (-0.5, float("inf"))  # Sin historial: prioridad neutra, se conserva el orden original
+        # Suavizado de Laplace para no descartar una estrategia por pocos intentos
+        tasa_exito = (registro["exitos"] + 1) / (registro["intentos"] + 2)
+        latencia = registro["latencia_exitos"] / registro["exitos"] if registro["exitos"] else float("inf")
+        return (-tasa_exito, latencia)
+    
+    return sorted(elementos, key=puntaje)
+
+# MÉTRICAS DE TIEMPO POR PASO
+# Cada paso medido (inicio del driver, navegación, carga, iframe, dropdowns, búsqueda, grupo,
+# profesional, limpieza...) alimenta un histograma en memoria. Al final de cada intento se
+# exportan a datos/metricas_pasos.prom (formato de texto de Prometheus, apto para el textfile
+# collector de node_exporter) y a datos/metricas_pasos.json (con p50/p95 de las muestras recientes).
+# Los pasos pueden anidarse (p. ej. 'busqueda' ocurre dentro de 'subconsulta').
+limites_histograma = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+muestras_recientes_por_paso = 2000
+archivo_metricas = os.path.join(directorio_datos, "metricas_pasos")
+if multiprocessing.parent_process() is not None:
+    # En el pool de procesos cada proceso exporta sus propias métricas
+    archivo_metricas += f"-{os.getpid()}"
+
+class HistogramaLatencia:
+    """Histograma acumulado de duraciones (segundos) más una ventana de muestras recientes"""
+    
+    def __init__(self):
+        self.cubetas = [0] * len(limites_histograma)
+        self.cuenta = 0
+        self.suma = 0.0
+        self.recientes = deque(maxlen=muestras_recientes_por_paso)
+    
+    def observar(self, segundos):
+        for i, limite in enumerate(limites_histograma):
+            if segundos <= limite:
+                self.cubetas[i] += 1
+        self.cuenta += 1
+        self.suma += segundos
+        self.recientes.append(segundos)
+    
+    def percentil(self, p):
+        if not self.recientes:
+            return None
+        ordenadas = sorted(self.recientes)
+        return ordenadas[min(len(ordenadas) - 1, int(p / 100 * len(ordenadas)))]
+    
+    def resumen(self):
+        return {
+            "cuenta": self.cuenta,
+            "suma_s": round(self.suma, 3),
+            "p50_s": self.percentil(50),
+            "p95_s": self.percentil(95),
+            "max_s": max(self.recientes) if self.recientes else None,
+            "cubetas": {str(limite): n for limite, n in zip(limites_histograma, self.cubetas)},
+        }
+
+histogramas_pasos = {}
+bloqueo_metricas = threading.Lock()
+bloqueo_archivo_metricas = threading.Lock()  # Varias sesiones en hilos pueden exportar a la vez
+# Tiempos del intento en curso en este hilo: lista de (paso, segundos) o None si no hay intento
+contexto_metricas = threading.local()
+
+def registrar_tiempo_paso(paso, segundos):
+    """Suma una duración al histograma del paso y al intento en curso del hilo"""
+    with bloqueo_metricas:
+        histograma = histogramas_pasos.get(paso)
+        if histograma is None:
+            histograma = histogramas_pasos[paso] = HistogramaLatencia()
+        histograma.observar(segundos)
+    tiempos_intento = getattr(contexto_metricas, "tiempos", None)
+    if tiempos_intento is not None:
+        tiempos_intento.append((paso, segundos))
+
+@contextmanager
+def medir_paso(paso):
+    """Mide la duración del bloque como un paso (también cuando termina con excepción)"""
+    inicio = time.monotonic()
+    try:
+        with tramo(paso, "paso"):
+            yield
+    finally:
+        registrar_tiempo_paso(paso, time.monotonic() - inicio)
+
+def medido(paso, instantanea=True):
+    """Decorador: mide cada llamada a la función como el paso indicado.
+    
+    Si la función recibe el driver como primer argumento y falla (devuelve False o lanza
+    una excepción), se guarda una instantánea del fallo (salvo con instantanea=False, para
+    pasos en los que False es un resultado normal).
+    """
+    def decorador(funcion):
+        recibe_driver = instantanea and next(iter(inspect.signature(funcion).parameters), None) == "driver"
+        
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            try:
+                with medir_paso(paso):
+                    resultado = funcion(*args, **kwargs)
+            except Exception as e:
+                if recibe_driver:
+                    capturar_instantanea_fallo(args[0], paso, repr(e))
+                raise
+            if recibe_driver and resultado is False:
+                capturar_instantanea_fallo(args[0], paso)
+            return resultado
+        return envoltura
+    return decorador
+
+def resumir_tiempos_intento(tiempos):
+    """Suma por paso los tiempos de un intento, en el orden en que aparecieron"""
+    totales = {}
+    for paso, segundos in tiempos:
+        totales[paso] = totales.get(paso, 0.0) + segundos
+    return totales
+
+def exportar_metricas_prometheus():
+    """Texto en formato de exposición de Prometheus con un histograma por paso"""
+    lineas = [
+        "# HELP citas_paso_duracion_segundos Duración de cada paso del proceso de citas",
+        "# TYPE citas_paso_duracion_segundos histogram",
+    ]
+    with bloqueo_metricas:
+        for paso, histograma in sorted(histogramas_pasos.items()):
+            for limite, n in zip(limites_histograma, histograma.cubetas):
+                lineas.append(f'citas_paso_duracion_segundos_bucket{{paso="{paso}",le="{limite}"}} {n}')
+            lineas.append(f'citas_paso_duracion_segundos_bucket{{paso="{paso}",le="+Inf"}} {histograma.cuenta}')
+            lineas.append(f'citas_paso_duracion_segundos_sum{{paso="{paso}"}} {histograma.suma:.6f}')
+            lineas.append(f'citas_paso_duracion_segundos_count{{paso="{paso}"}} {histograma.cuenta}')
+    return "\n".join(lineas) + "\n"
+
+def exportar_metricas_json():
+    """Instantánea de los histogramas (con percentiles recientes) y de las pausas/esperas por sitio"""
+    with bloqueo_metricas:
+        pasos = {paso: histograma.resumen() for paso, histograma in sorted(histogramas_pasos.items())}
+    with bloqueo_pausas:
+        pausas = presupuesto_intento(totales_pausas_por_sitio, 0.0)["por_sitio"]
+    return {"generado": datetime.now().isoformat(timespec="seconds"), "pasos": pasos, "pausas_y_esperas": pausas}
+
+def guardar_metricas():
+    """Escribe las métricas en .prom y .json (escritura atómica)"""
+    try:
+        os.makedirs(directorio_datos, exist_ok=True)
+        with bloqueo_archivo_metricas:
+            for extension, contenido in (
+                (".prom", exportar_metricas_prometheus()),
+                (".json", json.dumps(exportar_metricas_json(), ensure_ascii=False, indent=1)),
+            ):
+                escribir_atomico(archivo_metricas + extension, contenido)
+    except Exception as e:
+        logger.warning(f"No se pudieron guardar las métricas de tiempos: {e}")
+
+def configurar_bloqueo_recursos(driver):
+    """Bloquea por DevTools imágenes, fuentes, analítica y multimedia (perfil ligero)"""
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patrones_bloqueados})
+        
+        # El modo headless se anuncia en el user agent; se presenta como Chrome normal
+        agente = driver.execute_script("return navigator.userAgent;")
+        if "HeadlessChrome" in agente:
+            driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": agente.replace("HeadlessChrome", "Chrome")})
+        
+        logger.info(f"🚫 Bloqueo de recursos activo: {len(patrones_bloqueados)} patrones")
+    except Exception as e:
+        logger.warning(f"No se pudo configurar el bloqueo de recursos: {e}")
+
 # Funciones para el proceso de selección de citas
-def inicializar_driver():
+@medido("inicio_driver")
+def inicializar_driver(perfil=None):
     """Inicializa el driver con manejo de errores"""
+    perfil = perfil or perfil_navegador
     try:
         service = Service(ruta_driver)
-        driver = webdriver.Chrome(service=service, options=options)
+        opciones = options if perfil == perfil_navegador else crear_opciones_navegador(perfil)
+        driver = webdriver.Chrome(service=service, options=opciones)
         driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+        driver.set_script_timeout(tiempo_max_script_async)
+        instrumentar_driver(driver)
+        if perfil == "ligero":
+            configurar_bloqueo_recursos(driver)
+        logger.info(f"🧭 Navegador iniciado con perfil '{perfil}'")
         return driver
     except Exception as e:
         logger.error(f"Error inicializando driver: {e}")
@@ -66,7 +1223,6 @@ def hacer_click_seguro(driver, elemento):
     try:
         # Scroll al elemento primero
         driver.execute_script("arguments[0].scrollIntoView(true);", elemento)
-        time.sleep(0.5)
         elemento.click()
         return True
     except:
@@ -80,19 +1236,14 @@ def esperar_carga_completa_pagina(driver, wait):
     """Espera que la página cargue completamente antes de interactuar"""
     logger.info("=== ESPERANDO CARGA COMPLETA DE LA PÁGINA ===")
     
-    # Esperar que el DOM esté completamente cargado
-    wait.until(lambda driver: driver.execute_script("return document.readyState") == "complete")
-    logger.info("✅ Documento completamente cargado")
-    
-    # Esperar que jQuery termine (si existe)
-    try:
-        wait.until(lambda driver: driver.execute_script("return typeof jQuery === 'undefined' || jQuery.active === 0"))
-        logger.info("✅ jQuery terminó de cargar")
-    except:
-        logger.info("jQuery no detectado o no aplicable")
+    # Esperar que el DOM esté completamente cargado y jQuery inactivo (si existe)
+    if esperar_documento_listo(driver):
+        logger.info("✅ Documento completamente cargado")
+    else:
+        logger.warning("⚠️ Documento no terminó de cargar a tiempo")
     
-    # Esperar tiempo adicional para elementos dinámicos
-    time.sleep(5)
+    # Esperar a que los elementos dinámicos dejen de generarse
+    esperar_dom_estable(driver, silencio_ms=500, timeout=5)
     
     # Verificar elementos críticos
     elementos_criticos = ['button_service', 'services_drop', 'service_list']
@@ -111,60 +1262,7 @@ def debug_completo_dropdown(driver):
     
     try:
         # Información completa del DOM relacionado con el dropdown
-        info_completa = driver.execute_script("""
-            var info = {
-                button_service: null,
-                services_drop: null,
-                service_list: null,
-                dropdown_div: null
-            };
-            
-            // button_service
-            var btn = document.getElementById('button_service');
-            if (btn) {
-                info.button_service = {
-                    exists: true,
-                    tag: btn.tagName,
-                    text: btn.textContent.trim(),
-                    onclick: btn.getAttribute('onclick'),
-                    class: btn.getAttribute('class'),
-                    style_display: window.getComputedStyle(btn).display,
-                    visible: btn.offsetParent !== null,
-                    enabled: !btn.disabled
-                };
-            }
-            
-            // services_drop
-            var dropdown = document.getElementById('services_drop');
-            if (dropdown) {
-                info.services_drop = {
-                    exists: true,
-                    class: dropdown.getAttribute('class'),
-                    style_display: window.getComputedStyle(dropdown).display,
-                    style_visibility: window.getComputedStyle(dropdown).visibility,
-                    visible: dropdown.offsetParent !== null,
-                    children_count: dropdown.children.length
-                };
-            }
-            
-            // service_list
-            var list = document.getElementById('service_list');
-            if (list) {
-                info.service_list = {
-                    exists: true,
-                    children_count: list.children.length,
-                    style_display: window.getComputedStyle(list).display,
-                    visible: list.offsetParent !== null,
-                    first_child_tag: list.children.length > 0 ? list.children[0].tagName : null
-                };
-            }
-            
-            // Buscar divs con dropdown en la clase
-            var dropdownDivs = document.querySelectorAll('div[class*="dropdown"]');
-            info.dropdown_divs_count = dropdownDivs.length;
-            
-            return info;
-        """)
+        info_completa = llamar_biblioteca(driver, "estadoDropdownServicios")
         
         logger.info("📊 Estado completo del dropdown:")
         for elemento, datos in info_completa.items():
@@ -176,153 +1274,14 @@ def debug_completo_dropdown(driver):
     except Exception as e:
         logger.error(f"Error en debug completo: {e}")
 
-def abrir_dropdown_servicios_corregido(driver, wait):
-    """Versión corregida que encuentra específicamente el botón correcto"""
-    logger.info("=== ABRIENDO DROPDOWN DE SERVICIOS (VERSIÓN CORREGIDA) ===")
-    
-    # Paso 1: Verificar que el botón button_service existe
-    try:
-        button_service = wait.until(EC.presence_of_element_located((By.ID, "button_service")))
-        logger.info("✅ button_service encontrado")
-        
-        # Verificar información del botón
-        tag = button_service.tag_name
-        text = button_service.text.strip()
-        onclick = button_service.get_attribute("onclick") or ""
-        class_attr = button_service.get_attribute("class") or ""
-        is_displayed = button_service.is_displayed()
-        is_enabled = button_service.is_enabled()
-        
-        logger.info(f"📋 Info del botón: tag='{tag}', text='{text}', onclick='{onclick}', class='{class_attr}'")
-        logger.info(f"📋 Estado: visible={is_displayed}, habilitado={is_enabled}")
-        
-        if tag != "button":
-            logger.warning(f"⚠️ Elemento no es un botón, es: {tag}")
-            
-    except TimeoutException:
-        logger.error("❌ button_service no encontrado")
-        return False
-    
-    # Paso 2: Asegurar que el botón esté visible y clickeable
-    try:
-        # Scroll para asegurar visibilidad
-        driver.execute_script("arguments[0].scrollIntoView({behavior: 'smooth', block: 'center'});", button_service)
-        time.sleep(2)
-        
-        # Esperar que sea clickeable
-        button_clickeable = wait.until(EC.element_to_be_clickable((By.ID, "button_service")))
-        logger.info("✅ Botón confirmado como clickeable")
-        
-    except TimeoutException:
-        logger.error("❌ Botón no se volvió clickeable")
-        return False
-    
-    # Paso 3: Intentar click con múltiples estrategias
-    estrategias_click = [
-        ("Click directo", lambda: button_clickeable.click()),
-        ("Click JavaScript", lambda: driver.execute_script("arguments[0].click();", button_clickeable)),
-        ("Click con evento", lambda: driver.execute_script("""
-            var event = new MouseEvent('click', {bubbles: true, cancelable: true, view: window});
-            arguments[0].dispatchEvent(event);
-        """, button_clickeable)),
-        ("Función específica", lambda: driver.execute_script("showList('services_drop');")),
-        ("Click forzado", lambda: driver.execute_script("""
-            var btn = document.getElementById('button_service');
-            if (btn && btn.onclick) {
-                btn.onclick();
-            } else if (typeof showList === 'function') {
-                showList('services_drop');
-            }
-        """))
-    ]
-    
-    for nombre_estrategia, estrategia_func in estrategias_click:
-        try:
-            logger.info(f"Intentando: {nombre_estrategia}")
-            estrategia_func()
-            logger.info(f"✅ {nombre_estrategia} ejecutado")
-            
-            # Esperar y verificar si se abrió
-            time.sleep(3)
-            
-            # Verificar múltiples indicadores de que se abrió
-            dropdown_abierto = False
-            
-            # Verificar services_drop
-            try:
-                services_drop = driver.find_element(By.ID, "services_drop")
-                if services_drop.is_displayed():
-                    logger.info("✅ services_drop está visible")
-                    dropdown_abierto = True
-            except NoSuchElementException:
-                logger.warning("services_drop no encontrado")
-            
-            # Verificar service_list
-            try:
-                service_list = driver.find_element(By.ID, "service_list")
-                if service_list.is_displayed():
-                    logger.info("✅ service_list está visible")
-                    dropdown_abierto = True
-            except NoSuchElementException:
-                logger.warning("service_list no encontrado")
-            
-            if dropdown_abierto:
-                logger.info(f"✅ Dropdown abierto exitosamente con: {nombre_estrategia}")
-                return True
-            else:
-                logger.warning(f"⚠️ {nombre_estrategia} no abrió el dropdown")
-                
-        except Exception as e:
-            logger.warning(f"❌ {nombre_estrategia} falló: {e}")
-            continue
-    
-    # Paso 4: Intentar forzar la apertura modificando el DOM
-    try:
-        logger.info("Intentando forzar apertura modificando DOM...")
-        resultado = driver.execute_script("""
-            // Forzar visibilidad del dropdown
-            var dropdown = document.getElementById('services_drop');
-            var serviceList = document.getElementById('service_list');
-            
-            if (dropdown) {
-                dropdown.style.display = 'block';
-                dropdown.style.visibility = 'visible';
-                dropdown.style.opacity = '1';
-                dropdown.style.position = 'relative';
-                dropdown.style.zIndex = '9999';
-            }
-            
-            if (serviceList) {
-                serviceList.style.display = 'block';
-                serviceList.style.visibility = 'visible';
-                serviceList.style.opacity = '1';
-                serviceList.style.maxHeight = '500px';
-                serviceList.style.overflow = 'auto';
-            }
-            
-            // Verificar resultado
-            return {
-                dropdown_visible: dropdown ? dropdown.offsetParent !== null : false,
-                service_list_visible: serviceList ? serviceList.offsetParent !== null : false
-            };
-        """)
-        
-        logger.info(f"Resultado forzar DOM: {resultado}")
-        
-        if resultado.get('service_list_visible') or resultado.get('dropdown_visible'):
-            logger.info("✅ Dropdown forzado a abrirse")
-            return True
-            
-    except Exception as e:
-        logger.error(f"Error forzando DOM: {e}")
-    
-    logger.error("❌ Todas las estrategias fallaron")
-    return False
-
 def analizar_dropdown_servicios_detallado(driver):
     """Analiza la estructura completa del dropdown para debugging"""
     logger.info("=== ANÁLISIS DETALLADO DEL DROPDOWN DE SERVICIOS ===")
     
+    instantanea = instantanea_documento(driver, ["service_list"])
+    if instantanea:
+        return analizar_dropdown_servicios_local(instantanea)
+    
     try:
         # Verificar si el service_list está visible
         service_list = driver.find_element(By.ID, "service_list")
@@ -364,188 +1323,136 @@ def analizar_dropdown_servicios_detallado(driver):
     except NoSuchElementException:
         logger.warning("⚠️ No se encontró el elemento service_list")
 
-def seleccionar_cardiologia_actualizado(driver, wait):
-    """Selecciona CARDIOLOGÍA con la estructura HTML exacta"""
-    logger.info("=== SELECCIONANDO CARDIOLOGÍA CON ESTRUCTURA ACTUALIZADA ===")
+def analizar_dropdown_servicios_local(instantanea):
+    """Mismo análisis que analizar_dropdown_servicios_detallado sobre la copia local del DOM"""
+    service_list = instantanea["arbol"].get_element_by_id("service_list", None)
+    if service_list is None:
+        logger.warning("⚠️ No se encontró el elemento service_list")
+        return
+    visible = instantanea["visibles"].get("service_list", False)
+    if not visible:
+        logger.warning("⚠️ Lista de servicios no está visible")
+        return
+    logger.info("✅ Lista de servicios (service_list) es visible")
+    
+    # Los botones de la lista se ven cuando la lista se ve
+    cardiologia_buttons = consultar(service_list, ".//button[contains(@data-name, 'CARDIOLOGÍA')]")
+    logger.info(f"🔍 Botones de CARDIOLOGÍA encontrados: {len(cardiologia_buttons)}")
+    for i, btn in enumerate(cardiologia_buttons):
+        logger.info(f"  Botón {i+1}: text='{texto_nodo(btn)}', data-value='{btn.get('data-value')}', "
+                    f"data-name='{btn.get('data-name')}', class='{btn.get('class')}', visible={visible}")
+    
+    subtitle_buttons = consultar(service_list, ".//li[@class='subtitle']//button")
+    logger.info(f"📋 Total de especialidades principales: {len(subtitle_buttons)}")
+    for i, btn in enumerate(subtitle_buttons[:10]):
+        logger.info(f"  Especialidad {i+1}: '{texto_nodo(btn)}' (data-value: {btn.get('data-value')})")
+
+@medido("servicio")
+def seleccionar_cardiologia_actualizado(driver, wait, servicio="1450", nombre_servicio="CARDIOLOGÍA"):
+    """Selecciona el servicio (por defecto CARDIOLOGÍA) con la estructura HTML exacta"""
+    logger.info(f"=== SELECCIONANDO {nombre_servicio or servicio} CON ESTRUCTURA ACTUALIZADA ===")
     
     # Verificar que el dropdown esté abierto y el service_list visible
-    try:
-        service_list = wait.until(EC.presence_of_element_located((By.ID, "service_list")))
-        if not service_list.is_displayed():
-            logger.warning("service_list no está visible, esperando...")
-            wait.until(EC.visibility_of_element_located((By.ID, "service_list")))
-        
-        logger.info("✅ service_list está visible")
-    except TimeoutException:
+    if not esperar_visible(driver, "service_list", timeout=30):
         logger.error("❌ No se pudo encontrar service_list visible")
         return False
     
-    # Selectores específicos para CARDIOLOGÍA basados en el HTML exacto
+    logger.info("✅ service_list está visible")
+    
+    servicio, nombre_servicio = resolver_servicio(driver, servicio, nombre_servicio)
+    if servicio is None:
+        logger.error("❌ El servicio no está en el catálogo del formulario")
+        return False
+    
+    # Selectores específicos para el servicio basados en el HTML exacto
     selectores_cardiologia = [
         # Selector más específico del HTML real
-        (By.XPATH, "//li[@class='subtitle']//button[@class='action service' and @data-value='1450' and @data-name='CARDIOLOGÍA']"),
-        (By.XPATH, "//ul[@id='service_list']//button[@data-value='1450' and @data-name='CARDIOLOGÍA']"),
-        (By.XPATH, "//button[@class='action service' and @data-value='1450']"),
-        (By.XPATH, "//button[@data-value='1450' and text()='CARDIOLOGÍA']"),
-        (By.XPATH, "//li[@class='subtitle']//button[text()='CARDIOLOGÍA']"),
+        (By.XPATH, f"//li[@class='subtitle']//button[@class='action service' and @data-value='{servicio}' and @data-name='{nombre_servicio}']"),
+        (By.XPATH, f"//ul[@id='service_list']//button[@data-value='{servicio}' and @data-name='{nombre_servicio}']"),
+        (By.XPATH, f"//button[@class='action service' and @data-value='{servicio}']"),
+        (By.XPATH, f"//button[@data-value='{servicio}' and text()='{nombre_servicio}']"),
+        (By.XPATH, f"//li[@class='subtitle']//button[text()='{nombre_servicio}']"),
         # Backup con onclick específico
-        (By.XPATH, "//button[@onclick='showServiceOptionSelected(this)' and @data-value='1450']")
+        (By.XPATH, f"//button[@onclick='showServiceOptionSelected(this)' and @data-value='{servicio}']")
     ]
     
-    for selector_type, selector_value in selectores_cardiologia:
-        try:
-            logger.info(f"Buscando CARDIOLOGÍA con: {selector_value}")
-            elementos = driver.find_elements(selector_type, selector_value)
-            logger.info(f"Elementos encontrados: {len(elementos)}")
-            
-            for i, elemento in enumerate(elementos):
-                try:
-                    if elemento.is_displayed() and elemento.is_enabled():
-                        text = elemento.text.strip()
-                        data_value = elemento.get_attribute("data-value")
-                        data_name = elemento.get_attribute("data-name")
-                        class_attr = elemento.get_attribute("class")
-                        
-                        logger.info(f"🎯 Elemento {i+1}: text='{text}', data-value='{data_value}', data-name='{data_name}', class='{class_attr}'")
-                        
-                        if data_value == "1450" and (data_name == "CARDIOLOGÍA" or text == "CARDIOLOGÍA"):
-                            # Scroll al elemento
-                            driver.execute_script("arguments[0].scrollIntoView(true);", elemento)
-                            time.sleep(1)
-                            
-                            if hacer_click_seguro(driver, elemento):
-                                logger.info("✅ CARDIOLOGÍA seleccionada exitosamente!")
-                                time.sleep(2)
-                                return True
-                            
-                except Exception as e:
-                    logger.error(f"Error procesando elemento {i+1}: {e}")
-                    continue
-                    
-        except Exception as e:
-            logger.error(f"Error con selector {selector_value}: {e}")
-            continue
+    # Sin nombre conocido basta con el data-value, que identifica el servicio
+    criterios = [
+        {"atributos": {"data-value": servicio, "data-name": nombre_servicio}},
+        {"atributos": {"data-value": servicio}, "texto": nombre_servicio}
+    ] if nombre_servicio else [{"atributos": {"data-value": servicio}}]
+    
+    logger.info(f"Buscando {nombre_servicio or servicio} con {len(selectores_cardiologia)} selectores en una sola llamada...")
+    resultado = resolver_cascada(driver, selectores_cardiologia, criterios, grupo="selector_servicio")
+    if resultado and hacer_click_seguro(driver, resultado["elemento"]):
+        logger.info(f"✅ {nombre_servicio or servicio} seleccionada exitosamente!")
+        return True
     
     # JavaScript específico para la estructura HTML
     try:
-        logger.info("Intentando seleccionar CARDIOLOGÍA con JavaScript específico...")
-        js_cardiologia = """
-        // Buscar en el service_list específicamente
-        var serviceList = document.getElementById('service_list');
-        if (!serviceList) {
-            return 'ERROR: service_list not found';
-        }
-        
-        // Buscar el botón de CARDIOLOGÍA exacto
-        var cardioButton = serviceList.querySelector('li.subtitle button[data-value="1450"][data-name="CARDIOLOGÍA"]');
-        if (cardioButton && cardioButton.offsetParent !== null) {
-            cardioButton.scrollIntoView();
-            cardioButton.click();
-            return 'SUCCESS: Clicked CARDIOLOGÍA button in service_list';
-        }
-        
-        // Buscar por clase y data-value
-        var actionButtons = serviceList.querySelectorAll('button.action.service[data-value="1450"]');
-        for (var i = 0; i < actionButtons.length; i++) {
-            if (actionButtons[i].getAttribute('data-name') === 'CARDIOLOGÍA' && 
-                actionButtons[i].offsetParent !== null) {
-                actionButtons[i].scrollIntoView();
-                actionButtons[i].click();
-                return 'SUCCESS: Clicked CARDIOLOGÍA by data attributes';
-            }
-        }
-        
-        // Buscar por texto exacto
-        var allButtons = serviceList.querySelectorAll('button');
-        for (var i = 0; i < allButtons.length; i++) {
-            if (allButtons[i].textContent.trim() === 'CARDIOLOGÍA' && 
-                allButtons[i].offsetParent !== null) {
-                allButtons[i].scrollIntoView();
-                allButtons[i].click();
-                return 'SUCCESS: Clicked CARDIOLOGÍA by text';
-            }
-        }
-        
-        return 'ERROR: CARDIOLOGÍA button not found or not visible';
-        """
-        
-        resultado = driver.execute_script(js_cardiologia)
-        logger.info(f"Resultado JavaScript CARDIOLOGÍA: {resultado}")
+        logger.info(f"Intentando seleccionar {nombre_servicio or servicio} con JavaScript específico...")
+        filtro_nombre = f'[data-name="{nombre_servicio}"]' if nombre_servicio else ""
+        resultado = llamar_biblioteca(driver, "clickBoton", ["service_list"], [
+            f'li.subtitle button[data-value="{servicio}"]{filtro_nombre}',
+            f'button.action.service[data-value="{servicio}"]{filtro_nombre}',
+        ], nombre_servicio, False)
+        logger.info(f"Resultado JavaScript {nombre_servicio or servicio}: {resultado}")
         
         if "SUCCESS" in resultado:
-            time.sleep(2)
             return True
             
     except Exception as e:
-        logger.error(f"Error en JavaScript para CARDIOLOGÍA: {e}")
+        logger.error(f"Error en JavaScript para {nombre_servicio or servicio}: {e}")
     
     return False
 
-def seleccionar_subconsulta_cardiologia(driver, wait, tipo_consulta="control"):
-    """Selecciona el tipo específico de consulta de cardiología"""
+@medido("subconsulta")
+def seleccionar_subconsulta_cardiologia(driver, wait, tipo_consulta="control", servicio="1450", esperar_resultados=True):
+    """Selecciona el tipo específico de consulta (clave de consultas_disponibles, data-value o nombre)"""
     logger.info(f"=== SELECCIONANDO SUBCONSULTA DE CARDIOLOGÍA: {tipo_consulta} ===")
     
-    # Mapeo de tipos de consulta según el HTML
-    consultas_disponibles = {
-        "primera_vez": {
-            "data_value": "1510", 
-            "text": "890228 - CONSULTA DE PRIMERA VEZ POR ESPECIALISTA EN CARDIOLOGÍA."
-        },
-        "primera_vez_pediatrica": {
-            "data_value": "3443",
-            "text": "890229 - CONSULTA DE PRIMERA VEZ POR ESPECIALISTA EN CARDIOLOGÍA PEDIÁTRICA"
-        },
-        "control": {
-            "data_value": "1511",
-            "text": "890328 - CONSULTA DE CONTROL O DE SEGUIMIENTO POR ESPECIALISTA EN CARDIOLOGÍA."
-        },
-        "control_pediatrica": {
-            "data_value": "3444",
-            "text": "890329 - CONSULTA DE CONTROL O DE SEGUIMIENTO POR ESPECIALISTA EN CARDIOLOGÍA PEDIÁTRICA"
-        }
-    }
-    
-    if tipo_consulta not in consultas_disponibles:
+    servicio = resolver_servicio(None, servicio)[0] or servicio
+    data_value = id_subconsulta(servicio, tipo_consulta)
+    if data_value is None:
+        leer_catalogo_formulario(driver)
+        data_value = id_subconsulta(servicio, tipo_consulta)
+    if data_value is None:
         logger.error(f"Tipo de consulta '{tipo_consulta}' no válido")
         return False
+    consulta = {"data_value": data_value}
     
-    consulta = consultas_disponibles[tipo_consulta]
+    # Esperar a que el submenú de CARDIOLOGÍA se despliegue tras seleccionar el servicio
+    esperar_condicion_js(
+        driver,
+        "Array.prototype.some.call(document.querySelectorAll('button[data-value=\"' + args[0] + '\"]'), visible)",
+        consulta['data_value'], timeout=10
+    )
     
     selectores_subconsulta = [
-        (By.XPATH, f"//button[@data-value='{consulta['data_value']}' and @data-parent_id='1450']"),
+        (By.XPATH, f"//button[@data-value='{consulta['data_value']}' and @data-parent_id='{servicio}']"),
         (By.XPATH, f"//button[@data-value='{consulta['data_value']}']"),
         (By.XPATH, f"//li[@class='submenu_item']//button[contains(text(), '{consulta['data_value']}')]"),
         (By.XPATH, f"//button[@class='subservice_item service' and @data-value='{consulta['data_value']}']")
     ]
     
-    for selector_type, selector_value in selectores_subconsulta:
-        try:
-            elementos = driver.find_elements(selector_type, selector_value)
-            logger.info(f"Subconsulta selector {selector_value}: {len(elementos)} elementos encontrados")
-            
-            for elemento in elementos:
-                if elemento.is_displayed() and elemento.is_enabled():
-                    text = elemento.text.strip()
-                    data_value = elemento.get_attribute("data-value")
-                    
-                    logger.info(f"🎯 Subconsulta encontrada: text='{text}', data-value='{data_value}'")
-                    
-                    if data_value == consulta['data_value']:
-                        if hacer_click_seguro(driver, elemento):
-                            logger.info(f"✅ Subconsulta {tipo_consulta} seleccionada exitosamente!")
-                            time.sleep(3)
-                            
-                            # NUEVO: Click en el botón de búsqueda después de seleccionar subconsulta
-                            return hacer_click_boton_busqueda(driver, wait)
-                        
-        except Exception as e:
-            logger.error(f"Error con selector subconsulta {selector_value}: {e}")
-            continue
+    resultado = resolver_cascada(driver, selectores_subconsulta, [
+        {"atributos": {"data-value": consulta['data_value']}}
+    ], grupo="selector_subconsulta")
+    if resultado and hacer_click_seguro(driver, resultado["elemento"]):
+        logger.info(f"✅ Subconsulta {tipo_consulta} seleccionada exitosamente!")
+        
+        # NUEVO: Click en el botón de búsqueda después de seleccionar subconsulta
+        return hacer_click_boton_busqueda(driver, wait, esperar_resultados)
     
     return False
 
-def hacer_click_boton_busqueda(driver, wait):
-    """Hace click en el botón de búsqueda después de seleccionar la subconsulta"""
+@medido("busqueda")
+def hacer_click_boton_busqueda(driver, wait, esperar_resultados=True):
+    """Hace click en el botón de búsqueda después de seleccionar la subconsulta.
+    
+    Con esperar_resultados=False vuelve justo después del click (el modo pestañas
+    espera la respuesta del sitio mientras atiende otras pestañas).
+    """
     logger.info("=== HACIENDO CLICK EN BOTÓN DE BÚSQUEDA ===")
     
     try:
@@ -559,19 +1466,18 @@ def hacer_click_boton_busqueda(driver, wait):
             (By.XPATH, "//button[contains(@style, 'background-color: rgb(158, 19, 43)')]")
         ]
         
-        btn_search = None
-        for selector_type, selector_value in selectores_boton_busqueda:
-            try:
-                btn_search = wait.until(EC.element_to_be_clickable((selector_type, selector_value)))
-                logger.info(f"✅ Botón de búsqueda encontrado con selector: {selector_value}")
-                break
-            except TimeoutException:
-                logger.info(f"Botón no encontrado con: {selector_value}")
-                continue
+        # Esperar en el navegador a que btn_search sea visible; si no aparece, probar el resto de selectores
+        btn_search = esperar_visible(driver, "btn_search", timeout=15)
+        if btn_search:
+            logger.info("✅ Botón de búsqueda encontrado con selector: btn_search")
+        else:
+            resultado = resolver_cascada(driver, selectores_boton_busqueda[1:], grupo="selector_boton_busqueda")
+            if resultado:
+                btn_search = resultado["elemento"]
+                logger.info(f"✅ Botón de búsqueda encontrado con selector: {resultado['selector']}")
         
         if btn_search and btn_search.is_displayed() and btn_search.is_enabled():
             driver.execute_script("arguments[0].scrollIntoView(true);", btn_search)
-            time.sleep(2)
             
             # Intentar click con múltiples estrategias
             click_exitoso = False
@@ -610,20 +1516,18 @@ def hacer_click_boton_busqueda(driver, wait):
                 except Exception as e:
                     logger.warning(f"Submit falló: {e}")
             
+            if click_exitoso and not esperar_resultados:
+                logger.info("✅ Búsqueda iniciada (sin esperar resultados)")
+                return True
+            
             if click_exitoso:
-                time.sleep(5)  # Esperar a que procese la búsqueda
+                # Esperar a que la búsqueda muestre la sección de grupos o a que el DOM se estabilice
+                if not esperar_visible(driver, "group_section", timeout=10):
+                    esperar_dom_estable(driver, silencio_ms=500, timeout=5)
                 logger.info("✅ Búsqueda iniciada correctamente")
                 
                 # NUEVO: Scroll hacia arriba después de búsqueda exitosa
-                logger.info("📜 Posicionando página hacia arriba después de búsqueda exitosa...")
-                for step in range(6):
-                    scroll_position = max(0, 1200 - (step * 200))
-                    driver.execute_script(f"window.scrollTo({{top: {scroll_position}, behavior: 'smooth'}});")
-                    time.sleep(0.7)
-                
-                # Scroll final al top
-                driver.execute_script("window.scrollTo({top: 0, behavior: 'smooth'});")
-                time.sleep(2)
+                driver.execute_script("window.scrollTo(0, 0);")
                 logger.info("✅ Página posicionada en la parte superior después de búsqueda")
                 
                 return True
@@ -668,41 +1572,103 @@ def esperar_elementos_dinamicos(driver, wait, timeout=60):
     # 1. Esperar que aparezca el contenedor principal
     try:
         logger.info("Esperando contenedor principal service_dropdown...")
-        service_dropdown = wait.until(EC.presence_of_element_located((By.ID, "service_dropdown")))
+        service_dropdown = esperar_hasta(wait, EC.presence_of_element_located((By.ID, "service_dropdown")))
         logger.info("✅ Contenedor service_dropdown encontrado")
     except TimeoutException:
         logger.error("❌ Contenedor service_dropdown no encontrado")
         return False
     
-    # 2. Esperar tiempo para que JavaScript inicialice
+    # 2. Esperar en el navegador a que JavaScript genere los elementos
     logger.info("Esperando inicialización de JavaScript...")
-    time.sleep(10)
-    
-    # 3. Verificar si los elementos están presentes
     elementos_esperados = ["button_service", "services_drop", "service_list"]
-    elementos_encontrados = []
     
-    for intento in range(6):  # 6 intentos = 1 minuto
-        logger.info(f"Intento {intento + 1}/6 - Verificando elementos...")
-        elementos_encontrados = []
+    # Al menos button_service y services_drop (2 de 3), o lo que exista al agotar el tiempo
+    elementos_encontrados = esperar_condicion_js(
+        driver,
+        "(function (ids) { return ids.length >= 2 && ids; })(args[0].filter(porId))",
+        elementos_esperados, timeout=timeout
+    )
+    if elementos_encontrados:
+        logger.info(f"✅ Elementos suficientes encontrados: {elementos_encontrados}")
+        return True
+    
+    elementos_encontrados = driver.execute_script(
+        "return arguments[0].filter(function (id) { return document.getElementById(id); });",
+        elementos_esperados
+    )
+    logger.warning(f"⚠️ Solo se encontraron: {elementos_encontrados}")
+    return len(elementos_encontrados) > 0
+
+# DROPDOWNS DEL WIDGET
+# Servicios, sedes y profesionales se abren igual: botón, contenedor desplegable y una función
+# global de la página (showList, showGroups, showProfessionals). Cada estrategia se prueba dentro
+# del navegador en el orden que mejor resultado dio, sondeando la visibilidad cada 10ms y volviendo
+# en cuanto el dropdown se abre; si ninguna lo abre se fuerza con estilos.
+limite_estrategia_dropdown = 2.0  # segundos que se espera cada estrategia antes de probar la siguiente
+
+@dataclass(frozen=True, slots=True)
+class Dropdown:
+    """Dropdown del widget: botón que lo abre, contenedor desplegable y función de apertura de la página"""
+    boton: str
+    drop: str
+    funcion_apertura: str
+    grupo: str  # Grupo de las estadísticas de estrategias
+    visibles: tuple = ()  # IDs que cuentan como abierto (por defecto solo drop)
+    
+    def estrategias(self):
+        return [("JavaScript click", "click"), (f"Función {self.funcion_apertura}", "funcion"),
+                ("Click con evento", "evento"), ("Onclick manual", "onclick")]
+    
+    def abrir(self, driver, boton=None, timeout=10):
+        """Abre el dropdown (boton: elemento ya localizado; si no, se espera el ID); True si queda visible"""
+        ids = list(self.visibles or (self.drop,))
+        if boton is None:
+            boton = esperar_visible(driver, self.boton, timeout=timeout)
+            if not boton:
+                logger.error(f"❌ No se encontró el botón {self.boton}")
+                return False
         
-        for elemento_id in elementos_esperados:
-            try:
-                elemento = driver.find_element(By.ID, elemento_id)
-                elementos_encontrados.append(elemento_id)
-                logger.info(f"  ✅ {elemento_id} encontrado")
-            except NoSuchElementException:
-                logger.info(f"  ❌ {elemento_id} no encontrado")
+        estrategias = ordenar_por_historial(self.grupo, self.estrategias())
+        try:
+            resultado = llamar_biblioteca_async(
+                driver, "abrirDropdown", boton, self.funcion_apertura, self.drop, ids,
+                [tipo for _, tipo in estrategias], int(limite_estrategia_dropdown * 1000)
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Error abriendo {self.drop}: {e}")
+            resultado = None
+        if not resultado or "intentos" not in resultado:
+            resultado = {"estrategia": None, "intentos": []}
         
-        if len(elementos_encontrados) >= 2:  # Al menos button_service y services_drop
-            logger.info(f"✅ Elementos suficientes encontrados: {elementos_encontrados}")
+        for (nombre, _), (ms, exito, error) in zip(estrategias, resultado["intentos"]):
+            registrar_resultado_estrategia(self.grupo, nombre, exito, ms / 1000)
+            if error:
+                logger.warning(f"❌ {nombre} falló: {error}")
+            elif exito:
+                logger.info(f"✅ {self.drop} abierto con: {nombre} ({ms} ms)")
+            else:
+                logger.warning(f"{self.drop} no visible con {nombre}")
+        if resultado["estrategia"] == "abierto":
+            logger.info(f"✅ {self.drop} ya estaba abierto")
+        if resultado["estrategia"]:
             return True
         
-        logger.info(f"Solo {len(elementos_encontrados)}/3 elementos encontrados. Esperando...")
-        time.sleep(10)
-    
-    logger.warning(f"⚠️ Solo se encontraron: {elementos_encontrados}")
-    return len(elementos_encontrados) > 0
+        # Forzar apertura modificando el DOM
+        try:
+            logger.info(f"Forzando apertura de {self.drop}...")
+            forzado = llamar_biblioteca(driver, "forzarApertura", ids)
+            if any(forzado.get(id_drop) is True for id_drop in ids):
+                logger.info(f"✅ {self.drop} forzado a abrirse")
+                return True
+            logger.error(f"❌ {self.drop} sigue sin estar visible tras forzar su apertura: {forzado}")
+        except Exception as e:
+            logger.error(f"Error forzando apertura de {self.drop}: {e}")
+        return False
+
+dropdown_servicios = Dropdown("button_service", "services_drop", "showList", "abrir_servicios",
+                              ("services_drop", "service_list"))
+dropdown_grupos = Dropdown("group_button", "groups_drop", "showGroups", "abrir_grupos")
+dropdown_profesionales = Dropdown("professional_button", "professional_drop", "showProfessionals", "abrir_profesionales")
 
 def buscar_button_service_alternativo(driver, wait):
     """Busca el botón de servicio usando múltiples estrategias si no existe el ID"""
@@ -723,39 +1689,19 @@ def buscar_button_service_alternativo(driver, wait):
         (By.XPATH, "//button[contains(@onclick, 'showList') and contains(@class, 'dropbtn')]")
     ]
     
-    for selector_type, selector_value in selectores_alternativos:
-        try:
-            logger.info(f"Probando selector: {selector_value}")
-            elementos = driver.find_elements(selector_type, selector_value)
-            
-            if elementos:
-                for i, elemento in enumerate(elementos):
-                    try:
-                        if elemento.is_displayed() and elemento.is_enabled():
-                            text = elemento.text.strip()
-                            onclick = elemento.get_attribute("onclick") or ""
-                            class_attr = elemento.get_attribute("class") or ""
-                            
-                            logger.info(f"  Elemento {i+1}: text='{text}', onclick='{onclick}', class='{class_attr}'")
-                            
-                            # Verificar que sea el botón correcto
-                            if ("showList" in onclick and "dropbtn" in class_attr) or "Clic para seleccionar" in text:
-                                logger.info(f"✅ Botón de servicio encontrado con selector: {selector_value}")
-                                return elemento
-                                
-                    except Exception as e:
-                        logger.warning(f"Error verificando elemento {i+1}: {e}")
-                        continue
-            else:
-                logger.info(f"  No se encontraron elementos con este selector")
-                
-        except Exception as e:
-            logger.warning(f"Error con selector {selector_value}: {e}")
-            continue
+    # Verificar que sea el botón correcto: onclick con showList y clase dropbtn, o el texto por defecto
+    resultado = resolver_cascada(driver, selectores_alternativos, [
+        {"atributos_contienen": {"onclick": "showList", "class": "dropbtn"}},
+        {"texto_contiene": "Clic para seleccionar"}
+    ], grupo="selector_boton_servicio")
+    if resultado:
+        logger.info(f"✅ Botón de servicio encontrado con selector: {resultado['selector']}")
+        return resultado["elemento"]
     
     logger.error("❌ No se pudo encontrar el botón de servicio con ningún método")
     return None
 
+@medido("dropdown_servicios")
 def abrir_dropdown_con_interaccion_previa(driver, wait):
     """Abre el dropdown, pero primero interactúa con la página para generar elementos"""
     logger.info("=== ABRIENDO DROPDOWN CON INTERACCIÓN PREVIA ===")
@@ -765,14 +1711,12 @@ def abrir_dropdown_con_interaccion_previa(driver, wait):
     try:
         # Scroll hacia abajo y arriba
         driver.execute_script("window.scrollTo(0, 500);")
-        time.sleep(2)
         driver.execute_script("window.scrollTo(0, 0);")
-        time.sleep(2)
         
         # Click en diferentes partes de la página
         body = driver.find_element(By.TAG_NAME, "body")
         body.click()
-        time.sleep(2)
+        esperar_dom_estable(driver, silencio_ms=300, timeout=3)
         
         logger.info("✅ Interacciones realizadas")
     except Exception as e:
@@ -783,106 +1727,14 @@ def abrir_dropdown_con_interaccion_previa(driver, wait):
     if not button_service:
         return False
     
-    # 3. Asegurar que el botón esté en viewport
-    try:
-        driver.execute_script("arguments[0].scrollIntoView({behavior: 'smooth', block: 'center'});", button_service)
-        time.sleep(3)
-        logger.info("✅ Botón en viewport")
-    except Exception as e:
-        logger.warning(f"Error en scroll: {e}")
-    
-    # 4. Estrategias de click específicas para elementos dinámicos
-    estrategias_dinamicas = [
-        ("Click directo después de espera", lambda: (time.sleep(2), button_service.click())[1]),
-        ("JavaScript directo", lambda: driver.execute_script("arguments[0].click();", button_service)),
-        ("Función showList directa", lambda: driver.execute_script("if(typeof showList === 'function') showList('services_drop');")),
-        ("Disparo de evento click", lambda: driver.execute_script("""
-            var event = new MouseEvent('click', {bubbles: true, cancelable: true});
-            arguments[0].dispatchEvent(event);
-        """, button_service)),
-        ("Onclick manual", lambda: driver.execute_script("""
-            var btn = arguments[0];
-            if (btn.onclick) {
-                btn.onclick();
-            } else {
-                eval(btn.getAttribute('onclick'));
-            }
-        """, button_service))
-    ]
-    
-    for nombre, estrategia_func in estrategias_dinamicas:
-        try:
-            logger.info(f"Ejecutando: {nombre}")
-            estrategia_func()
-            logger.info(f"✅ {nombre} ejecutado")
-            
-            # Esperar más tiempo para elementos dinámicos
-            time.sleep(5)
-            
-            # Verificar si apareció el dropdown
-            dropdown_visible = False
-            
-            # Verificar services_drop
-            try:
-                services_drop = driver.find_element(By.ID, "services_drop")
-                if services_drop.is_displayed():
-                    logger.info("✅ services_drop generado y visible")
-                    dropdown_visible = True
-            except NoSuchElementException:
-                logger.info("services_drop aún no generado")
-            
-            # Verificar service_list
-            try:
-                service_list = driver.find_element(By.ID, "service_list")
-                if service_list.is_displayed():
-                    logger.info("✅ service_list generado y visible")
-                    dropdown_visible = True
-            except NoSuchElementException:
-                logger.info("service_list aún no generado")
-            
-            if dropdown_visible:
-                logger.info(f"✅ Dropdown generado exitosamente con: {nombre}")
-                return True
-            else:
-                logger.warning(f"⚠️ {nombre} no generó el dropdown")
-                
-        except Exception as e:
-            logger.warning(f"❌ {nombre} falló: {e}")
-            continue
-    
-    # 5. Último intento: forzar generación del HTML
-    try:
-        logger.info("Último intento: forzar generación del HTML...")
-        resultado = driver.execute_script("""
-            // Intentar llamar showList si existe
-            if (typeof showList === 'function') {
-                showList('services_drop');
-            }
-            
-            // Verificar si existe el contenido después
-            var servicesList = document.getElementById('service_list');
-            var servicesDropdown = document.getElementById('services_drop');
-            
-            return {
-                service_list_exists: servicesList !== null,
-                services_drop_exists: servicesDropdown !== null,
-                service_list_visible: servicesList ? servicesList.offsetParent !== null : false,
-                services_drop_visible: servicesDropdown ? servicesDropdown.offsetParent !== null : false
-            };
-        """)
-        
-        logger.info(f"Estado final de elementos: {resultado}")
-        
-        if resultado.get('service_list_exists') or resultado.get('services_drop_exists'):
-            logger.info("✅ Elementos generados mediante JavaScript")
-            return True
-            
-    except Exception as e:
-        logger.error(f"Error en generación forzada: {e}")
+    # 3. Abrir con las estrategias del dropdown de servicios
+    if dropdown_servicios.abrir(driver, button_service):
+        return True
     
     logger.error("❌ No se pudo generar/abrir el dropdown")
     return False
 
+@trazado
 def proceso_completo_corregido(driver, wait):
     """Proceso completo corregido para elementos dinámicos"""
     logger.info("=== PROCESO COMPLETO CORREGIDO PARA ELEMENTOS DINÁMICOS ===")
@@ -896,7 +1748,7 @@ def proceso_completo_corregido(driver, wait):
         logger.info("✅ Dropdown abierto correctamente")
         
         # PASO 3: Analizar y seleccionar
-        analizar_dropdown_servicios_detallado(driver)
+        diagnosticar(analizar_dropdown_servicios_detallado, driver)
         
         if seleccionar_cardiologia_actualizado(driver, wait):
             logger.info("✅ CARDIOLOGÍA seleccionada")
@@ -914,6 +1766,177 @@ def proceso_completo_corregido(driver, wait):
     
     return False
 
+# DIAGNÓSTICO PEREZOSO E INSTANTÁNEAS DE FALLOS
+# En modo producción (por defecto; CITAS_MODO_PRODUCCION=0 vuelve al diagnóstico completo) los
+# diagnósticos (diagnosticar_pagina_completa, analizar_dropdown_servicios_detallado,
+# debug_iframe_completo) no corren. En su lugar, cuando un paso medido falla se guarda en
+# datos/fallos/ una instantánea: el DOM del documento actual comprimido con gzip y una captura de
+# pantalla. Se toma una por intento o por ronda del modo pestañas (la del primer fallo, que suele
+# ser la causa) y se conservan las últimas max_instantaneas_fallo. Fuera de un intento (vigilancia,
+# benchmark) no se toman: ahí un False es rutina y llenaría el anillo.
+modo_produccion = os.environ.get("CITAS_MODO_PRODUCCION", "1") != "0"
+directorio_fallos = os.path.join(directorio_datos, "fallos")
+max_instantaneas_fallo = 20
+# Instantánea del intento o ronda en curso en este hilo: {"ruta": ...} o None si no hay intento
+contexto_fallos = threading.local()
+
+def diagnosticar(funcion, driver):
+    """Corre un diagnóstico solo fuera del modo producción"""
+    if not modo_produccion:
+        funcion(driver)
+
+def capturar_instantanea_fallo(driver, paso, error=None):
+    """Guarda el DOM comprimido y una captura de pantalla del fallo; devuelve el prefijo de los archivos
+    (None si no hay un intento en curso)"""
+    registro = getattr(contexto_fallos, "registro", None)
+    if registro is None:
+        return None
+    if registro.get("ruta"):
+        return registro["ruta"]
+    
+    with medir_paso("instantanea_fallo"):
+        try:
+            html, url, titulo = driver.execute_script(
+                "return [document.documentElement.outerHTML, location.href, document.title];"
+            )
+        except Exception as e:
+            html, url, titulo = None, None, f"(sin DOM: {e})"
+        try:
+            captura = driver.get_screenshot_as_png()
+        except Exception:
+            captura = None
+        if html is None and captura is None:
+            return None
+        
+        prefijo = os.path.join(directorio_fallos, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{paso}")
+        try:
+            os.makedirs(directorio_fallos, exist_ok=True)
+            if html is not None:
+                with gzip.open(prefijo + ".html.gz", "wt", encoding="utf-8") as archivo:
+                    comentario = f"paso: {paso} | url: {url} | título: {titulo} | error: {error or '-'}"
+                    archivo.write(f"<!-- {comentario.replace('--', '- -')} -->\n{html}")
+            if captura is not None:
+                with open(prefijo + ".png", "wb") as archivo:
+                    archivo.write(captura)
+            
+            # Anillo: conservar solo las instantáneas más recientes (cada una son hasta dos archivos)
+            prefijos = sorted({nombre.split(".")[0] for nombre in os.listdir(directorio_fallos)})
+            for antiguo in prefijos[:-max_instantaneas_fallo]:
+                for extension in (".html.gz", ".png"):
+                    if os.path.exists(os.path.join(directorio_fallos, antiguo + extension)):
+                        os.remove(os.path.join(directorio_fallos, antiguo + extension))
+        except Exception as e:
+            logger.warning(f"No se pudo guardar la instantánea del fallo: {e}")
+            return None
+    
+    logger.info(f"📸 Instantánea del fallo en '{paso}': {prefijo}.*")
+    registro["ruta"] = prefijo
+    return prefijo
+
+# ANÁLISIS LOCAL DEL DOM (LXML)
+# Los diagnósticos y búsquedas de solo lectura piden el HTML del documento actual (la página o el
+# iframe del formulario) en una sola llamada y lo consultan localmente con XPath compilado, en vez
+# de un find_element/get_attribute por elemento. La visibilidad (estilo calculado) no está en el
+# HTML: la misma llamada la trae para los IDs que se piden. Los clicks siguen yendo al navegador.
+# Requiere lxml; CITAS_ANALISIS_LOCAL=0 vuelve a las consultas al navegador.
+analisis_local = lxml_html is not None and os.environ.get("CITAS_ANALISIS_LOCAL", "1") != "0"
+
+js_instantanea_documento = """
+var ids = arguments[0] || [];
+function visible(el) {
+    if (!el || el.getClientRects().length === 0) return false;
+    var estilo = window.getComputedStyle(el);
+    return estilo.visibility !== 'hidden' && estilo.display !== 'none';
+}
+var visibles = {};
+ids.forEach(function (id) { visibles[id] = visible(document.getElementById(id)); });
+return {html: document.documentElement.outerHTML, titulo: document.title, url: location.href, visibles: visibles};
+"""
+
+def instantanea_documento(driver, ids_visibilidad=()):
+    """HTML del documento actual ya parseado, con título, URL y visibilidad de los IDs pedidos.
+    
+    Devuelve None si el análisis local está desactivado o falla (el llamador consulta al navegador).
+    """
+    if not analisis_local:
+        return None
+    try:
+        captura = driver.execute_script(js_instantanea_documento, list(ids_visibilidad))
+        captura["arbol"] = lxml_html.document_fromstring(captura["html"])
+        return captura
+    except Exception as e:
+        logger.debug(f"No se pudo analizar el DOM localmente: {e}")
+        return None
+
+@functools.lru_cache(maxsize=None)
+def compilar_xpath(expresion):
+    return etree.XPath(expresion)
+
+def xpath_de_selector(tipo, valor):
+    """Traduce un selector de Selenium a XPath (None si no tiene traducción directa)"""
+    if tipo == By.XPATH:
+        return valor
+    if tipo == By.ID:
+        return f"//*[@id='{valor}']"
+    if tipo == By.TAG_NAME:
+        return f"//{valor}"
+    if tipo == By.CLASS_NAME:
+        return f"//*[contains(concat(' ', normalize-space(@class), ' '), ' {valor} ')]"
+    return None
+
+def consultar(nodo, expresion):
+    """Evalúa un XPath (compilado una sola vez) sobre el árbol local"""
+    return compilar_xpath(expresion)(nodo)
+
+def texto_nodo(nodo):
+    return " ".join(nodo.text_content().split())
+
+def describir_nodo(nodo, tipo=None):
+    descripcion = {"tag": nodo.tag.upper(), "id": nodo.get("id") or "", "class": nodo.get("class") or "",
+                   "text": texto_nodo(nodo)[:50]}
+    return {"tipo": tipo, **descripcion} if tipo else descripcion
+
+def diagnosticar_pagina_local(driver, instantanea):
+    """Pasos 3 a 8 de diagnosticar_pagina_completa sobre la copia local del DOM"""
+    arbol = instantanea["arbol"]
+    elementos_service = (
+        [describir_nodo(nodo, "ID contains service") for nodo in consultar(arbol, "//*[contains(@id, 'service')]")] +
+        [describir_nodo(nodo, "CLASS contains service") for nodo in consultar(arbol, "//*[contains(@class, 'service')]")] +
+        [describir_nodo(nodo, "DROPDOWN element")
+         for nodo in consultar(arbol, "//*[contains(@class, 'dropdown') or contains(@id, 'dropdown')]")]
+    )
+    logger.info(f"🔍 Elementos relacionados con 'service' encontrados: {len(elementos_service)}")
+    for i, elem in enumerate(elementos_service[:10]):
+        logger.info(f"  {i+1}. {elem}")
+    
+    logger.info(f"📝 Formularios encontrados: {len(consultar(arbol, '//form'))}")
+    
+    botones = consultar(arbol, "//button")
+    logger.info(f"🔘 Botones encontrados: {len(botones)}")
+    for i, boton in enumerate(botones[:5]):
+        logger.info(f"  Botón {i+1}: text='{texto_nodo(boton)[:30]}', onclick='{(boton.get('onclick') or '')[:30]}', "
+                    f"class='{(boton.get('class') or '')[:30]}'")
+    
+    logger.info(f"🖼️ iFrames encontrados: {len(consultar(arbol, '//iframe'))}")
+    
+    # Los errores de JavaScript no están en el DOM: siguen saliendo del log del navegador
+    try:
+        errores_js = [log for log in driver.get_log('browser') if log['level'] == 'SEVERE']
+        logger.info(f"❌ Errores JavaScript: {len(errores_js)}")
+        for error in errores_js[-3:]:
+            logger.warning(f"  JS Error: {error['message'][:100]}")
+    except Exception as e:
+        logger.debug(f"No se pudo leer el log del navegador: {e}")
+    
+    body_html = instantanea["html"].lower()
+    for texto in ["ubicación", "location", "cookies", "javascript", "servicio", "cita", "formulario",
+                  "seleccionar", "cardiología", "especialidad"]:
+        if texto in body_html:
+            logger.info(f"✅ Encontrado en HTML: '{texto}'")
+        else:
+            logger.info(f"❌ NO encontrado en HTML: '{texto}'")
+    return True
+
 def diagnosticar_pagina_completa(driver):
     """Diagnóstica completamente el estado de la página"""
     logger.info("=== DIAGNÓSTICO COMPLETO DE LA PÁGINA ===")
@@ -933,48 +1956,13 @@ def diagnosticar_pagina_completa(driver):
         except:
             logger.info("✅ No hay alertas activas")
         
+        # Con lxml el resto del diagnóstico se resuelve sobre una sola copia del DOM
+        instantanea = instantanea_documento(driver)
+        if instantanea:
+            return diagnosticar_pagina_local(driver, instantanea)
+        
         # 3. Buscar todos los elementos con 'service' en el ID o clase
-        elementos_service = driver.execute_script("""
-            var elementos = [];
-            
-            // Buscar por ID que contenga 'service'
-            var allElements = document.querySelectorAll('*[id*="service"]');
-            for (var i = 0; i < allElements.length; i++) {
-                elementos.push({
-                    tipo: 'ID contains service',
-                    tag: allElements[i].tagName,
-                    id: allElements[i].id,
-                    class: allElements[i].className,
-                    text: allElements[i].textContent.trim().substring(0, 50)
-                });
-            }
-            
-            // Buscar por clase que contenga 'service'
-            var classElements = document.querySelectorAll('*[class*="service"]');
-            for (var i = 0; i < classElements.length; i++) {
-                elementos.push({
-                    tipo: 'CLASS contains service',
-                    tag: classElements[i].tagName,
-                    id: classElements[i].id,
-                    class: classElements[i].className,
-                    text: classElements[i].textContent.trim().substring(0, 50)
-                });
-            }
-            
-            // Buscar dropdowns
-            var dropdowns = document.querySelectorAll('*[class*="dropdown"], *[id*="dropdown"]');
-            for (var i = 0; i < dropdowns.length; i++) {
-                elementos.push({
-                    tipo: 'DROPDOWN element',
-                    tag: dropdowns[i].tagName,
-                    id: dropdowns[i].id,
-                    class: dropdowns[i].className,
-                    text: dropdowns[i].textContent.trim().substring(0, 50)
-                });
-            }
-            
-            return elementos;
-        """)
+        elementos_service = llamar_biblioteca(driver, "elementosServicio")
         
         logger.info(f"🔍 Elementos relacionados con 'service' encontrados: {len(elementos_service)}")
         for i, elem in enumerate(elementos_service[:10]):  # Primeros 10
@@ -1030,37 +2018,33 @@ def diagnosticar_pagina_completa(driver):
         logger.error(f"Error en diagnóstico: {e}")
         return False
 
+@medido("carga")
 def esperar_carga_completa_mejorada(driver, wait):
     """Espera mejorada con múltiples verificaciones"""
     logger.info("=== ESPERA MEJORADA DE CARGA COMPLETA ===")
     
-    # 1. Esperar document.readyState
+    # 1 y 2. Esperar document.readyState = complete y jQuery inactivo (si existe)
     logger.info("Esperando document.readyState = complete...")
-    wait.until(lambda driver: driver.execute_script("return document.readyState") == "complete")
-    logger.info("✅ Document ready")
-    
-    # 2. Esperar jQuery si existe
-    try:
-        wait.until(lambda driver: driver.execute_script("return typeof jQuery === 'undefined' || jQuery.active === 0"))
-        logger.info("✅ jQuery inactivo")
-    except:
-        logger.info("jQuery no detectado")
+    if esperar_documento_listo(driver, timeout=90):
+        logger.info("✅ Document ready y jQuery inactivo")
+    else:
+        logger.warning("⚠️ Document no llegó a complete a tiempo")
     
-    # 3. Esperar que aparezcan elementos básicos
+    # 3. Esperar que aparezcan elementos básicos (formulario o iframe que lo contiene)
     logger.info("Esperando elementos básicos de la página...")
-    time.sleep(10)
+    esperar_condicion_js(driver, "porId('button_service') || document.querySelector('iframe')", timeout=10)
+    esperar_dom_estable(driver, silencio_ms=500, timeout=10)
     
     # 4. Scroll para activar lazy loading
     logger.info("Activando lazy loading con scroll...")
     for i in range(3):
         driver.execute_script(f"window.scrollTo(0, {i * 300});")
-        time.sleep(2)
     
     driver.execute_script("window.scrollTo(0, 0);")
-    time.sleep(3)
+    esperar_dom_estable(driver, silencio_ms=300, timeout=3)
     
-    # 5. Verificar carga con diagnóstico
-    diagnosticar_pagina_completa(driver)
+    # 5. Verificar carga con diagnóstico (fuera del modo producción)
+    diagnosticar(diagnosticar_pagina_completa, driver)
     
     logger.info("Carga mejorada completada")
 
@@ -1089,6 +2073,20 @@ def buscar_elementos_alternativos(driver):
         (By.XPATH, "//*[@data-name]"),
     ]
     
+    instantanea = instantanea_documento(driver)
+    if instantanea:
+        elementos_encontrados = []
+        for selector_type, selector_value in selectores_amplios:
+            elementos = consultar(instantanea["arbol"], xpath_de_selector(selector_type, selector_value))
+            if elementos:
+                logger.info(f"✅ {len(elementos)} elementos encontrados con: {selector_value}")
+                elementos_encontrados.extend(elementos[:3])
+        for i, nodo in enumerate(elementos_encontrados[:10]):
+            descripcion = describir_nodo(nodo)
+            logger.info(f"  Elemento {i+1}: <{nodo.tag}> id='{descripcion['id']}' class='{descripcion['class']}' "
+                        f"text='{descripcion['text']}'")
+        return len(elementos_encontrados) > 0
+    
     elementos_encontrados = []
     
     for selector_type, selector_value in selectores_amplios:
@@ -1131,7 +2129,8 @@ def intentar_diferentes_urls(driver, wait):
             driver.get(url)
             
             # Esperar y diagnosticar
-            time.sleep(10)
+            esperar_documento_listo(driver)
+            esperar_dom_estable(driver, silencio_ms=500, timeout=10)
             
             # Verificar si ahora aparecen elementos
             if buscar_elementos_alternativos(driver):
@@ -1147,6 +2146,7 @@ def intentar_diferentes_urls(driver, wait):
     return False
 
 # FUNCIÓN PRINCIPAL COMPLETAMENTE CORREGIDA
+@trazado
 def proceso_completo_final(driver, wait):
     """Proceso final con diagnóstico completo"""
     logger.info("=== PROCESO COMPLETO FINAL ===")
@@ -1183,67 +2183,332 @@ def proceso_completo_final(driver, wait):
     
     return False
 
+# CATÁLOGO DE SERVICIOS
+# El árbol de service_list (servicios y subservicios con su data-value, nombre y data-parent_id),
+# las sedes de groups_drop por subconsulta y los profesionales por subconsulta y sede se guardan en
+# datos/catalogo_servicios.json. Los objetivos se resuelven en memoria contra el catálogo: el
+# servicio por id o por nombre y la subconsulta por clave de consultas_disponibles, por data-value o
+# por parte de su nombre, así se puede apuntar a cualquier especialidad sin código nuevo. El
+# catálogo se vuelve a leer del formulario (una sola llamada) solo cuando vence (ttl_catalogo) o
+# cuando una búsqueda no lo encuentra; la escritura a disco va en un hilo aparte. Cada
+# actualización publica un dict nuevo (nunca se modifica el publicado), así el hilo de escritura
+# puede volcarlo sin bloquear las búsquedas.
+archivo_catalogo = os.path.join(directorio_datos, "catalogo_servicios.json")
+version_catalogo = 1
+ttl_catalogo = int(os.environ.get("CITAS_TTL_CATALOGO", str(24 * 3600)))  # segundos
+catalogo_servicios = None  # Se carga desde disco en el primer uso
+catalogo_pendiente = False  # Una búsqueda no encontró su objetivo: releer en la próxima oportunidad
+bloqueo_catalogo = threading.RLock()  # catalogo_servicios y catalogo_pendiente (sesiones en hilos)
+bloqueo_archivo_catalogo = threading.Lock()
+
+def catalogo_vacio():
+    return {"version": version_catalogo, "actualizado": 0, "servicios": {}, "sedes": {}, "profesionales": {}}
+
+def cargar_catalogo():
+    """Carga (una sola vez) el catálogo guardado; uno vacío si no existe o es de otra versión"""
+    global catalogo_servicios
+    
+    with bloqueo_catalogo:
+        if catalogo_servicios is None:
+            try:
+                with open(archivo_catalogo, encoding="utf-8") as archivo:
+                    catalogo_servicios = json.load(archivo)
+                if catalogo_servicios.get("version") != version_catalogo:
+                    logger.info("📚 El catálogo guardado es de otra versión; se volverá a leer")
+                    catalogo_servicios = catalogo_vacio()
+            except FileNotFoundError:
+                catalogo_servicios = catalogo_vacio()
+            except Exception as e:
+                logger.warning(f"No se pudo leer el catálogo de servicios: {e}")
+                catalogo_servicios = catalogo_vacio()
+        return catalogo_servicios
+
+def guardar_catalogo():
+    """Vuelca a disco el catálogo publicado en ese momento, así dos escrituras seguidas no dejan el más viejo"""
+    try:
+        os.makedirs(directorio_datos, exist_ok=True)
+        with bloqueo_archivo_catalogo:
+            catalogo = cargar_catalogo()
+            escribir_atomico(archivo_catalogo, json.dumps(catalogo, ensure_ascii=False, indent=1))
+    except Exception as e:
+        logger.warning(f"No se pudo guardar el catálogo de servicios: {e}")
+
+def catalogo_vencido():
+    return time.time() - cargar_catalogo()["actualizado"] > ttl_catalogo
+
+def buscar_servicio_catalogo(servicio):
+    """(id, nombre) del servicio dado por data-value o por nombre, o None si no está en el catálogo"""
+    with bloqueo_catalogo:
+        servicios = cargar_catalogo()["servicios"]
+        if str(servicio) in servicios:
+            return str(servicio), servicios[str(servicio)]["nombre"]
+        buscado = str(servicio).casefold()
+        for id_servicio, datos in servicios.items():
+            if datos["nombre"].casefold() == buscado:
+                return id_servicio, datos["nombre"]
+        return None
+
+def id_subconsulta(servicio, subconsulta):
+    """data-value de la subconsulta (clave de consultas_disponibles, data-value o parte del nombre)"""
+    global catalogo_pendiente
+    
+    if str(subconsulta).isdigit():
+        return str(subconsulta)
+    with bloqueo_catalogo:
+        encontrado = buscar_servicio_catalogo(servicio)
+        subservicios = cargar_catalogo()["servicios"][encontrado[0]]["subservicios"] if encontrado else {}
+        # consultas_disponibles es de cardiología: sus claves solo valen si el servicio no las contradice
+        if subconsulta in consultas_disponibles:
+            data_value = consultas_disponibles[subconsulta]["data_value"]
+            if not subservicios or data_value in subservicios:
+                return data_value
+        buscado = str(subconsulta).replace("_", " ").casefold()
+        for id_sub, nombre in subservicios.items():
+            if buscado in nombre.casefold():
+                return id_sub
+        catalogo_pendiente = True
+        return None
+
+def leer_catalogo_formulario(driver, objetivo=None):
+    """Lee el catálogo presente en el formulario (una llamada) y lo guarda en segundo plano"""
+    global catalogo_servicios, catalogo_pendiente
+    
+    try:
+        lectura = llamar_biblioteca(driver, "leerCatalogo")
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo leer el catálogo del formulario: {e}")
+        return False
+    
+    with bloqueo_catalogo:
+        anterior = cargar_catalogo()
+        catalogo = json.loads(json.dumps(anterior))  # copia: el publicado no se modifica
+        if lectura["servicios"]:
+            servicios = {}
+            for valor, nombre, padre in lectura["servicios"]:
+                if not padre:
+                    servicios.setdefault(valor, {"nombre": nombre, "subservicios": {}})["nombre"] = nombre
+            for valor, nombre, padre in lectura["servicios"]:
+                if padre:
+                    servicios.setdefault(padre, {"nombre": padre, "subservicios": {}})["subservicios"][valor] = nombre
+            catalogo["servicios"] = servicios
+            catalogo["actualizado"] = time.time()
+        # Se publica ya para resolver la subconsulta con los servicios leídos; mientras se tenga el
+        # bloqueo ningún otro hilo lo ve a medias
+        catalogo_servicios = catalogo
+        if objetivo:
+            subconsulta = id_subconsulta(objetivo["servicio"], objetivo["subconsulta"]) or str(objetivo["subconsulta"])
+            if lectura["sedes"]:
+                catalogo["sedes"][subconsulta] = lectura["sedes"]
+            if lectura["profesionales"]:
+                catalogo["profesionales"][f"{subconsulta}|{objetivo['ciudad']}"] = lectura["profesionales"]
+        catalogo_pendiente = False
+        cambio = catalogo != anterior
+    
+    if cambio:
+        logger.info(f"📚 Catálogo actualizado: {len(catalogo['servicios'])} servicios, "
+                    f"{sum(len(s['subservicios']) for s in catalogo['servicios'].values())} subservicios")
+        threading.Thread(target=guardar_catalogo, daemon=True).start()
+    return True
+
+def actualizar_catalogo_si_hace_falta(driver, objetivo):
+    """Relee el catálogo con el formulario ya recorrido si venció, si hubo una búsqueda fallida o si
+    faltan las sedes y profesionales del objetivo"""
+    with bloqueo_catalogo:
+        catalogo = cargar_catalogo()
+        subconsulta = id_subconsulta(objetivo["servicio"], objetivo["subconsulta"]) or str(objetivo["subconsulta"])
+        hace_falta = catalogo_pendiente or catalogo_vencido() or subconsulta not in catalogo["sedes"] or \
+            f"{subconsulta}|{objetivo['ciudad']}" not in catalogo["profesionales"]
+    if hace_falta:
+        leer_catalogo_formulario(driver, objetivo)
+
+def resolver_servicio(driver, servicio, nombre_servicio=None):
+    """(id, nombre) del servicio según el catálogo, releyéndolo del formulario si no lo encuentra"""
+    encontrado = buscar_servicio_catalogo(servicio)
+    if encontrado is None and driver is not None:
+        logger.info(f"📚 {servicio} no está en el catálogo; leyéndolo del formulario...")
+        leer_catalogo_formulario(driver)
+        encontrado = buscar_servicio_catalogo(servicio)
+    if encontrado:
+        return encontrado[0], nombre_servicio or encontrado[1]
+    # Sin catálogo se usa el objetivo tal como viene (si el servicio ya es un data-value)
+    return (str(servicio) if str(servicio).isdigit() else None), nombre_servicio
+
+# CONDUCCIÓN DEL WIDGET POR SUS PROPIAS FUNCIONES
+# En vez de la coreografía de scroll, clicks simulados y pausas de cada paso, se llaman los
+# manejadores del widget (showList, showServiceOptionSelected, showGroups, showProfessionals y el
+# click de cada opción) con los ids del catálogo en un solo script asíncrono, que tras cada
+# llamada espera en la página a que se verifique su efecto. Si un paso no se verifica se sigue con
+# el flujo por interacción. Se desactiva con CITAS_MODO_API=0 (el modo pestañas siempre la usa,
+# paso a paso, para no bloquear las demás pestañas).
+modo_api = os.environ.get("CITAS_MODO_API", "1") != "0"
+# Pasos del recorrido (los mismos de conducirFormulario) y cuánto se espera la verificación de cada
+# uno en el modo pestañas; búsqueda y ciudad esperan respuestas del servidor
+pasos_formulario = ["abrir_servicios", "servicio", "subconsulta", "busqueda", "abrir_grupos", "ciudad",
+                    "abrir_profesionales", "profesional"]
+limites_pasos_formulario = {"busqueda": 90, "ciudad": 90, "abrir_profesionales": 30}
+limite_paso_formulario = 10
+
+def datos_conduccion(objetivo):
+    """Objetivo con los ids del catálogo para conducirFormulario, o None si no se pueden resolver"""
+    servicio = resolver_servicio(None, objetivo["servicio"])[0]
+    subconsulta = id_subconsulta(objetivo["servicio"], objetivo["subconsulta"])
+    if servicio is None or subconsulta is None:
+        return None
+    return {"servicio": servicio, "subconsulta": subconsulta, "ciudad": objetivo["ciudad"],
+            "profesional": objetivo.get("profesional", "Cualquier profesional")}
+
+def conducir_widget(driver, objetivo, desde="abrir_servicios", timeout=90):
+    """Recorre el formulario con las funciones del widget; True si todos los pasos se verificaron"""
+    datos = datos_conduccion(objetivo)
+    if datos is None:
+        logger.info("🔌 El objetivo no tiene ids en el catálogo; se usa el flujo por interacción")
+        return False
+    
+    with medir_paso("api"):
+        try:
+            resultado = llamar_biblioteca_async(driver, "conducirFormulario", datos, desde, int(timeout * 1000))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo recorrer el formulario con las funciones del widget: {e}")
+            return False
+    
+    if "tiempos" not in resultado:
+        logger.warning(f"⚠️ Error en las funciones del widget: {resultado.get('error')}")
+        return False
+    tiempos = ", ".join(f"{paso} {ms} ms" for paso, ms in resultado["tiempos"].items())
+    if resultado["ok"]:
+        logger.info(f"🔌 Formulario recorrido con las funciones del widget ({tiempos})")
+        return True
+    logger.warning(f"⚠️ Paso '{resultado['paso']}' no verificado con las funciones del widget "
+                   f"({resultado['error'] or 'tiempo agotado'}); {tiempos}")
+    return False
+
+# CACHÉ DEL IFRAME DEL FORMULARIO
+# Se recuerda el iframe que tenía button_service (src, id, name e índice) para probarlo primero
+archivo_cache_iframe = os.path.join(directorio_datos, "cache_iframe.json")
+cache_iframe = None  # Se carga desde disco en el primer uso; {} si no hay caché
+
+# Describe todos los iframes en una sola llamada: cuál coincide con la caché, en cuál de los
+# del mismo origen ya está button_service y cuáles no se pueden inspeccionar desde aquí
+js_localizar_iframe_formulario = """
+var cache = arguments[0] || {};
+var iframes = document.getElementsByTagName('iframe');
+var resultado = {iframes: [], cacheado: null, encontrado: null};
+
+function sinQuery(url) { return (url || '').split('?')[0]; }
+
+for (var i = 0; i < iframes.length; i++) {
+    var iframe = iframes[i];
+    var info = {elemento: iframe, indice: i, src: iframe.getAttribute('src') || '',
+                id: iframe.id || '', name: iframe.name || '', accesible: false, listo: false};
+    try {
+        var doc = iframe.contentDocument;
+        if (doc) {
+            info.accesible = true;
+            info.listo = doc.readyState === 'complete';
+            if (resultado.encontrado === null && doc.getElementById('button_service')) resultado.encontrado = i;
+        }
+    } catch (e) { /* iframe de otro origen */ }
+    resultado.iframes.push(info);
+}
+
+// Coincidencia con la caché: primero por id, luego name, luego src (sin query) y por último el índice
+var criterios = [
+    function (f) { return cache.id && f.id === cache.id; },
+    function (f) { return cache.name && f.name === cache.name; },
+    function (f) { return cache.src && sinQuery(f.src) === sinQuery(cache.src); },
+    function (f) { return cache.indice !== undefined && f.indice === cache.indice; }
+];
+for (var c = 0; c < criterios.length && resultado.cacheado === null; c++) {
+    for (var j = 0; j < resultado.iframes.length; j++) {
+        if (criterios[c](resultado.iframes[j])) { resultado.cacheado = j; break; }
+    }
+}
+return resultado;
+"""
+
+def cargar_cache_iframe():
+    """Carga (una sola vez) la ubicación del iframe del formulario guardada en disco"""
+    global cache_iframe
+    
+    if cache_iframe is None:
+        try:
+            with open(archivo_cache_iframe, encoding="utf-8") as archivo:
+                cache_iframe = json.load(archivo)
+        except FileNotFoundError:
+            cache_iframe = {}
+        except Exception as e:
+            logger.warning(f"No se pudo leer la caché del iframe: {e}")
+            cache_iframe = {}
+    return cache_iframe
+
+def guardar_cache_iframe(info_iframe):
+    """Recuerda el iframe que contenía button_service"""
+    global cache_iframe
+    
+    nuevo = {clave: info_iframe.get(clave) for clave in ("src", "id", "name", "indice")}
+    if nuevo == cache_iframe:
+        return
+    cache_iframe = nuevo
+    try:
+        os.makedirs(directorio_datos, exist_ok=True)
+        with open(archivo_cache_iframe, "w", encoding="utf-8") as archivo:
+            json.dump(cache_iframe, archivo, ensure_ascii=False)
+        logger.info(f"💾 Iframe del formulario recordado: {cache_iframe}")
+    except Exception as e:
+        logger.warning(f"No se pudo guardar la caché del iframe: {e}")
+
+@medido("iframe")
 def cambiar_a_iframe_formulario(driver, wait):
     """Cambia al iframe que contiene el formulario de citas"""
     logger.info("=== CAMBIANDO AL IFRAME DEL FORMULARIO ===")
     
     try:
-        # Buscar todos los iframes
-        iframes = driver.find_elements(By.TAG_NAME, "iframe")
+        # Inspeccionar todos los iframes de una vez
+        estado = driver.execute_script(js_localizar_iframe_formulario, cargar_cache_iframe())
+        iframes = estado["iframes"]
         logger.info(f"🖼️ Total de iframes encontrados: {len(iframes)}")
         
-        for i, iframe in enumerate(iframes):
+        # 1. El iframe del mismo origen que ya contiene button_service
+        if estado["encontrado"] is not None:
+            info = iframes[estado["encontrado"]]
+            driver.switch_to.frame(info["elemento"])
+            logger.info(f"🎯 ¡ENCONTRADO! button_service está en iframe {info['indice'] + 1} (revisión en una sola llamada)")
+            guardar_cache_iframe(info)
+            return True
+        
+        # 2. Los iframes que hay que visitar: primero el de la caché, luego los de otro origen
+        #    o los que aún no terminan de cargar (los del mismo origen ya cargados se descartan)
+        pendientes = [info for info in iframes if not info["accesible"] or not info["listo"]]
+        if estado["cacheado"] is not None:
+            cacheado = iframes[estado["cacheado"]]
+            pendientes = [cacheado] + [info for info in pendientes if info is not cacheado]
+            logger.info(f"📌 Probando primero el iframe recordado: {cache_iframe}")
+        
+        for info in pendientes:
+            i = info["indice"]
             try:
-                # Obtener información del iframe
-                src = iframe.get_attribute("src") or ""
-                name = iframe.get_attribute("name") or ""
-                id_attr = iframe.get_attribute("id") or ""
-                class_attr = iframe.get_attribute("class") or ""
-                
-                logger.info(f"  Iframe {i+1}: src='{src[:50]}...', name='{name}', id='{id_attr}', class='{class_attr}'")
+                logger.info(f"  Iframe {i+1}: src='{info['src'][:50]}...', name='{info['name']}', id='{info['id']}'")
                 
                 # Cambiar al iframe
-                driver.switch_to.frame(iframe)
+                driver.switch_to.frame(info["elemento"])
                 logger.info(f"✅ Cambiado al iframe {i+1}")
                 
-                # Esperar un poco para que cargue
-                time.sleep(5)
-                
-                # Buscar elementos del formulario dentro del iframe
-                try:
-                    # Buscar el button_service dentro del iframe
-                    button_service = driver.find_element(By.ID, "button_service")
+                # Esperar a que cargue el documento del iframe y, si es el del formulario, button_service
+                esperar_documento_listo(driver, timeout=5)
+                if esperar_presente(driver, "button_service", timeout=2):
                     logger.info(f"🎯 ¡ENCONTRADO! button_service está en iframe {i+1}")
-                    
-                    # VERIFICAR TAMBIÉN SI TIENE LA SECCIÓN DE GRUPOS
-                    try:
-                        group_section = driver.find_element(By.ID, "group_section")
-                        logger.info(f"🎯 ¡BONUS! group_section también está en iframe {i+1}")
-                    except NoSuchElementException:
-                        logger.info(f"group_section no está aún en iframe {i+1}, aparecerá después")
-                    
+                    guardar_cache_iframe(info)
                     return True
-                    
-                except NoSuchElementException:
-                    logger.info(f"  button_service no está en iframe {i+1}")
                 
-                # Buscar elementos alternativos del formulario
-                try:
-                    elements_formulario = driver.find_elements(By.XPATH, "//*[contains(@id, 'service') or contains(@class, 'service')]")
-                    if elements_formulario:
-                        logger.info(f"🎯 ¡Elementos de servicio encontrados en iframe {i+1}! Total: {len(elements_formulario)}")
-                        return True
-                except:
-                    pass
+                logger.info(f"  button_service no está en iframe {i+1}")
                 
-                # Buscar dropdowns
-                try:
-                    dropdowns = driver.find_elements(By.XPATH, "//*[contains(@class, 'dropdown') or contains(@id, 'dropdown')]")
-                    if dropdowns:
-                        logger.info(f"🎯 ¡Dropdowns encontrados en iframe {i+1}! Total: {len(dropdowns)}")
-                        return True
-                except:
-                    pass
+                # Buscar elementos alternativos del formulario o dropdowns
+                alternativos = driver.execute_script("""
+                    return document.querySelectorAll('[id*="service"], [class*="service"], [id*="dropdown"], [class*="dropdown"]').length;
+                """)
+                if alternativos:
+                    logger.info(f"🎯 ¡Elementos de servicio o dropdowns encontrados en iframe {i+1}! Total: {alternativos}")
+                    return True
                 
                 # Salir del iframe para probar el siguiente
                 driver.switch_to.default_content()
@@ -1265,9 +2530,11 @@ def cambiar_a_iframe_formulario(driver, wait):
         logger.error(f"Error buscando iframes: {e}")
         return False
 
-def proceso_con_iframe(driver, wait):
+@trazado
+def proceso_con_iframe(driver, wait, objetivo=None):
     """Proceso completo considerando que el formulario está en iframe"""
     logger.info("=== PROCESO CON IFRAME ===")
+    objetivo = objetivo or objetivo_por_defecto
     
     # PASO 1: Cambiar al iframe correcto
     if not cambiar_a_iframe_formulario(driver, wait):
@@ -1278,18 +2545,21 @@ def proceso_con_iframe(driver, wait):
     
     # PASO 2: Intentar el proceso original dentro del iframe
     try:
+        if modo_api and conducir_widget(driver, objetivo):
+            return True
+        
         # Ahora que estamos en el iframe, buscar elementos
         if abrir_dropdown_con_interaccion_previa(driver, wait):
             logger.info("✅ Dropdown abierto en iframe")
             
-            if seleccionar_cardiologia_actualizado(driver, wait):
+            if seleccionar_cardiologia_actualizado(driver, wait, objetivo["servicio"], objetivo.get("nombre_servicio")):
                 logger.info("✅ CARDIOLOGÍA seleccionada en iframe")
                 
-                if seleccionar_subconsulta_cardiologia(driver, wait, "control"):
+                if seleccionar_subconsulta_cardiologia(driver, wait, objetivo["subconsulta"], objetivo["servicio"]):
                     logger.info("✅ Subconsulta seleccionada y búsqueda iniciada en iframe")
                     
                     # NUEVO: Seleccionar Medellín DENTRO DEL MISMO IFRAME
-                    if proceso_seleccion_medellin(driver, wait):
+                    if proceso_seleccion_medellin(driver, wait, objetivo["ciudad"]):
                         logger.info("✅ Medellín seleccionado en iframe")
                         return True
                     else:
@@ -1297,16 +2567,18 @@ def proceso_con_iframe(driver, wait):
                         return True  # Continuar aunque falle Medellín
         else:
             logger.warning("⚠️ No se pudo abrir dropdown en iframe, intentando debug...")
-            debug_iframe_completo(driver)
+            diagnosticar(debug_iframe_completo, driver)
             
     except Exception as e:
         logger.error(f"Error en proceso iframe: {e}")
     
     return False
 
-def proceso_completo_final_actualizado(driver, wait):
+@trazado
+def proceso_completo_final_actualizado(driver, wait, objetivo=None):
     """Proceso final actualizado considerando iframe"""
     logger.info("=== PROCESO COMPLETO FINAL ACTUALIZADO ===")
+    objetivo = objetivo or objetivo_por_defecto
     
     # PASO 1: Espera y diagnóstico inicial
     esperar_carga_completa_mejorada(driver, wait)
@@ -1338,18 +2610,21 @@ def proceso_completo_final_actualizado(driver, wait):
     if formulario_en_pagina_principal:
         logger.info("🎯 Formulario detectado en página principal, procesando...")
         try:
+            if modo_api and conducir_widget(driver, objetivo):
+                return True
+            
             if abrir_dropdown_con_interaccion_previa(driver, wait):
                 logger.info("✅ Dropdown abierto en página principal")
                 
-                if seleccionar_cardiologia_actualizado(driver, wait):
+                if seleccionar_cardiologia_actualizado(driver, wait, objetivo["servicio"], objetivo.get("nombre_servicio")):
                     logger.info("✅ CARDIOLOGÍA seleccionada en página principal")
                     
                     # El botón de búsqueda se hace click dentro de seleccionar_subconsulta_cardiologia
-                    if seleccionar_subconsulta_cardiologia(driver, wait, "control"):
+                    if seleccionar_subconsulta_cardiologia(driver, wait, objetivo["subconsulta"], objetivo["servicio"]):
                         logger.info("✅ Subconsulta seleccionada y búsqueda iniciada")
                         
                         # DESPUÉS: Seleccionar Medellín en la siguiente pantalla
-                        if proceso_seleccion_medellin(driver, wait):
+                        if proceso_seleccion_medellin(driver, wait, objetivo["ciudad"]):
                             logger.info("✅ Proceso completo exitoso - Medellín seleccionado")
                             return True
                         else:
@@ -1363,7 +2638,7 @@ def proceso_completo_final_actualizado(driver, wait):
     
     # PASO 3: Intentar con iframe
     logger.info("🔄 Intentando buscar formulario en iframe...")
-    if proceso_con_iframe(driver, wait):
+    if proceso_con_iframe(driver, wait, objetivo):
         logger.info("✅ Proceso exitoso en iframe")
         logger.info("🎯 Proceso completado exitosamente dentro del iframe - NO ejecutar más procesos")
         # CORREGIDO: NO intentar más procesos después del iframe exitoso
@@ -1375,92 +2650,77 @@ def proceso_completo_final_actualizado(driver, wait):
     logger.info("🔄 Intentando URLs alternativas...")
     if intentar_diferentes_urls(driver, wait):
         logger.info("✅ Elementos encontrados con URL alternativa")
-        return proceso_completo_final_actualizado(driver, wait)
+        return proceso_completo_final_actualizado(driver, wait, objetivo)
     
     logger.error("❌ Todas las estrategias fallaron")
     return False
 
-def abrir_dropdown_grupos(driver, wait):
-    """Abre el dropdown de grupos/sedes"""
-    logger.info("=== ABRIENDO DROPDOWN DE GRUPOS/SEDES ===")
-    
+# REBÚSQUEDA EN CALIENTE
+# Tras un intento completo el formulario queda cargado con servicio, subconsulta, ciudad y
+# profesional elegidos; los siguientes intentos solo repiten la búsqueda (btn_search) en vez
+# de recargar la página. Se desactiva con CITAS_MODO_CALIENTE=0.
+modo_caliente = os.environ.get("CITAS_MODO_CALIENTE", "1") != "0"
+
+def entrar_contexto_formulario(driver):
+    """Deja el driver en el documento del formulario ya cargado (página principal o su iframe)"""
+    driver.switch_to.default_content()
+    if driver.find_elements(By.ID, "btn_search"):
+        return True
+    return reentrar_iframe_formulario(driver)
+
+@medido("busqueda_caliente", instantanea=False)
+def rebuscar_en_caliente(driver, wait, objetivo):
+    """Repite la búsqueda sobre el formulario ya cargado; False si hay que recargar la página"""
     try:
-        # Buscar el botón de grupos
-        group_button = wait.until(EC.element_to_be_clickable((By.ID, "group_button")))
-        logger.info("✅ Botón de grupos encontrado")
-        
-        # Verificar que el texto sea el correcto
-        span_text = group_button.find_element(By.ID, "selected_place").text
-        logger.info(f"📋 Texto actual del botón: '{span_text}'")
-        
-        # Scroll al elemento
-        driver.execute_script("arguments[0].scrollIntoView(true);", group_button)
-        time.sleep(2)
-        
-        # Estrategias para abrir el dropdown
-        estrategias_grupos = [
-            ("Click directo", lambda: group_button.click()),
-            ("JavaScript click", lambda: driver.execute_script("arguments[0].click();", group_button)),
-            ("Función showGroups", lambda: driver.execute_script("showGroups('groups_drop');")),
-            ("Click con evento", lambda: driver.execute_script("""
-                var event = new MouseEvent('click', {bubbles: true, cancelable: true});
-                arguments[0].dispatchEvent(event);
-            """, group_button))
-        ]
-        
-        for nombre, estrategia_func in estrategias_grupos:
-            try:
-                logger.info(f"Intentando abrir grupos con: {nombre}")
-                estrategia_func()
-                time.sleep(3)
-                
-                # Verificar si se abrió
-                try:
-                    groups_drop = driver.find_element(By.ID, "groups_drop")
-                    if groups_drop.is_displayed():
-                        logger.info(f"✅ Dropdown de grupos abierto con: {nombre}")
-                        return True
-                except NoSuchElementException:
-                    logger.warning(f"groups_drop no encontrado con {nombre}")
-                    
-            except Exception as e:
-                logger.warning(f"❌ {nombre} falló: {e}")
-                continue
+        if not entrar_contexto_formulario(driver):
+            return False
         
-        # Forzar apertura modificando DOM
-        try:
-            logger.info("Forzando apertura del dropdown de grupos...")
-            resultado = driver.execute_script("""
-                var groupsDropdown = document.getElementById('groups_drop');
-                if (groupsDropdown) {
-                    groupsDropdown.style.display = 'block';
-                    groupsDropdown.style.visibility = 'visible';
-                    groupsDropdown.classList.add('show');
-                    return true;
-                }
-                return false;
-            """)
-            
-            if resultado:
-                logger.info("✅ Dropdown de grupos forzado a abrirse")
-                return True
-                
-        except Exception as e:
-            logger.error(f"Error forzando apertura de grupos: {e}")
+        btn_search = esperar_visible(driver, "btn_search", timeout=2)
+        if not btn_search or not btn_search.is_enabled():
+            logger.info("♨️ btn_search no está disponible en la página cargada")
+            return False
         
-        return False
+        # El sitio real no oculta los grupos entre búsquedas: sin esperar una respuesta nueva se
+        # leería la agenda de la búsqueda anterior
+        respuestas = llamar_biblioteca(driver, "respuestas")
+        driver.execute_script("arguments[0].click();", btn_search)
+        logger.info("✅ Búsqueda repetida con btn_search")
+        if not esperar_condicion_js(driver, "window.__citasRespuestas > args[0]", respuestas, timeout=30):
+            logger.warning("⚠️ No llegó respuesta a la búsqueda repetida")
+            return False
         
-    except TimeoutException:
-        logger.error("❌ No se encontró el botón de grupos")
+        # La respuesta de la búsqueda redibuja los grupos: esperar a que aparezcan y el DOM se calme
+        if not esperar_visible(driver, "group_section", timeout=30):
+            logger.warning("⚠️ La sección de grupos no apareció tras repetir la búsqueda")
+            return False
+        esperar_dom_estable(driver, silencio_ms=500, timeout=10)
+        
+        # Si la búsqueda reinició la ciudad, se vuelve a elegir sin recargar la página
+        if not esperar_texto(driver, "selected_place", objetivo["ciudad"], timeout=2):
+            logger.info(f"♨️ La búsqueda reinició la selección; eligiendo {objetivo['ciudad']} de nuevo")
+            if modo_api and conducir_widget(driver, objetivo, desde="abrir_grupos"):
+                return True
+            return proceso_seleccion_medellin(driver, wait, objetivo["ciudad"])
+        return True
+        
+    except Exception as e:
+        logger.warning(f"⚠️ Error repitiendo la búsqueda en caliente: {e}")
         return False
 
-def seleccionar_medellin(driver, wait):
-    """Selecciona Medellín en el dropdown de grupos"""
-    logger.info("=== SELECCIONANDO MEDELLÍN ===")
+@medido("dropdown_grupos")
+def abrir_dropdown_grupos(driver, wait):
+    """Abre el dropdown de grupos/sedes"""
+    logger.info("=== ABRIENDO DROPDOWN DE GRUPOS/SEDES ===")
+    return dropdown_grupos.abrir(driver, timeout=30)
+
+@medido("grupo")
+def seleccionar_medellin(driver, wait, ciudad="Medellín"):
+    """Selecciona la ciudad (por defecto Medellín) en el dropdown de grupos"""
+    logger.info(f"=== SELECCIONANDO {ciudad.upper()} ===")
     
     try:
         # Verificar que el dropdown esté abierto
-        groups_drop = wait.until(EC.presence_of_element_located((By.ID, "groups_drop")))
+        groups_drop = esperar_hasta(wait, EC.presence_of_element_located((By.ID, "groups_drop")))
         if not groups_drop.is_displayed():
             logger.warning("dropdown de grupos no visible, intentando abrirlo...")
             if not abrir_dropdown_grupos(driver, wait):
@@ -1471,87 +2731,33 @@ def seleccionar_medellin(driver, wait):
         
         # Selectores específicos para Medellín
         selectores_medellin = [
-            (By.XPATH, "//button[@data-value='Medellín' and @data-name='Medellín']"),
-            (By.XPATH, "//button[@class='action place' and @data-value='Medellín']"),
-            (By.XPATH, "//li[@class='places_list']//button[text()='Medellín']"),
-            (By.XPATH, "//ul[@id='group']//button[contains(text(), 'Medellín')]"),
-            (By.XPATH, "//button[@id='button_place_text' and text()='Medellín']")
+            (By.XPATH, f"//button[@data-value='{ciudad}' and @data-name='{ciudad}']"),
+            (By.XPATH, f"//button[@class='action place' and @data-value='{ciudad}']"),
+            (By.XPATH, f"//li[@class='places_list']//button[text()='{ciudad}']"),
+            (By.XPATH, f"//ul[@id='group']//button[contains(text(), '{ciudad}')]"),
+            (By.XPATH, f"//button[@id='button_place_text' and text()='{ciudad}']")
         ]
         
-        for selector_type, selector_value in selectores_medellin:
-            try:
-                logger.info(f"Buscando Medellín con: {selector_value}")
-                elementos = driver.find_elements(selector_type, selector_value)
-                logger.info(f"Elementos encontrados: {len(elementos)}")
-                
-                for i, elemento in enumerate(elementos):
-                    try:
-                        if elemento.is_displayed() and elemento.is_enabled():
-                            text = elemento.text.strip()
-                            data_value = elemento.get_attribute("data-value")
-                            data_name = elemento.get_attribute("data-name")
-                            
-                            logger.info(f"🎯 Elemento {i+1}: text='{text}', data-value='{data_value}', data-name='{data_name}'")
-                            
-                            if text == "Medellín" and data_value == "Medellín":
-                                # Scroll al elemento
-                                driver.execute_script("arguments[0].scrollIntoView(true);", elemento)
-                                time.sleep(1)
-                                
-                                if hacer_click_seguro(driver, elemento):
-                                    logger.info("✅ Medellín seleccionado exitosamente!")
-                                    time.sleep(3)
-                                    return True
-                                    
-                    except Exception as e:
-                        logger.error(f"Error procesando elemento Medellín {i+1}: {e}")
-                        continue
-                        
-            except Exception as e:
-                logger.error(f"Error con selector Medellín {selector_value}: {e}")
-                continue
+        logger.info(f"Buscando {ciudad} con {len(selectores_medellin)} selectores en una sola llamada...")
+        resultado = resolver_cascada(driver, selectores_medellin, [
+            {"atributos": {"data-value": ciudad}, "texto": ciudad}
+        ], grupo="selector_grupo")
+        if resultado and hacer_click_seguro(driver, resultado["elemento"]):
+            logger.info(f"✅ {ciudad} seleccionado exitosamente!")
+            return True
         
         # JavaScript específico para Medellín
         try:
-            logger.info("Intentando seleccionar Medellín con JavaScript específico...")
-            js_medellin = """
-            // Buscar en el dropdown de grupos
-            var groupDropdown = document.getElementById('group_dropdown_list');
-            if (!groupDropdown) {
-                return 'ERROR: group_dropdown_list not found';
-            }
-            
-            // Buscar el botón de Medellín exacto
-            var medellinButton = groupDropdown.querySelector('button[data-value="Medellín"][data-name="Medellín"]');
-            if (medellinButton && medellinButton.offsetParent !== null) {
-                medellinButton.scrollIntoView();
-                medellinButton.click();
-                return 'SUCCESS: Clicked Medellín button';
-            }
-            
-            // Buscar por texto exacto
-            var allButtons = groupDropdown.querySelectorAll('button');
-            for (var i = 0; i < allButtons.length; i++) {
-                if (allButtons[i].textContent.trim() === 'Medellín' && 
-                    allButtons[i].offsetParent !== null) {
-                    allButtons[i].scrollIntoView();
-                    allButtons[i].click();
-                    return 'SUCCESS: Clicked Medellín by text';
-                }
-            }
-            
-            return 'ERROR: Medellín button not found or not visible';
-            """
-            
-            resultado = driver.execute_script(js_medellin)
-            logger.info(f"Resultado JavaScript Medellín: {resultado}")
+            logger.info(f"Intentando seleccionar {ciudad} con JavaScript específico...")
+            resultado = llamar_biblioteca(driver, "clickBoton", ["group_dropdown_list"],
+                                          [f'button[data-value="{ciudad}"][data-name="{ciudad}"]'], ciudad, False)
+            logger.info(f"Resultado JavaScript {ciudad}: {resultado}")
             
             if "SUCCESS" in resultado:
-                time.sleep(3)
                 return True
                 
         except Exception as e:
-            logger.error(f"Error en JavaScript para Medellín: {e}")
+            logger.error(f"Error en JavaScript para {ciudad}: {e}")
         
         return False
         
@@ -1559,11 +2765,11 @@ def seleccionar_medellin(driver, wait):
         logger.error("❌ No se pudo encontrar el dropdown de grupos")
         return False
 
-def verificar_seleccion_grupo(driver):
+def verificar_seleccion_grupo(driver, ciudad="Medellín"):
     """Verifica si el grupo fue seleccionado correctamente"""
     try:
-        # Esperar más tiempo para que se actualice el DOM
-        time.sleep(5)
+        # Esperar a que el DOM refleje la selección
+        esperar_texto(driver, "selected_place", ciudad, timeout=10)
         
         # Buscar el texto del span selected_place
         selected_place = driver.find_element(By.ID, "selected_place")
@@ -1571,21 +2777,21 @@ def verificar_seleccion_grupo(driver):
         
         logger.info(f"Texto actual del grupo seleccionado: '{texto_actual}'")
         
-        if "Medellín" in texto_actual:
-            logger.info("✅ Medellín confirmado como seleccionado")
+        if ciudad in texto_actual:
+            logger.info(f"✅ {ciudad} confirmado como seleccionado")
             return True
         elif texto_actual == "":
             # Si está vacío, probablemente aún se está actualizando
             logger.warning("⚠️ Texto vacío, esperando más tiempo...")
-            time.sleep(5)
+            esperar_condicion_js(driver, "porId('selected_place') && porId('selected_place').textContent.trim()", timeout=5)
             
             # Segundo intento
             try:
                 texto_actual = selected_place.text.strip()
                 logger.info(f"Segundo intento - Texto actual: '{texto_actual}'")
                 
-                if "Medellín" in texto_actual:
-                    logger.info("✅ Medellín confirmado en segundo intento")
+                if ciudad in texto_actual:
+                    logger.info(f"✅ {ciudad} confirmado en segundo intento")
                     return True
                 else:
                     # Asumir que la selección fue exitosa si el click fue exitoso
@@ -1607,185 +2813,49 @@ def seleccionar_cualquier_profesional(driver, wait):
     logger.info("=== SELECCIONANDO CUALQUIER PROFESIONAL ===")
     
     try:
-        # Esperar más tiempo para que aparezca la sección de profesionales
+        # Esperar el botón de profesionales y abrir su dropdown
         logger.info("Esperando que aparezca la sección de profesionales...")
-        time.sleep(8)
-        
-        # Buscar el botón de profesionales (similar al de grupos)
-        try:
-            professional_button = wait.until(EC.element_to_be_clickable((By.ID, "professional_button")))
-            logger.info("✅ Botón de profesionales encontrado")
-            
-            # Verificar texto actual
-            try:
-                span_text = professional_button.find_element(By.ID, "selected_professional").text
-                logger.info(f"📋 Texto actual del profesional: '{span_text}'")
-            except:
-                logger.info("📋 No se pudo leer el texto del profesional")
-            
-            # Scroll al elemento
-            driver.execute_script("arguments[0].scrollIntoView(true);", professional_button)
-            time.sleep(2)
-            
-            # Estrategias para abrir el dropdown de profesionales
-            estrategias_profesionales = [
-                ("Click directo", lambda: professional_button.click()),
-                ("JavaScript click", lambda: driver.execute_script("arguments[0].click();", professional_button)),
-                ("Función showProfessionals", lambda: driver.execute_script("showProfessionals('professional_drop');")),
-                ("Click con evento", lambda: driver.execute_script("""
-                    var event = new MouseEvent('click', {bubbles: true, cancelable: true});
-                    arguments[0].dispatchEvent(event);
-                """, professional_button))
+        if dropdown_profesionales.abrir(driver, timeout=30):
+            # Buscar y seleccionar "Cualquier profesional"
+            selectores_cualquier_prof = [
+                (By.XPATH, "//button[@data-value='Cualquier profesional' and @data-name='Cualquier profesional']"),
+                (By.XPATH, "//button[@class='action professional' and contains(text(), 'Cualquier profesional')]"),
+                (By.XPATH, "//li[@class='professionals_list']//button[text()='Cualquier profesional']"),
+                (By.XPATH, "//ul[@id='professional']//button[contains(text(), 'Cualquier')]"),
+                (By.ID, "button_professional_text")
             ]
             
-            dropdown_abierto = False
-            for nombre, estrategia_func in estrategias_profesionales:
-                try:
-                    logger.info(f"Intentando abrir profesionales con: {nombre}")
-                    estrategia_func()
-                    time.sleep(3)
-                    
-                    # Verificar si se abrió
-                    try:
-                        professional_drop = driver.find_element(By.ID, "professional_drop")
-                        if professional_drop.is_displayed():
-                            logger.info(f"✅ Dropdown de profesionales abierto con: {nombre}")
-                            dropdown_abierto = True
-                            break
-                    except NoSuchElementException:
-                        logger.warning(f"professional_drop no encontrado con {nombre}")
-                        
-                except Exception as e:
-                    logger.warning(f"❌ {nombre} falló: {e}")
-                    continue
-            
-            if not dropdown_abierto:
-                # Forzar apertura modificando DOM
-                try:
-                    logger.info("Forzando apertura del dropdown de profesionales...")
-                    resultado = driver.execute_script("""
-                        var profDropdown = document.getElementById('professional_drop');
-                        if (profDropdown) {
-                            profDropdown.style.display = 'block';
-                            profDropdown.style.visibility = 'visible';
-                            profDropdown.classList.add('show');
-                            return true;
-                        }
-                        return false;
-                    """)
-                    
-                    if resultado:
-                        logger.info("✅ Dropdown de profesionales forzado a abrirse")
-                        dropdown_abierto = True
-                        
-                except Exception as e:
-                    logger.error(f"Error forzando apertura de profesionales: {e}")
-            
-            if dropdown_abierto:
-                # Buscar y seleccionar "Cualquier profesional"
-                selectores_cualquier_prof = [
-                    (By.XPATH, "//button[@data-value='Cualquier profesional' and @data-name='Cualquier profesional']"),
-                    (By.XPATH, "//button[@class='action professional' and contains(text(), 'Cualquier profesional')]"),
-                    (By.XPATH, "//li[@class='professionals_list']//button[text()='Cualquier profesional']"),
-                    (By.XPATH, "//ul[@id='professional']//button[contains(text(), 'Cualquier')]"),
-                    (By.ID, "button_professional_text")
-                ]
+            logger.info(f"Buscando Cualquier profesional con {len(selectores_cualquier_prof)} selectores en una sola llamada...")
+            resultado = resolver_cascada(driver, selectores_cualquier_prof, [
+                {"texto_contiene": "Cualquier profesional"},
+                {"atributos_contienen": {"data-name": "Cualquier profesional"}},
+                {"texto_contiene": "Cualquier"}
+            ], grupo="selector_profesional")
+            if resultado and hacer_click_seguro(driver, resultado["elemento"]):
+                logger.info("✅ Cualquier profesional seleccionado exitosamente!")
+                esperar_dom_estable(driver, silencio_ms=500, timeout=5)
                 
-                for selector_type, selector_value in selectores_cualquier_prof:
-                    try:
-                        logger.info(f"Buscando Cualquier profesional con: {selector_value}")
-                        elementos = driver.find_elements(selector_type, selector_value)
-                        logger.info(f"Elementos encontrados: {len(elementos)}")
-                        
-                        for i, elemento in enumerate(elementos):
-                            try:
-                                if elemento.is_displayed() and elemento.is_enabled():
-                                    text = elemento.text.strip()
-                                    data_value = elemento.get_attribute("data-value")
-                                    data_name = elemento.get_attribute("data-name")
-                                    
-                                    logger.info(f"🎯 Elemento {i+1}: text='{text}', data-value='{data_value}', data-name='{data_name}'")
-                                    
-                                    if ("Cualquier profesional" in text or 
-                                        "Cualquier profesional" in (data_name or "") or
-                                        "Cualquier" in text):
-                                        
-                                        # Scroll al elemento
-                                        driver.execute_script("arguments[0].scrollIntoView(true);", elemento)
-                                        time.sleep(1)
-                                        
-                                        if hacer_click_seguro(driver, elemento):
-                                            logger.info("✅ Cualquier profesional seleccionado exitosamente!")
-                                            time.sleep(3)
-                                            
-                                            # NUEVO: Scroll hacia arriba después de seleccionar profesional
-                                            logger.info("📜 Posicionando página hacia arriba después de seleccionar profesional...")
-                                            for step in range(6):
-                                                scroll_position = max(0, 1200 - (step * 200))
-                                                driver.execute_script(f"window.scrollTo({{top: {scroll_position}, behavior: 'smooth'}});")
-                                                time.sleep(0.7)
-                                            
-                                            # Scroll final al top
-                                            driver.execute_script("window.scrollTo({top: 0, behavior: 'smooth'});")
-                                            time.sleep(2)
-                                            logger.info("✅ Página posicionada en la parte superior")
-                                            
-                                            return True
-                                            
-                            except Exception as e:
-                                logger.error(f"Error procesando elemento profesional {i+1}: {e}")
-                                continue
-                                
-                    except Exception as e:
-                        logger.error(f"Error con selector profesional {selector_value}: {e}")
-                        continue
+                # NUEVO: Scroll hacia arriba después de seleccionar profesional
+                driver.execute_script("window.scrollTo(0, 0);")
+                logger.info("✅ Página posicionada en la parte superior")
                 
-                # JavaScript específico para profesionales
-                try:
-                    logger.info("Intentando seleccionar profesional con JavaScript específico...")
-                    js_profesional = """
-                    // Buscar en el dropdown de profesionales
-                    var profDropdown = document.getElementById('professional_dropdown_list');
-                    if (!profDropdown) {
-                        profDropdown = document.getElementById('professional_drop');
-                    }
-                    
-                    if (profDropdown) {
-                        // Buscar el botón de Cualquier profesional exacto
-                        var profButton = profDropdown.querySelector('button[data-name="Cualquier profesional"]');
-                        if (profButton && profButton.offsetParent !== null) {
-                            profButton.scrollIntoView();
-                            profButton.click();
-                            return 'SUCCESS: Clicked Cualquier profesional button';
-                        }
-                        
-                        // Buscar por texto exacto
-                        var allButtons = profDropdown.querySelectorAll('button');
-                        for (var i = 0; i < allButtons.length; i++) {
-                            if (allButtons[i].textContent.includes('Cualquier profesional') && 
-                                allButtons[i].offsetParent !== null) {
-                                allButtons[i].scrollIntoView();
-                                allButtons[i].click();
-                                return 'SUCCESS: Clicked Cualquier profesional by text';
-                            }
-                        }
-                    }
-                    
-                    return 'ERROR: Cualquier profesional button not found';
-                    """
-                    
-                    resultado = driver.execute_script(js_profesional)
-                    logger.info(f"Resultado JavaScript profesional: {resultado}")
+                return True
+            
+            # JavaScript específico para profesionales
+            try:
+                logger.info("Intentando seleccionar profesional con JavaScript específico...")
+                resultado = llamar_biblioteca(
+                    driver, "clickBoton", ["professional_dropdown_list", "professional_drop"],
+                    ['button[data-name="Cualquier profesional"]'], "Cualquier profesional", True
+                )
+                logger.info(f"Resultado JavaScript profesional: {resultado}")
+                
+                if "SUCCESS" in resultado:
+                    esperar_dom_estable(driver, silencio_ms=500, timeout=5)
+                    return True
                     
-                    if "SUCCESS" in resultado:
-                        time.sleep(3)
-                        return True
-                        
-                except Exception as e:
-                    logger.error(f"Error en JavaScript para profesional: {e}")
-        
-        except TimeoutException:
-            logger.error("❌ No se encontró el botón de profesionales")
+            except Exception as e:
+                logger.error(f"Error en JavaScript para profesional: {e}")
         
         logger.warning("⚠️ No se pudo seleccionar profesional, pero continuando...")
         return True  # Continuar aunque falle
@@ -1794,6 +2864,8 @@ def seleccionar_cualquier_profesional(driver, wait):
         logger.warning(f"Error seleccionando profesional: {e}")
         return True  # Continuar aunque falle
 
+@medido("profesional")
+@trazado
 def proceso_seleccion_profesional(driver, wait):
     """Proceso completo para seleccionar profesional"""
     logger.info("=== PROCESO COMPLETO SELECCIÓN PROFESIONAL ===")
@@ -1808,17 +2880,19 @@ def proceso_seleccion_profesional(driver, wait):
             (By.XPATH, "//*[contains(text(), 'profesional')]")
         ]
         
+        # Esperar en el navegador por los IDs conocidos; los XPath amplios solo se revisan si no aparecen
         seccion_encontrada = False
-        for selector_type, selector_value in selectores_seccion_profesional:
-            try:
-                elemento = wait.until(EC.presence_of_element_located((selector_type, selector_value)))
-                if elemento.is_displayed():
+        elemento = esperar_alguno_visible(driver, ["professional_section", "professional_button"], timeout=90)
+        if elemento:
+            logger.info(f"✅ Sección de profesionales encontrada con: {elemento.get_attribute('id')}")
+            seccion_encontrada = True
+        else:
+            for selector_type, selector_value in selectores_seccion_profesional[2:]:
+                if any(e.is_displayed() for e in driver.find_elements(selector_type, selector_value)):
                     logger.info(f"✅ Sección de profesionales encontrada con: {selector_value}")
                     seccion_encontrada = True
                     break
-            except TimeoutException:
                 logger.info(f"No encontrado con: {selector_value}")
-                continue
         
         if not seccion_encontrada:
             logger.warning("❌ No apareció la sección de profesionales")
@@ -1831,230 +2905,1233 @@ def proceso_seleccion_profesional(driver, wait):
         logger.error(f"Error en proceso de selección de profesional: {e}")
         return True  # Continuar aunque falle
 
+@medido("seccion_grupos")
 def esperar_seccion_grupos(driver, wait):
     """Espera a que aparezca la sección de grupos"""
     logger.info("=== ESPERANDO SECCIÓN DE GRUPOS ===")
     
+    # Esperar que aparezca group_section
+    if not esperar_presente(driver, "group_section", timeout=90):
+        logger.error("❌ Sección de grupos no apareció")
+        return False
+    logger.info("✅ Sección de grupos encontrada")
+    
+    # Verificar que esté visible
+    if esperar_visible(driver, "group_section", timeout=10):
+        logger.info("✅ Sección de grupos está visible")
+        
+        # Esperar que aparezca el botón de grupo
+        if not esperar_presente(driver, "group_button", timeout=30):
+            logger.error("❌ Botón de grupo no apareció")
+            return False
+        logger.info("✅ Botón de grupo encontrado")
+        
+        return True
+    else:
+        logger.warning("⚠️ Sección de grupos no está visible")
+        return False
+
+@trazado
+def proceso_seleccion_medellin(driver, wait, ciudad="Medellín"):
+    """Proceso completo para seleccionar Medellín (o la ciudad indicada)"""
+    logger.info("=== PROCESO COMPLETO SELECCIÓN MEDELLÍN ===")
+    
+    # PASO 1: Esperar que aparezca la sección de grupos
+    if not esperar_seccion_grupos(driver, wait):
+        logger.error("❌ No apareció la sección de grupos")
+        return False
+    
+    # PASO 2: Abrir dropdown de grupos
+    if not abrir_dropdown_grupos(driver, wait):
+        logger.error("❌ No se pudo abrir el dropdown de grupos")
+        return False
+    
+    # PASO 3: Seleccionar Medellín
+    if not seleccionar_medellin(driver, wait, ciudad):
+        logger.error("❌ No se pudo seleccionar Medellín")
+        return False
+    
+    # PASO 4: Verificar selección de Medellín
+    if verificar_seleccion_grupo(driver, ciudad):
+        logger.info("✅ Medellín seleccionado exitosamente")
+        
+        # PASO 5: Seleccionar profesional después de Medellín
+        if proceso_seleccion_profesional(driver, wait):
+            logger.info("✅ Proceso completo de Medellín y profesional exitoso")
+            return True
+        else:
+            logger.warning("⚠️ Falló selección de profesional")
+            return True  # Continuar aunque falle profesional
+    else:
+        logger.warning("⚠️ Selección de Medellín no confirmada")
+        return False
+
+def debug_iframe_completo(driver):
+    """Debug específico del contenido del iframe"""
+    logger.info("=== DEBUG COMPLETO DEL IFRAME ===")
+    
     try:
-        # Esperar que aparezca group_section
-        group_section = wait.until(EC.presence_of_element_located((By.ID, "group_section")))
-        logger.info("✅ Sección de grupos encontrada")
-        
-        # Verificar que esté visible
-       
-        if group_section.is_displayed():
-            logger.info("✅ Sección de grupos está visible")
-            
-            # Esperar que aparezca el botón de grupo
-            group_button = wait.until(EC.presence_of_element_located((By.ID, "group_button")))
-            logger.info("✅ Botón de grupo encontrado")
-            
+        # 1. Información básica del iframe
+        titulo = driver.title
+        url_actual = driver.current_url
+        logger.info(f"📄 Título en iframe: {titulo}")
+        logger.info(f"🔗 URL en iframe: {url_actual}")
+        
+        # 2. Buscar elementos específicos
+        elementos_importantes = [
+            "button_service", "services_drop", "service_list",
+            "service_dropdown", "dropdown", "button",
+            "group_section", "group_button", "groups_drop", "group_dropdown_list"
+        ]
+        
+        instantanea = instantanea_documento(driver)
+        if instantanea:
+            for elemento_id in elementos_importantes:
+                if instantanea["arbol"].get_element_by_id(elemento_id, None) is not None:
+                    logger.info(f"✅ Encontrado por ID: {elemento_id}")
+                else:
+                    logger.info(f"❌ No encontrado: {elemento_id}")
             return True
+        
+        for elemento_id in elementos_importantes:
+            try:
+                elem = driver.find_element(By.ID, elemento_id)
+                logger.info(f"✅ Encontrado por ID: {elemento_id}")
+            except NoSuchElementException:
+                logger.info(f"❌ No encontrado: {elemento_id}")
+        
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error en debug iframe: {e}")
+        return False
+
+# SONDA HTTP SIN NAVEGADOR
+# Reproduce las peticiones XHR/formulario del widget con conexiones HTTP persistentes y solo
+# deja arrancar Chrome cuando detecta disponibilidad. Las peticiones se copian de la pestaña
+# Network de DevTools a un JSON (ruta en CITAS_SONDA_CONFIG o datos/sonda_http.json), p. ej.:
+#
+# {
+#   "peticiones": [
+#     {"metodo": "GET", "url": "https://institutodelcorazon.org/solicitar-cita/",
+#      "extraer": {"nonce": "\"nonce\":\"(\\w+)\""}},
+#     {"metodo": "POST", "url": "https://institutodelcorazon.org/wp-admin/admin-ajax.php",
+#      "datos": {"action": "...", "service": "{subconsulta}", "place": "{ciudad}", "nonce": "{nonce}"},
+#      "cabeceras": {"X-Requested-With": "XMLHttpRequest"}}
+#   ],
+#   "disponible_si": {"json": "data.slots"}
+# }
+#
+# En url, datos y cabeceras se sustituyen {servicio}, {subconsulta} (data-value), {ciudad} y lo
+# extraído con "extraer" (primer grupo de la regex). "disponible_si" admite "json" (ruta con
+# puntos a un valor que debe ser no vacío), "contiene", "no_contiene" o "regex" sobre la última respuesta.
+archivo_config_sonda = os.environ.get("CITAS_SONDA_CONFIG", os.path.join(directorio_datos, "sonda_http.json"))
+tiempo_max_sonda = 15
+agente_sonda = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36"
+
+# Pool de conexiones persistentes (keep-alive) por (esquema, host, puerto)
+conexiones_sonda = {}
+bloqueo_conexiones_sonda = threading.Lock()
+
+def cargar_config_sonda():
+    """Lee la configuración de la sonda HTTP; None si no está configurada"""
+    try:
+        with open(archivo_config_sonda, encoding="utf-8") as archivo:
+            return json.load(archivo)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Configuración de sonda HTTP inválida: {e}")
+        return None
+
+def tomar_conexion_sonda(clave):
+    """Toma una conexión libre del pool o abre una nueva"""
+    with bloqueo_conexiones_sonda:
+        libres = conexiones_sonda.setdefault(clave, [])
+        if libres:
+            return libres.pop()
+    esquema, host, puerto = clave
+    clase = http.client.HTTPSConnection if esquema == "https" else http.client.HTTPConnection
+    return clase(host, puerto, timeout=tiempo_max_sonda)
+
+def devolver_conexion_sonda(clave, conexion):
+    """Devuelve una conexión al pool para reutilizarla"""
+    with bloqueo_conexiones_sonda:
+        conexiones_sonda.setdefault(clave, []).append(conexion)
+
+def cerrar_conexiones_sonda():
+    """Cierra todas las conexiones del pool"""
+    with bloqueo_conexiones_sonda:
+        for libres in conexiones_sonda.values():
+            for conexion in libres:
+                conexion.close()
+        conexiones_sonda.clear()
+
+def peticion_sonda(metodo, url, datos=None, cabeceras=None, cookies=None):
+    """Hace una petición por el pool y devuelve (estado, texto); actualiza el dict de cookies"""
+    partes = urllib.parse.urlsplit(url)
+    clave = (partes.scheme, partes.hostname, partes.port)
+    ruta = (partes.path or "/") + (f"?{partes.query}" if partes.query else "")
+    cuerpo = None
+    
+    cabeceras = dict(cabeceras or {})
+    cabeceras.setdefault("User-Agent", agente_sonda)
+    cabeceras.setdefault("Accept-Encoding", "gzip")
+    if datos is not None:
+        codificados = urllib.parse.urlencode(datos)
+        if metodo == "GET":
+            ruta += ("&" if "?" in ruta else "?") + codificados
         else:
-            logger.warning("⚠️ Sección de grupos no está visible")
-            return False
+            cuerpo = codificados.encode("utf-8")
+            cabeceras.setdefault("Content-Type", "application/x-www-form-urlencoded; charset=UTF-8")
+    if cookies:
+        cabeceras["Cookie"] = "; ".join(f"{nombre}={valor}" for nombre, valor in cookies.items())
+    
+    for reintento in range(2):
+        conexion = tomar_conexion_sonda(clave)
+        try:
+            conexion.request(metodo, ruta, body=cuerpo, headers=cabeceras)
+            respuesta = conexion.getresponse()
+            contenido = respuesta.read()
+        except (http.client.HTTPException, OSError):
+            # Una conexión keep-alive pudo haber sido cerrada por el servidor: se reintenta con otra
+            conexion.close()
+            if reintento:
+                raise
+            continue
+        
+        if (respuesta.getheader("Connection") or "").lower() == "close":
+            conexion.close()
+        else:
+            devolver_conexion_sonda(clave, conexion)
+        break
+    
+    if cookies is not None:
+        for cabecera in respuesta.headers.get_all("Set-Cookie") or []:
+            for nombre, morsel in http.cookies.SimpleCookie(cabecera).items():
+                cookies[nombre] = morsel.value
+    
+    if (respuesta.getheader("Content-Encoding") or "").lower() == "gzip":
+        contenido = gzip.decompress(contenido)
+    return respuesta.status, contenido.decode(respuesta.headers.get_content_charset() or "utf-8", errors="replace")
+
+def evaluar_respuesta_sonda(contenido, criterio):
+    """Decide si la respuesta indica disponibilidad según el criterio configurado"""
+    if "json" in criterio:
+        valor = json.loads(contenido)
+        for parte in criterio["json"].split("."):
+            if isinstance(valor, list):
+                valor = valor[int(parte)] if int(parte) < len(valor) else None
+            elif isinstance(valor, dict):
+                valor = valor.get(parte)
+            else:
+                valor = None
+        return bool(valor)
+    if "contiene" in criterio:
+        return criterio["contiene"] in contenido
+    if "no_contiene" in criterio:
+        return criterio["no_contiene"] not in contenido
+    if "regex" in criterio:
+        return re.search(criterio["regex"], contenido) is not None
+    raise ValueError(f"Criterio de disponibilidad no reconocido: {criterio}")
+
+@medido("sonda_http")
+def sondear_disponibilidad_http(objetivo=None, config=None):
+    """Consulta la disponibilidad sin navegador.
+    
+    Devuelve True si hay disponibilidad, False si no la hay y None si la sonda no está
+    configurada o falló (en ese caso se debe usar el navegador).
+    """
+    config = config or cargar_config_sonda()
+    if not config:
+        return None
+    
+    objetivo = objetivo or objetivo_por_defecto
+    valores = {
+        "servicio": resolver_servicio(None, objetivo["servicio"])[0] or objetivo["servicio"],
+        "subconsulta": id_subconsulta(objetivo["servicio"], objetivo["subconsulta"]) or objetivo["subconsulta"],
+        "ciudad": objetivo["ciudad"],
+    }
+    cookies = {}
+    inicio = time.monotonic()
+    
+    try:
+        contenido = ""
+        for paso in config["peticiones"]:
+            url = paso["url"].format(**valores)
+            datos = {clave: str(valor).format(**valores) for clave, valor in paso["datos"].items()} if "datos" in paso else None
+            cabeceras = {clave: str(valor).format(**valores) for clave, valor in paso.get("cabeceras", {}).items()}
             
-    except TimeoutException:
-        logger.error("❌ Sección de grupos no apareció")
-        return False
+            estado, contenido = peticion_sonda(paso.get("metodo", "GET").upper(), url, datos, cabeceras, cookies)
+            if estado >= 400:
+                logger.warning(f"⚠️ Sonda HTTP: {url} respondió {estado}")
+                return None
+            
+            for nombre, patron in paso.get("extraer", {}).items():
+                coincidencia = re.search(patron, contenido)
+                if coincidencia:
+                    valores[nombre] = coincidencia.group(1)
+                else:
+                    logger.warning(f"⚠️ Sonda HTTP: no se pudo extraer '{nombre}' de {url}")
+        
+        disponible = evaluar_respuesta_sonda(contenido, config["disponible_si"])
+    except Exception as e:
+        logger.warning(f"⚠️ Sonda HTTP falló, se usará el navegador: {e}")
+        return None
+    
+    duracion_ms = (time.monotonic() - inicio) * 1000
+    logger.info(f"🔎 Sonda HTTP ({duracion_ms:.0f} ms): {'✅ HAY disponibilidad' if disponible else 'sin disponibilidad'}")
+    return disponible
 
-def proceso_seleccion_medellin(driver, wait):
-    """Proceso completo para seleccionar Medellín"""
-    logger.info("=== PROCESO COMPLETO SELECCIÓN MEDELLÍN ===")
+# TIEMPOS DEL LADO DEL NAVEGADOR (NAVIGATION Y RESOURCE TIMING)
+# Al final de cada intento se leen performance.getEntriesByType('navigation') y 'resource' de la
+# página y del iframe del formulario, para separar la latencia del sitio (backend, recursos
+# pesados) de la de la automatización. Se guardan resumidos, junto a los tiempos por paso y el
+# presupuesto del intento, en datos/intentos.jsonl (una línea por intento).
+archivo_historial_intentos = os.path.join(directorio_datos, "intentos.jsonl")
+max_bytes_historial_intentos = 20 * 1024 * 1024  # Al superarlo se rota a intentos.jsonl.1
+
+js_tiempos_navegador = """
+var limpiar = arguments[0];
+var soloEsteDocumento = arguments[1];
+
+function resumirNavegacion(n) {
+    if (!n) return null;
+    return {tipo: n.type, dns: n.domainLookupEnd - n.domainLookupStart, conexion: n.connectEnd - n.connectStart,
+            ttfb: n.responseStart - n.requestStart, descarga: n.responseEnd - n.responseStart,
+            dom_interactivo: n.domInteractive, dom_contenido: n.domContentLoadedEventEnd,
+            carga: n.loadEventEnd, duracion: n.duration, transferido: n.transferSize};
+}
+function capturar(ventana) {
+    var perf = ventana.performance;
+    var recursos = perf.getEntriesByType('resource').map(function (r) {
+        return {url: r.name, tipo: r.initiatorType, inicio: r.startTime, duracion: r.duration,
+                transferido: r.transferSize, cuerpo: r.encodedBodySize};
+    });
+    // La entrada de navegación es del documento, no del intento: si este documento ya se reportó
+    // (página caliente) no hubo navegación nueva y solo cuentan los recursos
+    var captura = {url: ventana.location.href,
+                   navegacion: ventana.__citasNavegacionReportada ? null
+                               : resumirNavegacion(perf.getEntriesByType('navigation')[0]),
+                   recursos: recursos};
+    ventana.__citasNavegacionReportada = true;
+    // En modo caliente la página sigue cargada: así el siguiente intento solo ve sus recursos nuevos
+    if (limpiar) perf.clearResourceTimings();
+    return captura;
+}
+
+var resultado = {documentos: [capturar(window)], iframes_inaccesibles: []};
+if (!soloEsteDocumento) {
+    var iframes = document.getElementsByTagName('iframe');
+    for (var i = 0; i < iframes.length; i++) {
+        try {
+            resultado.documentos.push(capturar(iframes[i].contentWindow));
+        } catch (e) {
+            resultado.iframes_inaccesibles.push(iframes[i]);
+        }
+    }
+}
+return resultado;
+"""
+
+def resumir_documento_navegador(captura, max_recursos=10):
+    """Resume la captura de un documento: navegación, totales, hosts y recursos más lentos"""
+    por_host = {}
+    for recurso in captura["recursos"]:
+        host = urllib.parse.urlsplit(recurso["url"]).netloc or "(local)"
+        total = por_host.setdefault(host, {"host": host, "recursos": 0, "duracion_ms": 0.0, "kb": 0.0})
+        total["recursos"] += 1
+        total["duracion_ms"] += recurso["duracion"]
+        total["kb"] += (recurso["transferido"] or 0) / 1024
+    
+    return {
+        "url": captura["url"],
+        "navegacion": {clave: round(valor, 1) if isinstance(valor, float) else valor
+                       for clave, valor in (captura["navegacion"] or {}).items()} or None,
+        "recursos": len(captura["recursos"]),
+        "kb_transferidos": round(sum(total["kb"] for total in por_host.values()), 1),
+        "por_host": [
+            {**total, "duracion_ms": round(total["duracion_ms"], 1), "kb": round(total["kb"], 1)}
+            for total in sorted(por_host.values(), key=lambda total: total["duracion_ms"], reverse=True)[:max_recursos]
+        ],
+        "mas_lentos": [
+            {"url": recurso["url"][:200], "tipo": recurso["tipo"], "duracion_ms": round(recurso["duracion"], 1)}
+            for recurso in sorted(captura["recursos"], key=lambda recurso: recurso["duracion"], reverse=True)[:max_recursos]
+        ],
+    }
+
+def capturar_tiempos_navegador(driver, limpiar=False):
+    """Navigation y Resource Timing de la página y de sus iframes (entrando a los de otro origen)"""
+    try:
+        driver.switch_to.default_content()
+        captura = driver.execute_script(js_tiempos_navegador, limpiar, False)
+        documentos = captura["documentos"]
+        for iframe in captura["iframes_inaccesibles"]:
+            try:
+                driver.switch_to.frame(iframe)
+                documentos += driver.execute_script(js_tiempos_navegador, limpiar, True)["documentos"]
+            except Exception as e:
+                logger.debug(f"No se pudieron leer los tiempos de un iframe: {e}")
+            finally:
+                driver.switch_to.default_content()
+        return [resumir_documento_navegador(documento) for documento in documentos]
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron capturar los tiempos del navegador: {e}")
+        return None
+
+def reportar_tiempos_navegador(nombre, documentos):
+    """Una línea de log por documento con la latencia del sitio y lo que más pesó"""
+    for documento in documentos or []:
+        navegacion = documento["navegacion"]
+        lentos = ", ".join(f"{host['host']} {host['duracion_ms']:.0f}ms" for host in documento["por_host"][:3])
+        carga = (f"TTFB {navegacion.get('ttfb', 0):.0f}ms, load {navegacion.get('carga', 0):.0f}ms"
+                 if navegacion else "sin navegación en este intento")
+        logger.info(
+            f"🌐 [{nombre}] {documento['url'][:70]}: {carga}, {documento['recursos']} recursos "
+            f"({documento['kb_transferidos']:.0f} KB); hosts más lentos: {lentos or '-'}"
+        )
+
+def guardar_registro_intento(registro):
+    """Agrega el registro del intento a datos/intentos.jsonl (rotando el archivo si crece demasiado)"""
+    try:
+        os.makedirs(directorio_datos, exist_ok=True)
+        with bloqueo_archivo_metricas:
+            if os.path.exists(archivo_historial_intentos) and \
+                    os.path.getsize(archivo_historial_intentos) > max_bytes_historial_intentos:
+                os.replace(archivo_historial_intentos, archivo_historial_intentos + ".1")
+            with open(archivo_historial_intentos, "a", encoding="utf-8") as archivo:
+                archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    except Exception as e:
+        logger.warning(f"No se pudo guardar el registro del intento: {e}")
+
+# EXTRACCIÓN DE CUPOS DISPONIBLES
+# Tras elegir profesional el widget muestra la agenda (schedule_section). Todos los horarios se
+# leen en una sola llamada al navegador (fecha, hora, profesional, sede e id de cada cupo) y se
+# devuelven como registros CupoCita, así cada intento dice si hay disponibilidad sin que nadie
+# tenga que mirar el navegador. Lo que el botón no trae en data-* se toma de su texto.
+@dataclass(frozen=True, slots=True)
+class CupoCita:
+    """Un horario disponible tal como lo publica el widget"""
+    fecha: str
+    hora: str
+    profesional: str
+    sede: str
+    id_cupo: str
+
+# Condición de espera: la agenda ya respondió (con horarios o con el aviso de que no hay)
+js_condicion_agenda_lista = (
+    "visible(porId('schedule_section')) && "
+    "(porId('schedule_list') && porId('schedule_list').children.length > 0 || visible(porId('schedule_empty')))"
+)
+
+# Última lectura de la agenda por objetivo: {clave_objetivo: (huella, cupos)}. La mayoría de los
+# sondeos ven exactamente la misma agenda; si la huella calculada en el navegador no cambió, no se
+# recorre la agenda ni se escribe el historial ni se avisa
+huellas_agenda = {}
+# Huella de una agenda que cambió, hasta que su lectura quede guardada en el historial: si la
+# escritura falla, la próxima lectura vuelve a ver el cambio
+huellas_agenda_pendientes = {}
+bloqueo_huellas_agenda = threading.Lock()
+
+@medido("cupos")
+def extraer_cupos(driver, timeout=30, objetivo=None):
+    """Lee los horarios disponibles del documento actual.
+    
+    Espera (en el navegador) a que la agenda responda si timeout > 0. Devuelve (cupos, cambiaron):
+    la lista de CupoCita (vacía si el sitio dice que no hay agenda) o None si no hay agenda visible,
+    y si la agenda cambió desde la última lectura del mismo objetivo (siempre True sin objetivo).
+    """
+    if timeout and not esperar_condicion_js(driver, js_condicion_agenda_lista, timeout=timeout):
+        logger.info("📅 La agenda no apareció; no se pudieron leer cupos")
+        return None, True
+    
+    clave = clave_objetivo(objetivo) if objetivo else None
+    with bloqueo_huellas_agenda:
+        huella_anterior, cupos_anteriores = huellas_agenda.get(clave, (None, None))
+    try:
+        agenda = llamar_biblioteca(driver, "extraerCupos", huella_anterior)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron leer los cupos: {e}")
+        return None, True
+    if agenda is None:
+        return None, True
+    if agenda.get("sinCambios"):
+        logger.info(f"📅 Agenda sin cambios desde la última lectura ({len(cupos_anteriores)} cupos)")
+        return cupos_anteriores, False
+    
+    cupos = [CupoCita(fecha=fila[1], hora=fila[2], profesional=fila[3], sede=fila[4], id_cupo=fila[0])
+             for fila in agenda["filas"]]
+    if clave:
+        with bloqueo_huellas_agenda:
+            huellas_agenda_pendientes[clave] = (agenda["huella"], cupos)
+    if cupos:
+        logger.info(f"📅 ¡{len(cupos)} CUPOS DISPONIBLES! " + "; ".join(
+            f"{cupo.fecha} {cupo.hora} {cupo.profesional} ({cupo.sede})" for cupo in cupos[:5]
+        ) + (" ..." if len(cupos) > 5 else ""))
+    else:
+        logger.info("📅 Sin cupos disponibles en la agenda")
+    return cupos, True
+
+def confirmar_huella_agenda(objetivo):
+    """Da por vista la última agenda leída del objetivo (una vez guardada en el historial)"""
+    clave = clave_objetivo(objetivo)
+    with bloqueo_huellas_agenda:
+        if clave in huellas_agenda_pendientes:
+            huellas_agenda[clave] = huellas_agenda_pendientes.pop(clave)
+
+# HISTORIAL DE CUPOS (SQLITE)
+# Cada apertura de un cupo es una fila de datos/historial_cupos.sqlite3 con el objetivo (servicio,
+# subconsulta, ciudad), la primera y la última vez que se vio y el momento en que dejó de verse.
+# Si un cupo desaparecido vuelve a aparecer, es una fila (apertura) nueva. Las escrituras de un
+# intento van en una sola transacción. Así se puede responder "qué se abrió en la última hora" y
+# "cuánto dura disponible un cupo", y medir qué tan rápido se reacciona.
+archivo_historial_cupos = os.environ.get("CITAS_HISTORIAL_CUPOS", os.path.join(directorio_datos, "historial_cupos.sqlite3"))
+
+esquema_historial_cupos = """
+CREATE TABLE IF NOT EXISTS cupos (
+    servicio TEXT NOT NULL,
+    subconsulta TEXT NOT NULL,
+    ciudad TEXT NOT NULL,
+    profesional TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    hora TEXT NOT NULL,
+    id_cupo TEXT NOT NULL,
+    sede TEXT NOT NULL,
+    primera_vez REAL NOT NULL,
+    ultima_vez REAL NOT NULL,
+    observaciones INTEGER NOT NULL DEFAULT 1,
+    desaparecido REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cupos_abiertos
+    ON cupos (servicio, subconsulta, ciudad, profesional, fecha, hora, id_cupo) WHERE desaparecido IS NULL;
+CREATE INDEX IF NOT EXISTS idx_cupos_objetivo ON cupos (servicio, subconsulta, ciudad, profesional, fecha);
+CREATE INDEX IF NOT EXISTS idx_cupos_primera_vez ON cupos (primera_vez);
+"""
+
+# Un cupo que sigue abierto solo actualiza ultima_vez; si no hay apertura en curso se crea una
+sql_registrar_cupo = """
+INSERT INTO cupos (servicio, subconsulta, ciudad, profesional, fecha, hora, id_cupo, sede, primera_vez, ultima_vez)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (servicio, subconsulta, ciudad, profesional, fecha, hora, id_cupo) WHERE desaparecido IS NULL
+DO UPDATE SET ultima_vez = excluded.ultima_vez, sede = excluded.sede, observaciones = observaciones + 1
+"""
+
+historiales_inicializados = set()
+bloqueo_historial_cupos = threading.Lock()
+
+def conectar_historial_cupos():
+    """Abre la base del historial (creando tablas e índices la primera vez en este proceso)"""
+    os.makedirs(os.path.dirname(archivo_historial_cupos) or ".", exist_ok=True)
+    conexion = sqlite3.connect(archivo_historial_cupos, timeout=30)
+    conexion.row_factory = sqlite3.Row
+    with bloqueo_historial_cupos:
+        if archivo_historial_cupos not in historiales_inicializados:
+            # WAL: las sesiones de un pool de procesos pueden leer mientras otra escribe
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.executescript(esquema_historial_cupos)
+            historiales_inicializados.add(archivo_historial_cupos)
+    return conexion
+
+def clave_objetivo(objetivo):
+    return (str(objetivo["servicio"]), str(objetivo["subconsulta"]), objetivo["ciudad"])
+
+def registrar_cupos_observados(objetivo, cupos, momento=None):
+    """Registra los cupos de un intento en una transacción; devuelve los que se abrieron ahora
+    (None si no se pudo guardar).
+    
+    Los cupos abiertos del objetivo que ya no aparecen quedan marcados como desaparecidos.
+    """
+    momento = momento or time.time()
+    servicio, subconsulta, ciudad = clave_objetivo(objetivo)
+    try:
+        conexion = conectar_historial_cupos()
+        try:
+            with conexion:
+                abiertos = {
+                    (fila["profesional"], fila["fecha"], fila["hora"], fila["id_cupo"])
+                    for fila in conexion.execute(
+                        "SELECT profesional, fecha, hora, id_cupo FROM cupos "
+                        "WHERE servicio = ? AND subconsulta = ? AND ciudad = ? AND desaparecido IS NULL",
+                        (servicio, subconsulta, ciudad)
+                    )
+                }
+                conexion.executemany(sql_registrar_cupo, [
+                    (servicio, subconsulta, ciudad, cupo.profesional, cupo.fecha, cupo.hora, cupo.id_cupo, cupo.sede,
+                     momento, momento)
+                    for cupo in cupos
+                ])
+                conexion.execute(
+                    "UPDATE cupos SET desaparecido = ? WHERE servicio = ? AND subconsulta = ? AND ciudad = ? "
+                    "AND desaparecido IS NULL AND ultima_vez < ?",
+                    (momento, servicio, subconsulta, ciudad, momento)
+                )
+        finally:
+            conexion.close()
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ No se pudo guardar el historial de cupos: {e}")
+        return None
+    
+    nuevos = [cupo for cupo in cupos if (cupo.profesional, cupo.fecha, cupo.hora, cupo.id_cupo) not in abiertos]
+    if nuevos:
+        logger.info(f"🆕 {len(nuevos)} cupos nuevos para {describir_objetivo(objetivo)}")
+    return nuevos
+
+def refrescar_cupos_abiertos(objetivo, momento=None):
+    """Agenda sin cambios: los cupos abiertos del objetivo siguen vistos ahora (solo ultima_vez)"""
+    momento = momento or time.time()
+    try:
+        conexion = conectar_historial_cupos()
+        try:
+            with conexion:
+                conexion.execute(
+                    "UPDATE cupos SET ultima_vez = ?, observaciones = observaciones + 1 "
+                    "WHERE servicio = ? AND subconsulta = ? AND ciudad = ? AND desaparecido IS NULL",
+                    (momento, *clave_objetivo(objetivo))
+                )
+        finally:
+            conexion.close()
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ No se pudo actualizar el historial de cupos: {e}")
+
+def registrar_lectura_cupos(objetivo, cupos, cambiaron):
+    """Lleva una lectura de extraer_cupos al historial; la agenda solo se da por vista si se guardó"""
+    if cupos is None:
+        return
+    if not cambiaron:
+        refrescar_cupos_abiertos(objetivo)
+    elif registrar_cupos_observados(objetivo, cupos) is not None:
+        confirmar_huella_agenda(objetivo)
+
+def cupos_abiertos_desde(segundos=3600, objetivo=None):
+    """Cupos que se abrieron en los últimos `segundos` (de un objetivo o de todos)"""
+    condicion, parametros = "primera_vez >= ?", [time.time() - segundos]
+    if objetivo:
+        condicion += " AND servicio = ? AND subconsulta = ? AND ciudad = ?"
+        parametros += clave_objetivo(objetivo)
+    conexion = conectar_historial_cupos()
+    try:
+        return [dict(fila) for fila in conexion.execute(
+            f"SELECT * FROM cupos WHERE {condicion} ORDER BY primera_vez DESC", parametros
+        )]
+    finally:
+        conexion.close()
+
+def duracion_disponibilidad_cupos(objetivo=None):
+    """Cuánto estuvieron disponibles las aperturas ya cerradas (segundos) y cuántas siguen abiertas"""
+    condicion, parametros = "1 = 1", []
+    if objetivo:
+        condicion = "servicio = ? AND subconsulta = ? AND ciudad = ?"
+        parametros = list(clave_objetivo(objetivo))
+    conexion = conectar_historial_cupos()
+    try:
+        duraciones = sorted(fila[0] for fila in conexion.execute(
+            f"SELECT desaparecido - primera_vez FROM cupos WHERE {condicion} AND desaparecido IS NOT NULL", parametros
+        ))
+        abiertos = conexion.execute(
+            f"SELECT COUNT(*) FROM cupos WHERE {condicion} AND desaparecido IS NULL", parametros
+        ).fetchone()[0]
+    finally:
+        conexion.close()
+    
+    if not duraciones:
+        return {"cerrados": 0, "abiertos": abiertos}
+    return {
+        "cerrados": len(duraciones),
+        "abiertos": abiertos,
+        "media_s": round(sum(duraciones) / len(duraciones), 1),
+        "p50_s": round(duraciones[len(duraciones) // 2], 1),
+        "min_s": round(duraciones[0], 1),
+        "max_s": round(duraciones[-1], 1),
+    }
+
+def reportar_historial_cupos(objetivo=None):
+    """Resumen del historial para los logs de estado"""
+    try:
+        recientes = cupos_abiertos_desde(3600, objetivo)
+        duracion = duracion_disponibilidad_cupos(objetivo)
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ No se pudo consultar el historial de cupos: {e}")
+        return
+    logger.info(f"   Cupos abiertos en la última hora: {len(recientes)} (siguen abiertos: {duracion['abiertos']})")
+    if duracion["cerrados"]:
+        logger.info(f"   Duración de un cupo disponible: mediana {duracion['p50_s'] / 60:.1f} min, "
+                    f"media {duracion['media_s'] / 60:.1f} min ({duracion['cerrados']} cupos ya tomados)")
+
+# SESIÓN DE CITAS
+# Todo el estado de un navegador (driver, wait, contador de intentos y tiempos) vive en una
+# SesionCitas, así que pueden coexistir varias en el mismo proceso (una por hilo o por objetivo).
+# Las funciones de módulo de siempre (reinicializar_driver, ejecutar_proceso_citas) operan
+# sobre sesion_global, la sesión del modo automático y de la ejecución única.
+class SesionCitas:
+    """Sesión de navegador independiente para un objetivo"""
+    
+    def __init__(self, objetivo=None, perfil=None, nombre="principal"):
+        self.objetivo = objetivo or objetivo_por_defecto
+        self.perfil = perfil
+        self.nombre = nombre
+        self.driver = None
+        self.wait = None
+        self.contador_intentos = 0
+        self.intentos_exitosos = 0
+        self.duraciones_intentos = []  # Segundos de cada intento con navegador
+        self.objetivo_caliente = None  # Objetivo con el formulario ya cargado en el navegador (modo caliente)
+        self.tiempos_ultimo_intento = {}  # Segundos por paso del último intento
+        self.presupuesto_ultimo_intento = None  # Pausas vs. esperas al sitio vs. trabajo activo
+        self.ultima_traza = None  # Ruta del JSON de trace events del último intento
+        self.tiempos_navegador_ultimo_intento = None  # Navigation/Resource Timing resumidos por documento
+        self.cupos_ultimo_intento = None  # CupoCita vistos en la agenda (None si no se pudo leer)
+        self.inicio = time.monotonic()
+        # Re-entrante: un intento puede reinicializar el driver sin bloquearse a sí mismo, pero
+        # dos hilos no pueden usar la misma sesión a la vez
+        self.bloqueo = threading.RLock()
+    
+    def __repr__(self):
+        return f"SesionCitas({self.nombre!r}, intentos={self.contador_intentos}, driver={'activo' if self.driver else 'no'})"
     
-    # PASO 1: Esperar que aparezca la sección de grupos
-    if not esperar_seccion_grupos(driver, wait):
-        logger.error("❌ No apareció la sección de grupos")
-        return False
+    def inicializar(self):
+        """Abre el navegador de la sesión si no está abierto"""
+        with self.bloqueo:
+            if self.driver:
+                return True
+            self.driver = inicializar_driver(self.perfil)
+            if not self.driver:
+                return False
+            self.wait = WebDriverWait(self.driver, 90)
+            return True
     
-    # PASO 2: Abrir dropdown de grupos
-    if not abrir_dropdown_grupos(driver, wait):
-        logger.error("❌ No se pudo abrir el dropdown de grupos")
-        return False
+    def reinicializar(self):
+        """Reinicia el driver si hay problemas"""
+        with self.bloqueo:
+            logger.info(f"🔄 [{self.nombre}] Reinicializando driver...")
+            self.cerrar()
+            if self.inicializar():
+                logger.info(f"✅ [{self.nombre}] Driver reinicializado correctamente")
+                return True
+            logger.error(f"❌ [{self.nombre}] Error reinicializando driver")
+            return False
     
-    # PASO 3: Seleccionar Medellín
-    if not seleccionar_medellin(driver, wait):
-        logger.error("❌ No se pudo seleccionar Medellín")
-        return False
+    def cerrar(self):
+        """Cierra el navegador de la sesión (si lo hay)"""
+        with self.bloqueo:
+            try:
+                if self.driver:
+                    self.driver.quit()
+            except:
+                pass
+            self.driver = None
+            self.wait = None
+            self.objetivo_caliente = None
     
-    # PASO 4: Verificar selección de Medellín
-    if verificar_seleccion_grupo(driver):
-        logger.info("✅ Medellín seleccionado exitosamente")
-        
-        # PASO 5: Seleccionar profesional después de Medellín
-        if proceso_seleccion_profesional(driver, wait):
-            logger.info("✅ Proceso completo de Medellín y profesional exitoso")
+    def asegurar_driver(self):
+        """Deja un driver que responde, abriéndolo o reiniciándolo si hace falta"""
+        if not self.driver:
+            logger.info(f"🔧 [{self.nombre}] Driver no existe, inicializando...")
+            return self.reinicializar()
+        try:
+            self.driver.current_url
             return True
-        else:
-            logger.warning("⚠️ Falló selección de profesional")
-            return True  # Continuar aunque falle profesional
-    else:
-        logger.warning("⚠️ Selección de Medellín no confirmada")
-        return False
-
-def debug_iframe_completo(driver):
-    """Debug específico del contenido del iframe"""
-    logger.info("=== DEBUG COMPLETO DEL IFRAME ===")
+        except Exception as e:
+            logger.warning(f"⚠️ [{self.nombre}] Driver no responde: {e}")
+            return self.reinicializar()
     
-    try:
-        # 1. Información básica del iframe
-        titulo = driver.title
-        url_actual = driver.current_url
-        logger.info(f"📄 Título en iframe: {titulo}")
-        logger.info(f"🔗 URL en iframe: {url_actual}")
-        
-        # 2. Buscar elementos específicos
-        elementos_importantes = [
-            "button_service", "services_drop", "service_list",
-            "service_dropdown", "dropdown", "button",
-            "group_section", "group_button", "groups_drop", "group_dropdown_list"
-        ]
-        
-        for elemento_id in elementos_importantes:
+    def limpiar(self):
+        """Limpia cookies y almacenamiento para el siguiente intento"""
+        with medir_paso("limpieza"):
             try:
-                elem = driver.find_element(By.ID, elemento_id)
-                logger.info(f"✅ Encontrado por ID: {elemento_id}")
-            except NoSuchElementException:
-                logger.info(f"❌ No encontrado: {elemento_id}")
-        
-        return True
+                self.driver.delete_all_cookies()
+                self.driver.execute_script("window.localStorage.clear();")
+                self.driver.execute_script("window.sessionStorage.clear();")
+            except:
+                pass
+    
+    def leer_cupos(self, objetivo=None, timeout=30):
+        """Lee la agenda del formulario cargado y registra lo visto en el historial de cupos"""
+        objetivo = objetivo or self.objetivo
+        self.cupos_ultimo_intento, cambiaron = extraer_cupos(self.driver, timeout=timeout, objetivo=objetivo)
+        registrar_lectura_cupos(objetivo, self.cupos_ultimo_intento, cambiaron)
+        return self.cupos_ultimo_intento
+    
+    def ejecutar_intento(self, objetivo=None, sondear=True):
+        """Un intento completo: sonda HTTP (opcional), navegación y proceso de selección.
         
-    except Exception as e:
-        logger.error(f"Error en debug iframe: {e}")
-        return False
+        Devuelve True si se completó la selección, False si falló o la sonda no vio
+        disponibilidad, y None si no se pudo obtener un navegador.
+        """
+        objetivo = objetivo or self.objetivo
+        with self.bloqueo:
+            self.contador_intentos += 1
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            
+            logger.info(f"")
+            logger.info(f"{'='*60}")
+            logger.info(f"🚀 [{self.nombre}] INICIANDO INTENTO #{self.contador_intentos} - {timestamp}")
+            logger.info(f"{'='*60}")
+            
+            # Verificar si alcanzamos el máximo de intentos
+            if self.contador_intentos > max_intentos:
+                logger.warning(f"⚠️ Alcanzado máximo de intentos ({max_intentos}). Continuando...")
+                self.contador_intentos = 0  # Resetear contador
+            
+            # Los pasos medidos en este hilo se acumulan también en los tiempos del intento
+            tiempos = contexto_metricas.tiempos = []
+            pausas = contexto_pausas.registro = {}
+            fallo = contexto_fallos.registro = {}
+            iniciar_traza()
+            inicio_traza = ahora_us()
+            
+            # Si la sonda HTTP está configurada y no ve disponibilidad, no se usa el navegador
+            if sondear and sondear_disponibilidad_http(objetivo) is False:
+                logger.info("😴 Sin disponibilidad según la sonda HTTP; el navegador no se usa en este intento")
+                self.tiempos_ultimo_intento = resumir_tiempos_intento(tiempos)
+                contexto_metricas.tiempos = None
+                contexto_pausas.registro = None
+                contexto_fallos.registro = None
+                terminar_traza(f"{self.nombre}-{self.contador_intentos}")
+                return False
+            
+            inicio = time.monotonic()
+            resultado = None
+            self.tiempos_navegador_ultimo_intento = None
+            self.cupos_ultimo_intento = None
+            try:
+                if not self.asegurar_driver():
+                    logger.error(f"❌ [{self.nombre}] No se pudo inicializar el driver")
+                    return None
+                
+                # Con la página caliente del mismo objetivo basta con repetir la búsqueda
+                if modo_caliente and self.objetivo_caliente == objetivo:
+                    logger.info(f"♨️ [{self.nombre}] Formulario ya cargado: solo se repite la búsqueda")
+                    resultado = rebuscar_en_caliente(self.driver, self.wait, objetivo)
+                    if resultado:
+                        self.leer_cupos(objetivo)
+                        actualizar_catalogo_si_hace_falta(self.driver, objetivo)
+                    self.tiempos_navegador_ultimo_intento = capturar_tiempos_navegador(self.driver, limpiar=True)
+                    if resultado:
+                        self.intentos_exitosos += 1
+                        logger.info(f"✅ ¡PROCESO EXITOSO! [{self.nombre}] Búsqueda repetida en caliente")
+                        return resultado
+                    logger.warning(f"⚠️ [{self.nombre}] La búsqueda en caliente falló; se recarga la página completa")
+                    self.objetivo_caliente = None
+                
+                # Navegar a la página
+                logger.info("🌐 Navegando a la página de citas...")
+                try:
+                    with medir_paso("navegacion"):
+                        self.driver.get("https://institutodelcorazon.org/solicitar-cita/")
+                except Exception as e:
+                    logger.error(f"❌ Error navegando: {e}")
+                    if not self.reinicializar():
+                        return None
+                    with medir_paso("navegacion"):
+                        self.driver.get("https://institutodelcorazon.org/solicitar-cita/")
+                
+                # Ejecutar el proceso principal
+                logger.info("🎯 Ejecutando proceso de selección de citas...")
+                resultado = proceso_completo_final_actualizado(self.driver, self.wait, objetivo)
+                if resultado:
+                    self.leer_cupos(objetivo)
+                    actualizar_catalogo_si_hace_falta(self.driver, objetivo)
+                self.tiempos_navegador_ultimo_intento = capturar_tiempos_navegador(
+                    self.driver, limpiar=modo_caliente and bool(resultado)
+                )
+                
+                if resultado:
+                    self.intentos_exitosos += 1
+                    logger.info(f"✅ ¡PROCESO EXITOSO! [{self.nombre}] Se completó la selección de cita")
+                else:
+                    logger.warning(f"⚠️ [{self.nombre}] Intento #{self.contador_intentos} falló. Continuando...")
+                    capturar_instantanea_fallo(self.driver, "intento")
+                
+                # En modo caliente el formulario (y sus cookies) se conserva para el siguiente intento
+                if modo_caliente and resultado:
+                    self.objetivo_caliente = dict(objetivo)
+                else:
+                    self.limpiar()
+                
+            except Exception as e:
+                logger.error(f"❌ [{self.nombre}] Error crítico en intento #{self.contador_intentos}: {e}")
+                import traceback
+                logger.error(traceback.format_exc())
+                resultado = False
+                capturar_instantanea_fallo(self.driver, "intento", repr(e))
+                
+                # Intentar reinicializar driver después de error crítico
+                try:
+                    self.reinicializar()
+                except:
+                    logger.error("❌ No se pudo reinicializar driver después del error")
+            
+            finally:
+                duracion = time.monotonic() - inicio
+                self.duraciones_intentos.append(duracion)
+                contexto_metricas.tiempos = None
+                contexto_pausas.registro = None
+                contexto_fallos.registro = None
+                registrar_tiempo_paso("intento", duracion)
+                agregar_evento_traza("intento", "intento", inicio_traza, ahora_us() - inicio_traza,
+                                     {"objetivo": describir_objetivo(objetivo), "resultado": resultado})
+                self.ultima_traza = terminar_traza(f"{self.nombre}-{self.contador_intentos}")
+                if self.ultima_traza:
+                    logger.info(f"🧵 Traza del intento: {self.ultima_traza}")
+                self.tiempos_ultimo_intento = resumir_tiempos_intento(tiempos)
+                logger.info(f"⏱️ [{self.nombre}] Intento en {duracion:.1f}s: " + ", ".join(
+                    f"{paso} {segundos:.1f}s" for paso, segundos in self.tiempos_ultimo_intento.items()
+                ))
+                self.presupuesto_ultimo_intento = presupuesto_intento(pausas, duracion)
+                reportar_presupuesto(self.nombre, self.presupuesto_ultimo_intento)
+                reportar_tiempos_navegador(self.nombre, self.tiempos_navegador_ultimo_intento)
+                guardar_registro_intento({
+                    "fecha": datetime.now().isoformat(timespec="seconds"),
+                    "sesion": self.nombre,
+                    "intento": self.contador_intentos,
+                    "objetivo": objetivo,
+                    "resultado": resultado,
+                    "pasos_s": {paso: round(s, 3) for paso, s in self.tiempos_ultimo_intento.items()},
+                    "presupuesto": self.presupuesto_ultimo_intento,
+                    "navegador": self.tiempos_navegador_ultimo_intento,
+                    "cupos": [asdict(cupo) for cupo in self.cupos_ultimo_intento]
+                             if self.cupos_ultimo_intento is not None else None,
+                    "traza": self.ultima_traza,
+                    "instantanea_fallo": fallo.get("ruta"),
+                })
+            
+            return resultado
+    
+    def resumen(self):
+        """Contadores y tiempos de la sesión (serializable, sirve también entre procesos)"""
+        duraciones = self.duraciones_intentos
+        return {
+            "nombre": self.nombre,
+            "objetivo": dict(self.objetivo),
+            "intentos": self.contador_intentos,
+            "exitosos": self.intentos_exitosos,
+            "duracion_media_s": round(sum(duraciones) / len(duraciones), 2) if duraciones else None,
+            "tiempos_ultimo_intento": {paso: round(s, 3) for paso, s in self.tiempos_ultimo_intento.items()},
+            "presupuesto_ultimo_intento": self.presupuesto_ultimo_intento,
+            "cupos_ultimo_intento": len(self.cupos_ultimo_intento) if self.cupos_ultimo_intento is not None else None,
+            "activa_s": round(time.monotonic() - self.inicio, 1),
+        }
+
+# Sesión del modo automático y de la ejecución única
+sesion_global = SesionCitas()
 
 def reinicializar_driver():
     """Reinicia el driver si hay problemas"""
-    global driver_global, wait_global
-    
-    logger.info("🔄 Reinicializando driver...")
+    return sesion_global.reinicializar()
+
+def ejecutar_proceso_citas():
+    """Función principal que se ejecuta cada 4 minutos"""
+    sesion_global.ejecutar_intento()
+    logger.info(f"⏰ Próximo intento en 4 minutos...")
     
+    # Persistir qué estrategias y selectores ganaron en este intento y los tiempos por paso
+    guardar_estadisticas_estrategias()
+    guardar_metricas()
+
+# EJECUCIÓN DE VARIAS SESIONES EN UN POOL
+# Cada objetivo recibe su propia SesionCitas dentro de un pool de hilos o de procesos
+# (CITAS_MODO_POOL=procesos para repartir el trabajo entre todos los núcleos del equipo).
+modo_pool_sesiones = os.environ.get("CITAS_MODO_POOL", "hilos")
+evento_detener_sesiones = threading.Event()
+
+def ciclo_sesion(objetivo, nombre, intervalo, rondas=None, perfil=None):
+    """Bucle de intentos de una sesión; corre en un hilo o proceso del pool"""
+    sesion = SesionCitas(objetivo, perfil=perfil, nombre=nombre)
+    ronda = 0
     try:
-        if driver_global:
-            driver_global.quit()
-    except:
-        pass
+        while rondas is None or ronda < rondas:
+            ronda += 1
+            inicio = time.monotonic()
+            sesion.ejecutar_intento()
+            guardar_estadisticas_estrategias()
+            guardar_metricas()
+            if rondas is not None and ronda >= rondas:
+                break
+            with contabilizar("pausa", "ciclo_sesion:intervalo"):
+                if evento_detener_sesiones.wait(max(0, intervalo - (time.monotonic() - inicio))):
+                    break
+    finally:
+        sesion.cerrar()
+    return sesion.resumen()
+
+def ejecutar_sesiones_en_pool(objetivos, modo=None, max_trabajadores=None, intervalo=240, rondas=None):
+    """Ejecuta una sesión por objetivo en un pool de hilos o procesos y devuelve sus resúmenes"""
+    modo = modo or modo_pool_sesiones
+    max_trabajadores = max_trabajadores or len(objetivos)
+    clase_pool = ProcessPoolExecutor if modo == "procesos" else ThreadPoolExecutor
+    logger.info(f"🧵 {len(objetivos)} sesiones en un pool de {modo} (máx. {max_trabajadores} a la vez)")
     
-    driver_global = inicializar_driver()
-    if driver_global:
-        wait_global = WebDriverWait(driver_global, 90)
-        logger.info("✅ Driver reinicializado correctamente")
-        return True
-    else:
-        logger.error("❌ Error reinicializando driver")
-        return False
+    evento_detener_sesiones.clear()
+    resumenes = []
+    with clase_pool(max_workers=max_trabajadores) as pool:
+        futuros = [
+            pool.submit(ciclo_sesion, objetivo, f"sesion-{i + 1}", intervalo, rondas, perfil_navegador)
+            for i, objetivo in enumerate(objetivos)
+        ]
+        try:
+            for futuro in futuros:
+                try:
+                    resumenes.append(futuro.result())
+                except Exception as e:
+                    logger.error(f"❌ Una sesión terminó con error: {e}")
+        except KeyboardInterrupt:
+            # Los hilos terminan al acabar su intento actual; los procesos reciben su propio Ctrl+C
+            evento_detener_sesiones.set()
+            raise
+    
+    for resumen in resumenes:
+        logger.info(f"📊 {resumen['nombre']}: {resumen['intentos']} intentos, {resumen['exitosos']} exitosos, "
+                    f"media {resumen['duracion_media_s']}s")
+    return resumenes
 
-def ejecutar_proceso_citas():
-    """Función principal que se ejecuta cada 4 minutos"""
-    global driver_global, wait_global, contador_intentos
+# MODO PESTAÑAS: VARIOS OBJETIVOS EN UN SOLO CHROME
+# Cada objetivo corre en una pestaña del mismo navegador. El flujo de cada pestaña es un
+# generador que lanza un paso con las funciones del widget (window.__citas.accionPaso) y cede el
+# control con la condición JS que espera del sitio; el planificador rota entre pestañas y solo avanza la que ya está lista, así
+# mientras una espera al servidor las demás siguen trabajando. Cuesta una fracción de la memoria
+# de abrir un Chrome por objetivo.
+url_solicitar_cita = "https://institutodelcorazon.org/solicitar-cita/"
+rebanada_espera_pestana = 0.25  # segundos que se escucha una pestaña antes de pasar a la siguiente
+
+def reentrar_iframe_formulario(driver):
+    """Vuelve al iframe del formulario tras cambiar de pestaña (usa la caché del iframe)"""
+    estado = driver.execute_script(js_localizar_iframe_formulario, cargar_cache_iframe())
+    indice = estado["encontrado"] if estado["encontrado"] is not None else estado["cacheado"]
+    if indice is None:
+        return cambiar_a_iframe_formulario(driver, None)
+    driver.switch_to.frame(estado["iframes"][indice]["elemento"])
+    return True
+
+def flujo_pestana(driver, objetivo, pestana):
+    """Flujo de proceso_completo_final_actualizado partido en pasos.
     
-    contador_intentos += 1
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    Cede tuplas (descripción, condición JS, timeout) y recibe True si la condición se
+    cumplió o False si se agotó el tiempo. Devuelve el resultado del intento. Cada paso del
+    formulario solo lanza su acción con las funciones del widget (una llamada corta) y cede su
+    verificación, así ninguna pestaña bloquea a las demás mientras espera.
+    """
+    nombre = pestana["nombre"]
+    wait = WebDriverWait(driver, 90)
     
-    logger.info(f"")
-    logger.info(f"{'='*60}")
-    logger.info(f"🚀 INICIANDO INTENTO #{contador_intentos} - {timestamp}")
-    logger.info(f"{'='*60}")
+    # Navegar sin bloquear: driver.get esperaría la carga completa de la pestaña
+    driver.execute_script("window.location.href = arguments[0];", url_solicitar_cita)
+    if not (yield ("carga de la página",
+                   "document.readyState === 'complete' && (porId('button_service') || document.querySelector('iframe'))",
+                   60)):
+        logger.warning(f"⚠️ [{nombre}] La página no terminó de cargar")
+        return False
+    
+    if not driver.find_elements(By.ID, "button_service"):
+        if not cambiar_a_iframe_formulario(driver, wait):
+            logger.error(f"❌ [{nombre}] No se encontró el formulario")
+            return False
+        pestana["en_iframe"] = True
+        if not (yield ("formulario en iframe", "visible(porId('button_service'))", 30)):
+            logger.warning(f"⚠️ [{nombre}] button_service no apareció en el iframe")
+            return False
+    
+    datos = datos_conduccion(objetivo)
+    if datos is None:
+        leer_catalogo_formulario(driver)
+        datos = datos_conduccion(objetivo)
+    if datos is None:
+        logger.error(f"❌ [{nombre}] El objetivo no está en el catálogo del formulario")
+        return False
+    
+    for paso in pasos_formulario:
+        error = llamar_biblioteca(driver, "accionPaso", paso, datos)
+        if error:
+            logger.error(f"❌ [{nombre}] Paso '{paso}' falló: {error}")
+            return False
+        condicion = f"window.__citas && window.__citas.verificarPaso({json.dumps(paso)}, {json.dumps(datos)})"
+        if not (yield (paso, condicion, limites_pasos_formulario.get(paso, limite_paso_formulario))):
+            logger.error(f"❌ [{nombre}] Paso '{paso}' no verificado")
+            return False
     
-    # Verificar si alcanzamos el máximo de intentos
-    if contador_intentos > max_intentos:
-        logger.warning(f"⚠️ Alcanzado máximo de intentos ({max_intentos}). Continuando...")
-        contador_intentos = 0  # Resetear contador
+    if (yield ("agenda", js_condicion_agenda_lista, 30)):
+        pestana["cupos"], pestana["cupos_cambiaron"] = extraer_cupos(driver, timeout=0, objetivo=objetivo)
+    return True
+
+def avanzar_pestana(pestana, valor):
+    """Ejecuta el siguiente paso del flujo de una pestaña hasta su próxima espera"""
+    try:
+        descripcion, condicion, timeout = pestana["flujo"].send(valor)
+        pestana["espera"] = (descripcion, condicion)
+        pestana["limite"] = time.monotonic() + timeout
+    except StopIteration as fin:
+        pestana["espera"] = None
+        pestana["resultado"] = bool(fin.value)
+    except Exception as e:
+        logger.error(f"❌ [{pestana['nombre']}] Error en el flujo: {e}")
+        pestana["espera"] = None
+        pestana["resultado"] = False
+
+def ejecutar_pestanas(sesion, objetivos):
+    """Un intento de todos los objetivos, cada uno en su pestaña; devuelve los resultados en orden.
     
+    La ronda se instrumenta como un intento de SesionCitas: traza, tiempos por paso, presupuesto
+    de pausas y esperas y un registro en intentos.jsonl con el resultado de cada pestaña.
+    """
+    driver = sesion.driver
+    sesion.contador_intentos += 1
+    tiempos = contexto_metricas.tiempos = []
+    pausas = contexto_pausas.registro = {}
+    fallo = contexto_fallos.registro = {}  # Una instantánea de fallo por ronda
+    iniciar_traza()
+    inicio_traza = ahora_us()
+    inicio = time.monotonic()
+    pestanas = []
     try:
-        # Verificar si el driver existe y está funcionando
-        if not driver_global:
-            logger.info("🔧 Driver no existe, inicializando...")
-            if not reinicializar_driver():
-                logger.error("❌ No se pudo inicializar el driver")
-                return
+        handles = driver.window_handles
+        for i, objetivo in enumerate(objetivos):
+            if i < len(handles):
+                driver.switch_to.window(handles[i])
+            else:
+                driver.switch_to.new_window("tab")
+            pestana = {"nombre": f"pestaña-{i + 1}", "handle": driver.current_window_handle, "en_iframe": False,
+                       "espera": None, "limite": None, "resultado": None, "cupos": None,
+                       "cupos_cambiaron": False}
+            pestana["flujo"] = flujo_pestana(driver, objetivo, pestana)
+            logger.info(f"🗂️ [{pestana['nombre']}] {describir_objetivo(objetivo)}")
+            avanzar_pestana(pestana, None)
+            pestanas.append(pestana)
         
-        # Verificar que el driver funciona
-        try:
-            driver_global.current_url
-        except Exception as e:
-            logger.warning(f"⚠️ Driver no responde: {e}")
-            if not reinicializar_driver():
-                logger.error("❌ No se pudo reinicializar driver")
-                return
+        pendientes = [pestana for pestana in pestanas if pestana["espera"]]
+        while pendientes:
+            for pestana in pendientes:
+                try:
+                    driver.switch_to.window(pestana["handle"])
+                    if pestana["en_iframe"]:
+                        reentrar_iframe_formulario(driver)
+                except Exception as e:
+                    logger.error(f"❌ [{pestana['nombre']}] No se pudo volver a la pestaña: {e}")
+                    pestana["flujo"].close()
+                    pestana["espera"] = None
+                    pestana["resultado"] = False
+                    continue
+            
+                # Con una sola pestaña pendiente se la escucha hasta su límite; si no, una rebanada corta
+                restante = pestana["limite"] - time.monotonic()
+                rebanada = restante if len(pendientes) == 1 else min(rebanada_espera_pestana, restante)
+                descripcion, condicion = pestana["espera"]
+                if esperar_condicion_js(driver, condicion, timeout=max(0.05, rebanada)):
+                    logger.info(f"✅ [{pestana['nombre']}] Lista: {descripcion}")
+                    avanzar_pestana(pestana, True)
+                elif time.monotonic() >= pestana["limite"]:
+                    logger.warning(f"⏱️ [{pestana['nombre']}] Tiempo agotado esperando: {descripcion}")
+                    avanzar_pestana(pestana, False)
+            pendientes = [pestana for pestana in pendientes if pestana["espera"]]
         
-        # Navegar a la página
-        logger.info("🌐 Navegando a la página de citas...")
-        try:
-            driver_global.get("https://institutodelcorazon.org/solicitar-cita/")
-            time.sleep(5)  # Esperar carga inicial
-        except Exception as e:
-            logger.error(f"❌ Error navegando: {e}")
-            if not reinicializar_driver():
+        for pestana, objetivo in zip(pestanas, objetivos):
+            estado = "✅ ÉXITO" if pestana["resultado"] else "❌ sin éxito"
+            if pestana["cupos"] is not None:
+                estado += f", {len(pestana['cupos'])} cupos"
+                registrar_lectura_cupos(objetivo, pestana["cupos"], pestana["cupos_cambiaron"])
+            logger.info(f"📋 [{pestana['nombre']}] {describir_objetivo(objetivo)}: {estado}")
+        return [pestana["resultado"] for pestana in pestanas]
+    finally:
+        duracion = time.monotonic() - inicio
+        sesion.duraciones_intentos.append(duracion)
+        contexto_metricas.tiempos = None
+        contexto_pausas.registro = None
+        contexto_fallos.registro = None
+        registrar_tiempo_paso("ronda_pestanas", duracion)
+        resultados = [{"objetivo": objetivo, "resultado": pestana["resultado"],
+                       "cupos": [asdict(cupo) for cupo in pestana["cupos"]] if pestana["cupos"] is not None else None}
+                      for pestana, objetivo in zip(pestanas, objetivos)]
+        agregar_evento_traza("ronda_pestanas", "intento", inicio_traza, ahora_us() - inicio_traza,
+                             {"objetivos": [describir_objetivo(objetivo) for objetivo in objetivos],
+                              "resultados": [r["resultado"] for r in resultados]})
+        sesion.ultima_traza = terminar_traza(f"{sesion.nombre}-{sesion.contador_intentos}")
+        if sesion.ultima_traza:
+            logger.info(f"🧵 Traza de la ronda: {sesion.ultima_traza}")
+        sesion.tiempos_ultimo_intento = resumir_tiempos_intento(tiempos)
+        sesion.presupuesto_ultimo_intento = presupuesto_intento(pausas, duracion)
+        reportar_presupuesto(sesion.nombre, sesion.presupuesto_ultimo_intento)
+        guardar_registro_intento({
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "sesion": sesion.nombre,
+            "intento": sesion.contador_intentos,
+            "objetivos": resultados,
+            "resultado": bool(resultados) and all(r["resultado"] for r in resultados),
+            "pasos_s": {paso: round(s, 3) for paso, s in sesion.tiempos_ultimo_intento.items()},
+            "presupuesto": sesion.presupuesto_ultimo_intento,
+            "traza": sesion.ultima_traza,
+            "instantanea_fallo": fallo.get("ruta"),
+        })
+
+def iniciar_modo_pestanas(intervalo=240):
+    """Sondea todos los objetivos configurados en pestañas de un solo Chrome cada `intervalo` segundos"""
+    objetivos = cargar_objetivos()
+    sesion = SesionCitas(nombre="pestañas")
+    logger.info(f"🚀 INICIANDO MODO PESTAÑAS: {len(objetivos)} objetivos en un solo navegador")
+    logger.info("🛑 Presiona Ctrl+C para detener")
+    
+    try:
+        while True:
+            inicio = time.monotonic()
+            if not sesion.asegurar_driver():
+                logger.error("❌ No se pudo inicializar el driver. Saliendo...")
                 return
-            driver_global.get("https://institutodelcorazon.org/solicitar-cita/")
-        
-        # Ejecutar el proceso principal
-        logger.info("🎯 Ejecutando proceso de selección de citas...")
-        resultado = proceso_completo_final_actualizado(driver_global, wait_global)
-        
-        if resultado:
-            logger.info("✅ ¡PROCESO EXITOSO! Se completó la selección de cita")
-            logger.info("🎉 Proceso terminado con éxito.")
-        else:
-            logger.warning(f"⚠️ Intento #{contador_intentos} falló. Continuando...")
-        
-        logger.info(f"⏰ Próximo intento en 4 minutos...")
-        
-        # Limpiar cookies y caché para el siguiente intento
-        try:
-            driver_global.delete_all_cookies()
-            driver_global.execute_script("window.localStorage.clear();")
-            driver_global.execute_script("window.sessionStorage.clear();")
-        except:
-            pass
-        
-    except Exception as e:
-        logger.error(f"❌ Error crítico en intento #{contador_intentos}: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
-        
-        # Intentar reinicializar driver después de error crítico
-        try:
-            reinicializar_driver()
-        except:
-            logger.error("❌ No se pudo reinicializar driver después del error")
+            try:
+                ejecutar_pestanas(sesion, objetivos)
+                sesion.limpiar()
+            except Exception as e:
+                logger.error(f"❌ Error en la ronda de pestañas: {e}")
+                sesion.reinicializar()
+            guardar_estadisticas_estrategias()
+            guardar_metricas()
+            
+            logger.info(f"⏰ Ronda completada en {time.monotonic() - inicio:.1f}s; próxima en {intervalo // 60} minutos...")
+            if evento_detener_sesiones.wait(max(0, intervalo - (time.monotonic() - inicio))):
+                break
+    except KeyboardInterrupt:
+        logger.info("")
+        logger.info("🛑 Proceso interrumpido por el usuario")
+    finally:
+        sesion.cerrar()
+        logger.info("👋 Proceso terminado")
 
 def mostrar_estado():
     """Muestra el estado actual del proceso"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     logger.info(f"")
     logger.info(f"📊 ESTADO ACTUAL - {timestamp}")
-    logger.info(f"   Intentos realizados: {contador_intentos}")
-    logger.info(f"   Driver activo: {'✅ Sí' if driver_global else '❌ No'}")
+    logger.info(f"   Intentos realizados: {sesion_global.contador_intentos}")
+    logger.info(f"   Driver activo: {'✅ Sí' if sesion_global.driver else '❌ No'}")
+    
+    # Tiempo real desde que arrancó la sesión (antes se estimaba como intentos * 4 minutos)
+    tiempo_transcurrido = int(time.monotonic() - sesion_global.inicio) // 60  # minutos
+    horas = tiempo_transcurrido // 60
+    minutos = tiempo_transcurrido % 60
+    logger.info(f"   Tiempo transcurrido: {horas}h {minutos}m")
     
-    if contador_intentos > 0:
-        tiempo_transcurrido = contador_intentos * 4  # minutos
-        horas = tiempo_transcurrido // 60
-        minutos = tiempo_transcurrido % 60
-        logger.info(f"   Tiempo transcurrido: {horas}h {minutos}m")
+    with bloqueo_metricas:
+        intentos = histogramas_pasos.get("intento")
+        if intentos and intentos.cuenta:
+            logger.info(f"   Duración de intentos: p50 {intentos.percentil(50):.1f}s, p95 {intentos.percentil(95):.1f}s")
+    reportar_historial_cupos()
     
     logger.info(f"   Próximo intento en: 4 minutos")
     logger.info(f"")
 
 def iniciar_proceso_automatico():
     """Inicia el proceso automático con scheduler"""
-    global driver_global, wait_global
-    
     logger.info("🚀 INICIANDO PROCESO AUTOMÁTICO DE CITAS")
     logger.info("⏰ Se ejecutará cada 4 minutos automáticamente")
     logger.info("🛑 Presiona Ctrl+C para detener")
     logger.info("")
     
-    # Inicializar driver
-    logger.info("🔧 Inicializando driver...")
-    driver_global = inicializar_driver()
-    if not driver_global:
-        logger.error("❌ No se pudo inicializar el driver. Saliendo...")
-        return
-    
-    wait_global = WebDriverWait(driver_global, 90)
-    logger.info("✅ Driver inicializado correctamente")
+    # Inicializar driver (con sonda HTTP, Chrome solo se abre cuando la sonda ve disponibilidad)
+    if cargar_config_sonda():
+        logger.info("🔎 Sonda HTTP configurada: el navegador se abrirá solo cuando haya disponibilidad")
+    else:
+        logger.info("🔧 Inicializando driver...")
+        if not sesion_global.inicializar():
+            logger.error("❌ No se pudo inicializar el driver. Saliendo...")
+            return
+        
+        logger.info("✅ Driver inicializado correctamente")
     
     # Ejecutar inmediatamente el primer intento
     logger.info("🚀 Ejecutando primer intento...")
@@ -2072,7 +4149,7 @@ def iniciar_proceso_automatico():
     try:
         while True:
             schedule.run_pending()
-            time.sleep(30)  # Verificar cada 30 segundos
+            pausar(30, "scheduler")  # Verificar cada 30 segundos
             
     except KeyboardInterrupt:
         logger.info("")
@@ -2083,12 +4160,283 @@ def iniciar_proceso_automatico():
         
     finally:
         logger.info("🧹 Limpiando recursos...")
+        cerrar_conexiones_sonda()
+        if sesion_global.driver:
+            sesion_global.cerrar()
+            logger.info("✅ Driver cerrado correctamente")
+        logger.info("👋 Proceso terminado")
+
+# SONDEO CONCURRENTE DE VARIOS OBJETIVOS
+# Varios objetivos (servicio, subconsulta, ciudad) se sondean a la vez en un solo event loop:
+# las sondas HTTP comparten un semáforo y los intentos con navegador un pool de sesiones, así
+# que añadir un objetivo no suma un intento serial completo. Los objetivos se leen de un JSON
+# (ruta en CITAS_OBJETIVOS o datos/objetivos.json); las claves que falten toman el valor por defecto:
+#
+# [
+#   {"servicio": "1450", "nombre_servicio": "CARDIOLOGÍA", "subconsulta": "control", "ciudad": "Medellín"},
+#   {"servicio": "1450", "nombre_servicio": "CARDIOLOGÍA", "subconsulta": "primera_vez", "ciudad": "Rionegro"}
+# ]
+archivo_objetivos = os.environ.get("CITAS_OBJETIVOS", os.path.join(directorio_datos, "objetivos.json"))
+max_navegadores_concurrentes = int(os.environ.get("CITAS_MAX_NAVEGADORES", "2"))
+max_sondas_concurrentes = int(os.environ.get("CITAS_MAX_SONDAS", "8"))
+intervalo_sondeo = 240  # segundos, igual que el modo automático
+
+def cargar_objetivos():
+    """Lee la lista de objetivos; sin archivo se usa solo el objetivo por defecto"""
+    try:
+        with open(archivo_objetivos, encoding="utf-8") as archivo:
+            objetivos = json.load(archivo)
+    except FileNotFoundError:
+        return [dict(objetivo_por_defecto)]
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ No se pudo leer {archivo_objetivos}, se usa el objetivo por defecto: {e}")
+        return [dict(objetivo_por_defecto)]
+    
+    return [{**objetivo_por_defecto, **objetivo} for objetivo in objetivos]
+
+def describir_objetivo(objetivo):
+    """Texto corto para identificar un objetivo en los logs"""
+    return f"{objetivo.get('nombre_servicio') or objetivo['servicio']} / {objetivo['subconsulta']} / {objetivo['ciudad']}"
+
+async def sondear_objetivo(objetivo, config_sonda, semaforo_sondas, sesiones):
+    """Un intento para un objetivo: sonda HTTP (si hay) y, si hace falta, una sesión del pool"""
+    descripcion = describir_objetivo(objetivo)
+    
+    if config_sonda:
+        async with semaforo_sondas:
+            disponible = await asyncio.to_thread(sondear_disponibilidad_http, objetivo, config_sonda)
+        if disponible is False:
+            logger.info(f"😴 [{descripcion}] Sin disponibilidad según la sonda HTTP")
+            return False
+    
+    # Las sesiones del pool abren su navegador al usarlas por primera vez y lo reutilizan
+    sesion = await sesiones.get()
+    try:
+        logger.info(f"🎯 [{descripcion}] Intento en {sesion.nombre}")
+        return await asyncio.to_thread(sesion.ejecutar_intento, objetivo, False)
+    finally:
+        sesiones.put_nowait(sesion)
+
+async def sondear_objetivos(objetivos, intervalo=intervalo_sondeo, rondas=None):
+    """Sondea todos los objetivos a la vez cada `intervalo` segundos (indefinidamente si rondas es None)"""
+    config_sonda = cargar_config_sonda()
+    semaforo_sondas = asyncio.Semaphore(max_sondas_concurrentes)
+    sesiones = asyncio.Queue()
+    for i in range(max(1, min(max_navegadores_concurrentes, len(objetivos)))):
+        sesiones.put_nowait(SesionCitas(nombre=f"navegador-{i + 1}"))
+    
+    loop = asyncio.get_running_loop()
+    ronda = 0
+    try:
+        while rondas is None or ronda < rondas:
+            ronda += 1
+            inicio = loop.time()
+            logger.info(f"")
+            logger.info(f"{'='*60}")
+            logger.info(f"🚀 RONDA #{ronda} - {len(objetivos)} objetivos - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            logger.info(f"{'='*60}")
+            
+            resultados = await asyncio.gather(
+                *(sondear_objetivo(objetivo, config_sonda, semaforo_sondas, sesiones) for objetivo in objetivos),
+                return_exceptions=True,
+            )
+            for objetivo, resultado in zip(objetivos, resultados):
+                if isinstance(resultado, Exception):
+                    logger.error(f"❌ [{describir_objetivo(objetivo)}] Error: {resultado}")
+            
+            # Persistir qué estrategias y selectores ganaron en esta ronda y los tiempos por paso
+            guardar_estadisticas_estrategias()
+            guardar_metricas()
+            
+            duracion = loop.time() - inicio
+            logger.info(f"⏱️ Ronda #{ronda} completada en {duracion:.1f}s")
+            if rondas is None or ronda < rondas:
+                await asyncio.sleep(max(0, intervalo - duracion))
+    finally:
+        while not sesiones.empty():
+            await asyncio.to_thread(sesiones.get_nowait().cerrar)
+        cerrar_conexiones_sonda()
+
+def iniciar_sondeo_multiple():
+    """Inicia el sondeo concurrente de todos los objetivos configurados"""
+    objetivos = cargar_objetivos()
+    
+    logger.info("🚀 INICIANDO SONDEO CONCURRENTE DE OBJETIVOS")
+    for objetivo in objetivos:
+        logger.info(f"   • {describir_objetivo(objetivo)}")
+    logger.info(f"⏰ Se ejecutará cada {intervalo_sondeo // 60} minutos "
+                f"(máx. {max_navegadores_concurrentes} navegadores y {max_sondas_concurrentes} sondas a la vez)")
+    logger.info("🛑 Presiona Ctrl+C para detener")
+    
+    try:
+        asyncio.run(sondear_objetivos(objetivos))
+    except KeyboardInterrupt:
+        logger.info("")
+        logger.info("🛑 Proceso interrumpido por el usuario")
+    logger.info("👋 Proceso terminado")
+
+# VIGILANCIA CONTINUA DE RESULTADOS (MUTATIONOBSERVER)
+# Con el formulario caliente se instala en la página un MutationObserver sobre el área de
+# resultados que, tras un silencio de 500ms, compara el contenido con el anterior y encola el
+# cambio. Python queda bloqueado en un script asíncrono que despierta con el evento 'citas:cambio'
+# (sin sondear), y si no hubo cambios en el intervalo repite solo la búsqueda en caliente.
+selector_area_resultados = os.environ.get("CITAS_SELECTOR_RESULTADOS", "#schedule_section, #group_section")
+intervalo_vigilancia = int(os.environ.get("CITAS_INTERVALO_VIGILANCIA", "20"))  # segundos (< tiempo_max_script_async)
+
+js_instalar_vigilante = """
+var selector = arguments[0];
+var silencioMs = arguments[1];
+var areas = Array.prototype.slice.call(document.querySelectorAll(selector));
+if (!areas.length) return null;
+
+// Si ya vigila exactamente los mismos nodos se conserva (y su cola de cambios)
+var previo = window.__vigilanteCitas;
+if (previo && previo.areas.length === areas.length &&
+        previo.areas.every(function (area, i) { return area === areas[i]; })) {
+    return previo.ultima;
+}
+if (previo) previo.observador.disconnect();
+
+function firma() {
+    return areas.map(function (area) { return area.textContent.replace(/\\s+/g, ' ').trim(); }).join(' | ');
+}
+var vigilante = {areas: areas, cola: [], ultima: firma(), temporizador: null, observador: null};
+vigilante.observador = new MutationObserver(function () {
+    clearTimeout(vigilante.temporizador);
+    vigilante.temporizador = setTimeout(function () {
+        var actual = firma();
+        if (actual === vigilante.ultima) return;
+        vigilante.ultima = actual;
+        vigilante.cola.push({momento: Date.now(), firma: actual.slice(0, 2000), elementos: areas.reduce(function (n, area) {
+            return n + area.querySelectorAll('button, li').length;
+        }, 0)});
+        window.dispatchEvent(new CustomEvent('citas:cambio'));
+    }, silencioMs);
+});
+areas.forEach(function (area) {
+    vigilante.observador.observe(area, {childList: true, subtree: true, characterData: true, attributes: true});
+});
+window.__vigilanteCitas = vigilante;
+return vigilante.ultima;
+"""
+
+# Devuelve los cambios encolados en cuanto haya alguno, [] al agotar el tiempo y null si el
+# vigilante ya no existe (la página se recargó)
+js_esperar_cambios = """
+var callback = arguments[arguments.length - 1];
+var limiteMs = arguments[0];
+var vigilante = window.__vigilanteCitas;
+
+new Promise(function (resolver) {
+    if (!vigilante) return resolver(null);
+    if (vigilante.cola.length) return resolver(true);
+    var limite = null;
+    function alCambiar() {
+        clearTimeout(limite);
+        window.removeEventListener('citas:cambio', alCambiar);
+        resolver(true);
+    }
+    window.addEventListener('citas:cambio', alCambiar);
+    limite = setTimeout(function () {
+        window.removeEventListener('citas:cambio', alCambiar);
+        resolver(false);
+    }, limiteMs);
+}).then(function (hayCambios) {
+    if (hayCambios === null) return callback(null);
+    var cambios = vigilante.cola;
+    vigilante.cola = [];
+    callback(cambios);
+});
+"""
+
+def instalar_vigilante_resultados(driver):
+    """Instala (o conserva) el vigilante en el documento actual; devuelve el contenido vigilado o None"""
+    try:
+        return driver.execute_script(js_instalar_vigilante, selector_area_resultados, 500)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo instalar el vigilante de resultados: {e}")
+        return None
+
+def esperar_cambios_resultados(driver, timeout=20):
+    """Bloquea hasta que el vigilante registre cambios; [] sin cambios y None si se perdió el vigilante"""
+    with contabilizar("espera") as estado:
         try:
-            if driver_global:
-                driver_global.quit()
-                logger.info("✅ Driver cerrado correctamente")
-        except:
-            pass
+            cambios = driver.execute_async_script(js_esperar_cambios, int(timeout * 1000))
+        except TimeoutException:
+            cambios = []
+        except Exception as e:
+            logger.warning(f"⚠️ Error esperando cambios en los resultados: {e}")
+            cambios = None
+        estado["agotada"] = cambios == []
+        return cambios
+
+def vigilar_resultados(sesion=None, objetivo=None, intervalo=None, duracion_max=None):
+    """Vigila el área de resultados y avisa de cada cambio; recarga solo si la página se pierde"""
+    sesion = sesion or sesion_global
+    objetivo = objetivo or sesion.objetivo
+    intervalo = intervalo or intervalo_vigilancia
+    inicio = time.monotonic()
+    if not modo_caliente:
+        logger.error("❌ La vigilancia necesita el modo caliente (CITAS_MODO_CALIENTE distinto de 0)")
+        return
+    
+    while duracion_max is None or time.monotonic() - inicio < duracion_max:
+        # La primera vez (o tras perder la página) se hace un intento completo para dejarla caliente
+        if sesion.objetivo_caliente != objetivo:
+            if not sesion.ejecutar_intento(objetivo) or sesion.objetivo_caliente != objetivo:
+                logger.warning(f"⚠️ No se pudo dejar el formulario listo; reintentando en {intervalo}s")
+                pausar(intervalo, "vigilar_resultados:reintento")
+                continue
+        
+        error_navegador = False
+        with sesion.bloqueo:
+            try:
+                contenido = instalar_vigilante_resultados(sesion.driver) if entrar_contexto_formulario(sesion.driver) else None
+                if contenido is None:
+                    logger.warning("⚠️ No se encontró el área de resultados; se recargará la página")
+                    sesion.objetivo_caliente = None
+                    continue
+                logger.info(f"👁️ Vigilando resultados ({describir_objetivo(objetivo)}): {contenido[:120]}")
+                
+                cambios = esperar_cambios_resultados(sesion.driver, timeout=intervalo)
+                if cambios is None:
+                    logger.warning("⚠️ Se perdió el vigilante (la página cambió); se recargará")
+                    sesion.objetivo_caliente = None
+                    continue
+                
+                for cambio in cambios:
+                    logger.info(f"🔔 CAMBIO EN LOS RESULTADOS ({cambio['elementos']} elementos): {cambio['firma'][:300]}")
+                if cambios:
+                    sesion.leer_cupos(objetivo, timeout=0)
+                
+                # Sin cambios en el intervalo: el widget no se actualiza solo, se repite la búsqueda en caliente
+                if not cambios and not rebuscar_en_caliente(sesion.driver, sesion.wait, objetivo):
+                    logger.warning("⚠️ La búsqueda en caliente falló; se recargará la página")
+                    sesion.objetivo_caliente = None
+            except WebDriverException as e:
+                # Un fallo del navegador no termina la vigilancia: se recarga la página (y el driver si no responde)
+                logger.warning(f"⚠️ Error del navegador vigilando resultados: {e.msg or type(e).__name__}; se recargará en {intervalo}s")
+                sesion.objetivo_caliente = None
+                sesion.asegurar_driver()
+                error_navegador = True
+        # La pausa se hace fuera del bloqueo para no retener la sesión mientras se espera
+        if error_navegador:
+            pausar(intervalo, "vigilar_resultados:error_navegador")
+
+def iniciar_vigilancia():
+    """Modo de vigilancia continua del objetivo por defecto"""
+    logger.info("👁️ INICIANDO VIGILANCIA CONTINUA DE RESULTADOS")
+    logger.info(f"⏰ Búsqueda en caliente cada {intervalo_vigilancia}s si no hay cambios; avisos al instante")
+    logger.info("🛑 Presiona Ctrl+C para detener")
+    try:
+        vigilar_resultados()
+    except KeyboardInterrupt:
+        logger.info("")
+        logger.info("🛑 Proceso interrumpido por el usuario")
+    finally:
+        guardar_estadisticas_estrategias()
+        guardar_metricas()
+        sesion_global.cerrar()
         logger.info("👋 Proceso terminado")
 
 def menu_principal():
@@ -2101,12 +4449,16 @@ def menu_principal():
     print()
     print("1. 🔄 Modo automático (cada 4 minutos)")
     print("2. 🎯 Ejecución única")
-    print("3. ❌ Salir")
+    print("3. 🔀 Varios objetivos a la vez (datos/objetivos.json)")
+    print("4. 🧵 Una sesión por objetivo en paralelo (hilos o procesos)")
+    print("5. 🗂️ Varios objetivos en pestañas de un solo Chrome")
+    print("6. 👁️ Vigilancia continua de resultados")
+    print("7. ❌ Salir")
     print()
     
     while True:
         try:
-            opcion = input("Ingresa tu opción (1-3): ").strip()
+            opcion = input("Ingresa tu opción (1-7): ").strip()
             
             if opcion == "1":
                 print("\n🔄 Iniciando modo automático cada 4 minutos...")
@@ -2119,11 +4471,31 @@ def menu_principal():
                 break
                 
             elif opcion == "3":
+                print("\n🔀 Iniciando sondeo de varios objetivos...")
+                iniciar_sondeo_multiple()
+                break
+                
+            elif opcion == "4":
+                print(f"\n🧵 Iniciando una sesión por objetivo ({modo_pool_sesiones})...")
+                ejecutar_sesiones_en_pool(cargar_objetivos())
+                break
+                
+            elif opcion == "5":
+                print("\n🗂️ Iniciando modo pestañas...")
+                iniciar_modo_pestanas()
+                break
+                
+            elif opcion == "6":
+                print("\n👁️ Iniciando vigilancia continua...")
+                iniciar_vigilancia()
+                break
+                
+            elif opcion == "7":
                 print("\n👋 Saliendo...")
                 break
                 
             else:
-                print("❌ Opción inválida. Por favor ingresa 1, 2 o 3.")
+                print("❌ Opción inválida. Por favor ingresa un número del 1 al 7.")
                 
         except KeyboardInterrupt:
             print("\n\n🛑 Proceso interrumpido por el usuario")
@@ -2131,25 +4503,21 @@ def menu_principal():
 
 def ejecutar_proceso_unico():
     """Ejecuta el proceso una sola vez (modo original)"""
-    global driver_global, wait_global
-    
     # INICIALIZAR DRIVER
-    driver_global = inicializar_driver()
-    if not driver_global:
+    if not sesion_global.inicializar():
         logger.error("No se pudo inicializar el driver. Saliendo...")
         return
 
-    wait_global = WebDriverWait(driver_global, 90)
-
     try:
         # ABRIR LA PÁGINA INICIAL
         logger.info("Abriendo la página web...")
-        driver_global.get("https://institutodelcorazon.org/solicitar-cita/")
+        with medir_paso("navegacion"):
+            sesion_global.driver.get("https://institutodelcorazon.org/solicitar-cita/")
 
         logger.info("Iniciando proceso completo...")
         
         # PROCESO COMPLETO FINAL ACTUALIZADO
-        if proceso_completo_final_actualizado(driver_global, wait_global):
+        if proceso_completo_final_actualizado(sesion_global.driver, sesion_global.wait, sesion_global.objetivo):
             logger.info("✅ Proceso exitoso!")
         else:
             logger.error("❌ Proceso falló")
@@ -2162,10 +4530,12 @@ def ejecutar_proceso_unico():
         logger.error(traceback.format_exc())
 
     finally:
+        guardar_estadisticas_estrategias()
+        guardar_metricas()
         logger.info("Script pausado para revisar la página. Presiona Enter para continuar...")
         input("Presiona Enter para cerrar el navegador...")
-        if driver_global:
-            driver_global.quit()
+        if sesion_global.driver:
+            sesion_global.cerrar()
             logger.info("Navegador cerrado correctamente")
 
 # PUNTO DE ENTRADA PRINCIPAL
@@ -2178,14 +4548,4 @@ if __name__ == "__main__":
         logger.error(f"Error crítico: {e}")
     finally:
         # Asegurar que el driver se cierre
-        if 'driver_global' in globals() and driver_global:
-            try:
-                driver_global.quit()
-            except:
-                pass
-        # Asegurar que el driver se cierre
-        if 'driver_global' in globals() and driver_global:
-            try:
-                driver_global.quit()
-            except:
-                pass
+        sesion_global.cerrar()
@@ -0,0 +1,431 @@
+"""Réplica local del widget de solicitar-cita para pruebas y benchmarks.
+
+Sirve una copia HTML/JS con la misma estructura que recorre formulario_cita.py
+(button_service, services_drop, service_list, btn_search, group_section/groups_drop,
+professional_drop y la lista de horarios), directamente en la página o dentro de un
+iframe, con retrasos configurables para el armado del widget y para cada respuesta.
+
+Uso:
+    python replica_widget.py --puerto 8765 --iframe --retraso-busqueda 1500
+
+Cualquier parámetro se puede cambiar por petición con la query string, p. ej.
+http://127.0.0.1:8765/solicitar-cita/?iframe=1&busqueda=1500&cupos=0
+
+La sonda HTTP de formulario_cita también se puede probar contra la réplica:
+    python replica_widget.py --config-sonda datos/sonda_replica.json
+    CITAS_SONDA_CONFIG=datos/sonda_replica.json python formulario_cita.py
+    python replica_widget.py --verificar-sonda
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# RETRASOS SIMULADOS (milisegundos)
+# widget y dropdown se aplican en el navegador (setTimeout); busqueda, profesionales y
+# horarios en el servidor antes de responder, como la latencia de red del sitio real.
+retrasos_por_defecto = {
+    "widget": 300,         # Armado del formulario por JavaScript tras cargar la página
+    "dropdown": 50,        # Apertura de cada dropdown
+    "busqueda": 800,       # Respuesta de btn_search (sedes disponibles)
+    "profesionales": 400,  # Respuesta al elegir sede
+    "horarios": 600,       # Respuesta al elegir profesional
+}
+
+# CATÁLOGO DE LA RÉPLICA (mismos data-value que el sitio real)
+catalogo_servicios = [
+    {"id": "1450", "nombre": "CARDIOLOGÍA", "subservicios": [
+        {"id": "1510", "nombre": "890228 - CONSULTA DE PRIMERA VEZ POR ESPECIALISTA EN CARDIOLOGÍA."},
+        {"id": "3443", "nombre": "890228 - CONSULTA DE PRIMERA VEZ POR ESPECIALISTA EN CARDIOLOGÍA PEDIÁTRICA."},
+        {"id": "1511", "nombre": "890328 - CONSULTA DE CONTROL O DE SEGUIMIENTO POR ESPECIALISTA EN CARDIOLOGÍA."},
+        {"id": "3444", "nombre": "890328 - CONSULTA DE CONTROL O DE SEGUIMIENTO POR ESPECIALISTA EN CARDIOLOGÍA PEDIÁTRICA."},
+    ]},
+    {"id": "1451", "nombre": "CIRUGÍA CARDIOVASCULAR", "subservicios": [
+        {"id": "1520", "nombre": "890235 - CONSULTA DE PRIMERA VEZ POR ESPECIALISTA EN CIRUGÍA CARDIOVASCULAR."},
+    ]},
+    {"id": "1452", "nombre": "ELECTROFISIOLOGÍA", "subservicios": [
+        {"id": "1530", "nombre": "890229 - CONSULTA DE PRIMERA VEZ POR ESPECIALISTA EN ELECTROFISIOLOGÍA."},
+    ]},
+]
+sedes_replica = ["Medellín", "Rionegro", "Apartadó"]
+profesionales_replica = ["Cualquier profesional", "Dra. Ana Restrepo", "Dr. Carlos Gómez"]
+
+pagina_principal = """<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>Solicitar cita (réplica local)</title>
+<style>
+body { font-family: sans-serif; margin: 0; }
+header, footer { background: #9e132b; color: #fff; padding: 16px; }
+main { padding: 16px; min-height: 1200px; }
+iframe { width: 100%; height: 900px; border: 0; }
+</style>
+</head>
+<body>
+<header>Instituto del Corazón - réplica local</header>
+<main>
+<h1>Solicitar cita</h1>
+__CONTENIDO__
+</main>
+<footer>Réplica para pruebas; no envía datos a ningún sitio.</footer>
+</body>
+</html>
+"""
+
+pagina_widget = """<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>Widget de citas (réplica local)</title>
+__ESTILOS__
+</head>
+<body>
+<div id="booking_widget"></div>
+<script>var CONFIG_REPLICA = __CONFIG__;</script>
+<script>__SCRIPT__</script>
+</body>
+</html>
+"""
+
+estilos_widget = """<style>
+.dropdown { position: relative; margin: 8px 0; }
+.dropbtn { padding: 8px 12px; min-width: 320px; text-align: left; }
+.dropdown-content { display: none; border: 1px solid #ccc; background: #fff; padding: 4px; }
+.dropdown-content.show { display: block; }
+.submenu { display: none; }
+.submenu.show { display: block; }
+ul { list-style: none; padding-left: 8px; }
+#btn_search { display: none; color: #fff; padding: 8px 24px; }
+#group_section, #professional_section, #schedule_section { display: none; margin-top: 16px; }
+</style>"""
+
+# Funciones con los mismos nombres que el widget real (showList, showServiceOptionSelected,
+# showGroups, showProfessionals) para que las estrategias por JavaScript también se ejerciten
+script_widget = r"""
+var estado = {servicio: null, subservicio: null, sede: null, profesional: null};
+
+function conRetraso(ms, funcion) { setTimeout(funcion, ms); }
+function api(ruta, parametros) {
+    var query = Object.keys(parametros).map(function (k) {
+        return k + '=' + encodeURIComponent(parametros[k]);
+    }).join('&');
+    return fetch(ruta + '?' + query + '&' + CONFIG_REPLICA.query).then(function (r) { return r.json(); });
+}
+function alternar(id) {
+    conRetraso(CONFIG_REPLICA.retrasos.dropdown, function () {
+        document.getElementById(id).classList.toggle('show');
+    });
+}
+
+function showList(id) { alternar(id); }
+function showGroups(id) { alternar(id); }
+function showProfessionals(id) { alternar(id); }
+
+function showServiceOptionSelected(boton) {
+    estado.servicio = boton.getAttribute('data-value');
+    document.querySelectorAll('#service_list .submenu').forEach(function (submenu) {
+        submenu.classList.toggle('show', submenu.getAttribute('data-parent_id') === estado.servicio);
+    });
+}
+
+function selectSubservice(boton) {
+    estado.subservicio = boton.getAttribute('data-value');
+    document.getElementById('selected_service').textContent = boton.textContent;
+    document.getElementById('services_drop').classList.remove('show');
+    document.getElementById('btn_search').style.display = 'inline-block';
+}
+
+function buscar() {
+    ['group_section', 'professional_section', 'schedule_section'].forEach(function (id) {
+        document.getElementById(id).style.display = 'none';
+    });
+    estado.sede = null;
+    estado.profesional = null;
+    document.getElementById('selected_place').textContent = 'Seleccione una sede';
+    api('/api/buscar', {service: estado.subservicio}).then(function (datos) {
+        var lista = document.getElementById('group');
+        lista.innerHTML = '';
+        datos.sedes.forEach(function (sede) {
+            var li = document.createElement('li');
+            li.className = 'places_list';
+            li.innerHTML = '<button class="action place" type="button" data-value="' + sede + '" data-name="' + sede +
+                           '" onclick="selectGroup(this)">' + sede + '</button>';
+            lista.appendChild(li);
+        });
+        document.getElementById('group_section').style.display = 'block';
+    });
+}
+
+function selectGroup(boton) {
+    estado.sede = boton.getAttribute('data-value');
+    document.getElementById('selected_place').textContent = estado.sede;
+    document.getElementById('groups_drop').classList.remove('show');
+    api('/api/profesionales', {service: estado.subservicio, place: estado.sede}).then(function (datos) {
+        var lista = document.getElementById('professional');
+        lista.innerHTML = '';
+        datos.profesionales.forEach(function (nombre) {
+            var li = document.createElement('li');
+            li.className = 'professionals_list';
+            li.innerHTML = '<button class="action professional" type="button" data-value="' + nombre + '" data-name="' +
+                           nombre + '" onclick="selectProfessional(this)">' + nombre + '</button>';
+            lista.appendChild(li);
+        });
+        document.getElementById('professional_section').style.display = 'block';
+    });
+}
+
+function selectProfessional(boton) {
+    estado.profesional = boton.getAttribute('data-value');
+    document.getElementById('selected_professional').textContent = estado.profesional;
+    document.getElementById('professional_drop').classList.remove('show');
+    api('/api/horarios', {service: estado.subservicio, place: estado.sede, professional: estado.profesional})
+        .then(function (datos) {
+            var lista = document.getElementById('schedule_list');
+            lista.innerHTML = '';
+            datos.horarios.forEach(function (cupo) {
+                var li = document.createElement('li');
+                li.className = 'schedule_item';
+                li.innerHTML = '<button class="action schedule" type="button" data-slot_id="' + cupo.id +
+                               '" data-date="' + cupo.fecha + '" data-time="' + cupo.hora +
+                               '" data-professional="' + cupo.profesional + '" data-place="' + cupo.sede + '">' +
+                               cupo.fecha + ' ' + cupo.hora + ' - ' + cupo.profesional + '</button>';
+                lista.appendChild(li);
+            });
+            document.getElementById('schedule_empty').style.display = datos.horarios.length ? 'none' : 'block';
+            document.getElementById('schedule_section').style.display = 'block';
+        });
+}
+
+function construirWidget() {
+    var html = '<div class="dropdown">' +
+        '<button id="button_service" class="dropbtn" type="button" onclick="showList(\'services_drop\')">' +
+        '<span id="selected_service">Clic para seleccionar</span></button>' +
+        '<div id="services_drop" class="dropdown-content"><ul id="service_list">';
+    CONFIG_REPLICA.servicios.forEach(function (servicio) {
+        html += '<li class="subtitle"><button class="action service" type="button" data-value="' + servicio.id +
+                '" data-name="' + servicio.nombre + '" onclick="showServiceOptionSelected(this)">' + servicio.nombre +
+                '</button><ul class="submenu" data-parent_id="' + servicio.id + '">';
+        servicio.subservicios.forEach(function (sub) {
+            html += '<li class="submenu_item"><button class="subservice_item service" type="button" data-value="' +
+                    sub.id + '" data-parent_id="' + servicio.id + '" onclick="selectSubservice(this)">' + sub.nombre +
+                    '</button></li>';
+        });
+        html += '</ul></li>';
+    });
+    html += '</ul></div></div>' +
+        '<button id="btn_search" class="btn search" type="button" style="background-color: rgb(158, 19, 43)" ' +
+        'onclick="buscar()">Buscar</button>' +
+        '<div id="group_section"><div class="dropdown">' +
+        '<button id="group_button" class="dropbtn" type="button" onclick="showGroups(\'groups_drop\')">' +
+        '<span id="selected_place">Seleccione una sede</span></button>' +
+        '<div id="groups_drop" class="dropdown-content"><div id="group_dropdown_list"><ul id="group"></ul></div></div>' +
+        '</div></div>' +
+        '<div id="professional_section"><div class="dropdown">' +
+        '<button id="professional_button" class="dropbtn" type="button" ' +
+        'onclick="showProfessionals(\'professional_drop\')">' +
+        '<span id="selected_professional">Seleccione un profesional</span></button>' +
+        '<div id="professional_drop" class="dropdown-content"><div id="professional_dropdown_list">' +
+        '<ul id="professional"></ul></div></div></div></div>' +
+        '<div id="schedule_section"><p id="schedule_empty">No hay agenda disponible.</p>' +
+        '<ul id="schedule_list"></ul></div>';
+    document.getElementById('booking_widget').innerHTML = html;
+}
+
+conRetraso(CONFIG_REPLICA.retrasos.widget, construirWidget);
+"""
+
+def leer_parametros(query, base):
+    """Combina la configuración del servidor con los parámetros de la query string"""
+    parametros = urllib.parse.parse_qs(query)
+
+    def valor(nombre, defecto):
+        return parametros[nombre][0] if nombre in parametros else defecto
+
+    retrasos = {clave: int(valor(clave, ms)) for clave, ms in base["retrasos"].items()}
+    return {
+        "iframe": valor("iframe", "1" if base["iframe"] else "0") == "1",
+        "cupos": int(valor("cupos", base["cupos"])),
+        "retrasos": retrasos,
+    }
+
+def generar_horarios(cupos, sede, profesional, semilla):
+    """Cupos ficticios pero estables para la misma búsqueda"""
+    aleatorio = random.Random(semilla)
+    profesionales = profesionales_replica[1:] if profesional == "Cualquier profesional" else [profesional]
+    horarios = []
+    for i in range(cupos):
+        fecha = date.today() + timedelta(days=aleatorio.randint(1, 60))
+        hora = f"{aleatorio.randint(7, 16):02d}:{aleatorio.choice(['00', '20', '40'])}"
+        horarios.append({"id": f"R{semilla % 10000:04d}{i:02d}", "fecha": fecha.isoformat(), "hora": hora,
+                         "profesional": aleatorio.choice(profesionales), "sede": sede})
+    return sorted(horarios, key=lambda cupo: (cupo["fecha"], cupo["hora"]))
+
+class ManejadorReplica(BaseHTTPRequestHandler):
+    """Atiende la página, el widget y las respuestas JSON de la réplica"""
+    protocol_version = "HTTP/1.1"  # Conexiones keep-alive, como el sitio real
+
+    def setup(self):
+        super().setup()
+        with self.server.bloqueo:
+            self.server.conexiones += 1
+
+    def log_message(self, formato, *args):
+        logger.debug("réplica: " + formato, *args)
+
+    def responder(self, contenido, tipo="text/html; charset=utf-8", estado=200):
+        datos = contenido.encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(datos)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        config = leer_parametros(url.query, self.server.config)
+        ruta = url.path.rstrip("/") or "/"
+
+        if ruta in ("/", "/solicitar-cita"):
+            if config["iframe"]:
+                contenido = f'<iframe id="booking_frame" name="booking_frame" src="/widget/?{url.query}"></iframe>'
+            else:
+                contenido = self.html_widget(url.query, config, completo=False)
+            self.responder(pagina_principal.replace("__CONTENIDO__", contenido))
+        elif ruta == "/widget":
+            self.responder(self.html_widget(url.query, config, completo=True))
+        elif ruta.startswith("/api/"):
+            self.responder_api(ruta, urllib.parse.parse_qs(url.query), config)
+        else:
+            self.responder("No encontrado", "text/plain; charset=utf-8", 404)
+
+    def html_widget(self, query, config, completo):
+        """Widget completo (para el iframe) o incrustado en la página principal"""
+        datos = {"retrasos": config["retrasos"], "servicios": catalogo_servicios, "query": query}
+        if completo:
+            return (pagina_widget.replace("__ESTILOS__", estilos_widget)
+                    .replace("__CONFIG__", json.dumps(datos, ensure_ascii=False))
+                    .replace("__SCRIPT__", script_widget))
+        return (estilos_widget + '<div id="booking_widget"></div>'
+                f"<script>var CONFIG_REPLICA = {json.dumps(datos, ensure_ascii=False)};</script>"
+                f"<script>{script_widget}</script>")
+
+    def responder_api(self, ruta, parametros, config):
+        def valor(nombre):
+            return parametros.get(nombre, [""])[0]
+
+        if ruta == "/api/buscar":
+            time.sleep(config["retrasos"]["busqueda"] / 1000)
+            respuesta = {"sedes": sedes_replica}
+        elif ruta == "/api/profesionales":
+            time.sleep(config["retrasos"]["profesionales"] / 1000)
+            respuesta = {"profesionales": profesionales_replica}
+        elif ruta == "/api/horarios":
+            time.sleep(config["retrasos"]["horarios"] / 1000)
+            semilla = sum(map(ord, valor("service") + valor("place") + valor("professional")))
+            respuesta = {"horarios": generar_horarios(config["cupos"], valor("place"), valor("professional"), semilla)}
+        else:
+            self.responder(json.dumps({"error": "ruta desconocida"}), "application/json", 404)
+            return
+        self.responder(json.dumps(respuesta, ensure_ascii=False), "application/json; charset=utf-8")
+
+def crear_servidor_replica(puerto=0, iframe=False, retrasos=None, cupos=3, host="127.0.0.1"):
+    """Crea el servidor de la réplica (puerto 0 = uno libre cualquiera)"""
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorReplica)
+    servidor.daemon_threads = True
+    servidor.config = {"iframe": iframe, "cupos": cupos, "retrasos": {**retrasos_por_defecto, **(retrasos or {})}}
+    servidor.conexiones = 0  # Conexiones TCP aceptadas (para comprobar la reutilización keep-alive)
+    servidor.bloqueo = threading.Lock()
+    return servidor
+
+def iniciar_replica_en_hilo(**kwargs):
+    """Arranca la réplica en segundo plano; devuelve (servidor, url de solicitar-cita)"""
+    servidor = crear_servidor_replica(**kwargs)
+    threading.Thread(target=servidor.serve_forever, name="replica_widget", daemon=True).start()
+    host, puerto = servidor.server_address[:2]
+    return servidor, f"http://{host}:{puerto}/solicitar-cita/"
+
+# SONDA HTTP CONTRA LA RÉPLICA
+# sondear_disponibilidad_http (formulario_cita) apuntada a /api/buscar y /api/horarios de la
+# réplica: la ruta JSON "horarios" es no vacía con cupos y vacía con cupos=0, así que se pueden
+# probar ambos resultados y el pool de conexiones sin tocar el sitio real.
+def config_sonda_replica(url_base, cupos=None):
+    """Configuración de la sonda para la réplica en url_base (cupos fuerza los de /api/horarios)"""
+    horarios = {"service": "{subconsulta}", "place": "{ciudad}", "professional": "Cualquier profesional"}
+    if cupos is not None:
+        horarios["cupos"] = str(cupos)
+    return {
+        "peticiones": [
+            {"metodo": "GET", "url": f"{url_base}/api/buscar", "datos": {"service": "{subconsulta}"}},
+            {"metodo": "GET", "url": f"{url_base}/api/horarios", "datos": horarios},
+        ],
+        "disponible_si": {"json": "horarios"},
+    }
+
+def verificar_sonda():
+    """Corre la sonda contra una réplica sin retrasos: True con cupos, False sin ellos y una sola
+    conexión para todas las peticiones. Devuelve True si todo se cumple"""
+    import formulario_cita  # Solo aquí: servir la réplica no requiere Selenium
+
+    servidor, url = iniciar_replica_en_hilo(retrasos={clave: 0 for clave in retrasos_por_defecto})
+    url_base = url.rsplit("/solicitar-cita/", 1)[0]
+    try:
+        formulario_cita.cerrar_conexiones_sonda()
+        resultados = {
+            "con cupos": formulario_cita.sondear_disponibilidad_http(config=config_sonda_replica(url_base, cupos=3)),
+            "sin cupos": formulario_cita.sondear_disponibilidad_http(config=config_sonda_replica(url_base, cupos=0)),
+        }
+        conexiones = servidor.conexiones
+    finally:
+        formulario_cita.cerrar_conexiones_sonda()
+        servidor.shutdown()
+        servidor.server_close()
+
+    correcto = resultados == {"con cupos": True, "sin cupos": False} and conexiones == 1
+    logger.info(f"{'✅' if correcto else '❌'} Sonda contra la réplica: {resultados}, "
+                f"{conexiones} conexión(es) para 4 peticiones")
+    return correcto
+
+def main():
+    parser = argparse.ArgumentParser(description="Réplica local del widget de solicitar-cita")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--iframe", action="store_true", help="Servir el widget dentro de un iframe")
+    parser.add_argument("--cupos", type=int, default=3, help="Cupos que devuelve la búsqueda (0 = sin agenda)")
+    for clave, ms in retrasos_por_defecto.items():
+        parser.add_argument(f"--retraso-{clave}", type=int, default=ms, help=f"Retraso de {clave} en ms")
+    parser.add_argument("--config-sonda", help="Guardar aquí la configuración de la sonda HTTP para esta réplica")
+    parser.add_argument("--verificar-sonda", action="store_true",
+                        help="Comprobar la sonda HTTP de formulario_cita contra la réplica y salir")
+    args = parser.parse_args()
+
+    if args.verificar_sonda:
+        raise SystemExit(0 if verificar_sonda() else 1)
+
+    retrasos = {clave: getattr(args, f"retraso_{clave}") for clave in retrasos_por_defecto}
+    servidor = crear_servidor_replica(args.puerto, args.iframe, retrasos, args.cupos, args.host)
+    if args.config_sonda:
+        with open(args.config_sonda, "w", encoding="utf-8") as archivo:
+            json.dump(config_sonda_replica(f"http://{args.host}:{servidor.server_address[1]}"), archivo,
+                      ensure_ascii=False, indent=2)
+        logger.info(f"🔎 Configuración de la sonda en {args.config_sonda} (CITAS_SONDA_CONFIG)")
+    logger.info(f"🧪 Réplica del widget en http://{args.host}:{servidor.server_address[1]}/solicitar-cita/ "
+                f"({'en iframe' if args.iframe else 'en la página'}, retrasos {retrasos})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("🛑 Réplica detenida")
+    finally:
+        servidor.server_close()
+
+if __name__ == "__main__":
+    main()